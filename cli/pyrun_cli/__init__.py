@@ -9,6 +9,7 @@
 """
 # Public API
 from pyrun_cli import main # noqa
+from pyrun_cli.main import PyRunCLI, entry_point # noqa
 
 # Version
 __version__ = '0.1.0.dev1'
@@ -13,4 +13,4 @@ from pyrun_cli import entry_point
 ###
 
 if __name__ == '__main__':
-    entry_point(sys.argv)
+    sys.exit(entry_point(sys.argv))
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.bytecode - Byte compile installed modules
+
+    Compiles Python modules to .pyc files using the target PyRun
+    interpreter (the .pyc format depends on the Python version), in
+    parallel. Modules are compiled to unchecked hash based .pyc files
+    (PEP 552): these are used without checking the source file, which
+    avoids the stat() calls on imports and works for read-only file
+    systems, where missing .pyc files would otherwise be recompiled in
+    memory on every run.
+
+    Note: Unchecked .pyc files are not updated when the source files
+    change, so they should only be used for immutable installations.
+
+    Modules can also be compiled into a bytecode cache dir, which PyRun
+    uses as sys.pycache_prefix when PYRUN_PYCACHE is set, e.g. to
+    pre-populate a cache shared by many containers.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import json
+import time
+import fnmatch
+import subprocess
+import concurrent.futures
+
+### Globals
+
+# Optimization levels to compile for (see makepyrun.compile_module())
+OPTIMIZATION_LEVELS = (0, 1, 2)
+
+DEFAULT_JOBS = os.cpu_count() or 4
+
+# Invalidation modes (names of py_compile.PycInvalidationMode members)
+UNCHECKED_HASH = 'UNCHECKED_HASH'
+CHECKED_HASH = 'CHECKED_HASH'
+TIMESTAMP = 'TIMESTAMP'
+
+# Command line names of the invalidation modes
+INVALIDATION_MODES = {
+    'unchecked-hash': UNCHECKED_HASH,
+    'checked-hash': CHECKED_HASH,
+    'timestamp': TIMESTAMP,
+}
+
+# Scripts run by the target interpreter
+INFO_SCRIPT = """\
+import sys, json
+sys.stdout.write(json.dumps({
+    'version': list(sys.version_info[:2]),
+    'cache_tag': getattr(getattr(sys, 'implementation', None),
+                         'cache_tag', None),
+}))
+"""
+
+COMPILE_SCRIPT = """\
+import sys, json, py_compile
+request = json.loads(sys.stdin.read())
+mode = py_compile.PycInvalidationMode[request['mode']]
+errors = []
+for source, cfile, optimize, dfile in request['tasks']:
+    try:
+        py_compile.compile(source, cfile=cfile, dfile=dfile, doraise=True,
+                           optimize=optimize, invalidation_mode=mode)
+    except (py_compile.PyCompileError, OSError) as reason:
+        errors.append([source, str(reason).strip()])
+sys.stdout.write(json.dumps(errors))
+"""
+
+### Errors
+
+class BytecodeError(Exception):
+
+    """ Error raised when byte compiling modules.
+
+    """
+    pass
+
+### Helpers
+
+def cache_path(source, cache_tag, optimization=0, prefix=None):
+
+    """ Return the .pyc path of the source file for the interpreter
+        cache_tag and optimization level.
+
+        If prefix is given, the path is placed under this bytecode
+        cache prefix (sys.pycache_prefix), instead of the __pycache__
+        dir next to source. This mirrors
+        importlib.util.cache_from_source().
+
+    """
+    head, tail = os.path.split(source)
+    name = '%s.%s%s.pyc' % (
+        os.path.splitext(tail)[0],
+        cache_tag,
+        '.opt-%i' % optimization if optimization else '')
+    if prefix is None:
+        return os.path.join(head, '__pycache__', name)
+    head = os.path.abspath(head).lstrip(os.sep)
+    return os.path.join(prefix, head, name)
+
+def legacy_path(source):
+
+    """ Return the path of the .pyc file used for imports when there
+        is no source file.
+
+    """
+    return os.path.splitext(source)[0] + '.pyc'
+
+def parse_levels(text):
+
+    """ Return the tuple of optimization levels given as comma separated
+        list in text.
+
+    """
+    try:
+        levels = tuple(int(level) for level in text.split(','))
+    except ValueError:
+        levels = ()
+    if not levels or not set(levels) <= set(OPTIMIZATION_LEVELS):
+        raise BytecodeError('invalid optimization levels %r' % text)
+    return levels
+
+def find_sources(directory):
+
+    """ Return the sorted list of .py files in directory (recursively).
+
+    """
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        if '__pycache__' in dirnames:
+            dirnames.remove('__pycache__')
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                sources.append(os.path.join(dirpath, filename))
+    return sources
+
+def find_installation(target, python=None):
+
+    """ Return (python, site_packages) for target, which may either be
+        a PyRun installation dir or a site-packages dir.
+
+        python defaults to bin/pyrun of the installation.
+
+    """
+    target = os.path.abspath(target)
+    if not os.path.isdir(target):
+        raise BytecodeError('%s is not a directory' % target)
+    lib_dir = os.path.join(target, 'lib')
+    if os.path.isdir(lib_dir):
+        for name in sorted(os.listdir(lib_dir)):
+            path = os.path.join(lib_dir, name, 'site-packages')
+            if name.startswith('python') and os.path.isdir(path):
+                site_packages = path
+                prefix = target
+                break
+        else:
+            raise BytecodeError('no site-packages dir found in %s' % target)
+    else:
+        # site-packages dir of an installation: <prefix>/lib/pythonX.Y/
+        # site-packages
+        site_packages = target
+        prefix = os.path.dirname(os.path.dirname(os.path.dirname(target)))
+    if python is None:
+        python = os.path.join(prefix, 'bin', 'pyrun')
+        if not os.path.exists(python):
+            raise BytecodeError('PyRun interpreter %s not found; please '
+                                'specify the interpreter to use' % python)
+    return python, site_packages
+
+###
+
+class BytecodeCompiler:
+
+    """ Compile modules using the Python interpreter python, running
+        jobs processes in parallel.
+
+    """
+    def __init__(self, python, jobs=DEFAULT_JOBS, log=None):
+
+        self.python = python
+        self.jobs = max(1, jobs)
+        self.log = log or (lambda message: None)
+        self._info = None
+
+    def run_script(self, script, input_data=None):
+
+        try:
+            result = subprocess.run(
+                [self.python, '-c', script],
+                input=input_data,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except OSError as reason:
+            raise BytecodeError('cannot run %s: %s' % (self.python, reason))
+        if result.returncode != 0:
+            raise BytecodeError('%s failed: %s' % (
+                self.python,
+                result.stderr.decode('utf-8', 'replace').strip()))
+        return json.loads(result.stdout.decode('utf-8'))
+
+    @property
+    def info(self):
+
+        """ Dict with version and cache_tag of the interpreter.
+
+        """
+        if self._info is None:
+            info = self.run_script(INFO_SCRIPT)
+            if tuple(info['version']) < (3, 7):
+                raise BytecodeError('%s: hash based .pyc files need '
+                                    'Python 3.7+' % self.python)
+            self._info = info
+        return self._info
+
+    @property
+    def cache_tag(self):
+
+        return self.info['cache_tag']
+
+    def compile(self, tasks, mode=UNCHECKED_HASH):
+
+        """ Compile the list of tasks (source, cfile, optimization level,
+            dfile), using the invalidation mode. dfile is the file name
+            used in tracebacks (None: use source).
+
+            The tasks are distributed to .jobs interpreter processes;
+            tasks for the same source should be adjacent, so that
+            they end up in the same process.
+
+            Raises a BytecodeError, if modules fail to compile.
+
+        """
+        # Check the interpreter version
+        self.info
+        if not tasks:
+            return
+        batch_size = -(-len(tasks) // self.jobs)
+        batches = [tasks[i:i + batch_size]
+                   for i in range(0, len(tasks), batch_size)]
+
+        def compile_batch(batch):
+            request = json.dumps({'mode': mode, 'tasks': batch})
+            return self.run_script(COMPILE_SCRIPT, request.encode('utf-8'))
+
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            for batch_errors in executor.map(compile_batch, batches):
+                errors.extend(batch_errors)
+        if errors:
+            raise BytecodeError('%i modules failed to compile:\n%s' % (
+                len(errors),
+                '\n'.join('%s: %s' % tuple(error) for error in errors)))
+
+def optimize_site(site_packages, compiler, levels=OPTIMIZATION_LEVELS,
+                  strip_sources=False, keep_sources=(), log=None):
+
+    """ Compile all modules in site_packages to unchecked hash based
+        .pyc files for the optimization levels, using the
+        BytecodeCompiler compiler.
+
+        With strip_sources, the .py files are removed (except for
+        those matching one of the fnmatch patterns in keep_sources,
+        relative to site_packages). Imports without source files only
+        use .pyc files next to the (removed) source files, so these
+        are compiled for the first of the levels only.
+
+        Returns a dict with information about the result.
+
+    """
+    log = log or (lambda message: None)
+    start_time = time.time()
+    cache_tag = compiler.cache_tag
+    tasks = []
+    stripped = []
+    sources = find_sources(site_packages)
+    for source in sources:
+        relpath = os.path.relpath(source, site_packages).replace(os.sep, '/')
+        if (strip_sources and
+            not any(fnmatch.fnmatch(relpath, pattern)
+                    for pattern in keep_sources)):
+            tasks.append((source, legacy_path(source), levels[0], None))
+            stripped.append(source)
+        else:
+            for level in levels:
+                tasks.append((source, cache_path(source, cache_tag, level),
+                              level, None))
+    log('Compiling %i modules for optimization levels %s using %s' % (
+        len(sources), ', '.join(str(level) for level in levels),
+        compiler.python))
+    compiler.compile(tasks)
+    for source in stripped:
+        os.remove(source)
+        # Cached .pyc files are not used without source file
+        for level in OPTIMIZATION_LEVELS:
+            cfile = cache_path(source, cache_tag, level)
+            if os.path.exists(cfile):
+                os.remove(cfile)
+        cache_dir = os.path.join(os.path.dirname(source), '__pycache__')
+        if os.path.isdir(cache_dir) and not os.listdir(cache_dir):
+            os.rmdir(cache_dir)
+    return {
+        'site_packages': site_packages,
+        'python': compiler.python,
+        'cache_tag': cache_tag,
+        'levels': list(levels),
+        'modules': len(sources),
+        'pyc_files': len(tasks),
+        'stripped': len(stripped),
+        'seconds': round(time.time() - start_time, 3),
+    }
+
+def map_sources(path, runtime_path):
+
+    """ Return a list of (source, runtime source path) tuples for the
+        .py files in path (a file or dir), which is available as
+        runtime_path when running the application (e.g. in a container
+        image).
+
+    """
+    if os.path.isfile(path):
+        return [(path, runtime_path)]
+    return [(source,
+             os.path.join(runtime_path, os.path.relpath(source, path)))
+            for source in find_sources(path)]
+
+def fill_pycache(directory, sources, compiler, levels=OPTIMIZATION_LEVELS,
+                 mode=CHECKED_HASH, log=None):
+
+    """ Compile the list of (source, runtime source path) tuples sources
+        into the bytecode cache directory, using the BytecodeCompiler
+        compiler.
+
+        The .pyc files are placed where Python looks for them when
+        using directory as sys.pycache_prefix (e.g. via PYRUN_PYCACHE)
+        and importing the files from the runtime paths. The default
+        invalidation mode checks the source hash, which works
+        independently of file time stamps (e.g. in images) and for
+        caches shared by different versions of an application.
+
+        Returns a dict with information about the result.
+
+    """
+    log = log or (lambda message: None)
+    start_time = time.time()
+    if tuple(compiler.info['version']) < (3, 8):
+        raise BytecodeError('%s: bytecode cache dirs need Python 3.8+' %
+                            compiler.python)
+    cache_tag = compiler.cache_tag
+    tasks = []
+    for source, runtime_path in sources:
+        for level in levels:
+            tasks.append((source,
+                          cache_path(runtime_path, cache_tag, level,
+                                     prefix=directory),
+                          level,
+                          runtime_path))
+    log('Compiling %i modules into the bytecode cache %s' % (
+        len(sources), directory))
+    compiler.compile(tasks, mode=mode)
+    return {
+        'pycache': directory,
+        'python': compiler.python,
+        'cache_tag': cache_tag,
+        'levels': list(levels),
+        'modules': len(sources),
+        'pyc_files': len(tasks),
+        'seconds': round(time.time() - start_time, 3),
+    }
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.cache - Content addressed download cache
+
+    The cache stores files by their SHA-256 hash in
+    <cache>/sha256/<2 hex chars>/<62 hex chars> and maps file names
+    (e.g. wheel or PyRun distribution file names) to hashes via small
+    files in <cache>/names/. All writes are done via temporary files
+    and atomic renames, so that many processes can share one cache
+    (e.g. on a volume mounted into many containers).
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import hashlib
+import tempfile
+
+### Globals
+
+# Chunk size used for copying and hashing files
+CHUNK_SIZE = 1 << 20
+
+### Errors
+
+class CacheError(Exception):
+
+    """ Error raised by the cache, e.g. for hash mismatches.
+
+    """
+    pass
+
+### Helpers
+
+def default_cache_dir():
+
+    """ Return the default cache dir: $PYRUN_CACHE or
+        $XDG_CACHE_HOME/pyrun (defaults to ~/.cache/pyrun).
+
+    """
+    path = os.environ.get('PYRUN_CACHE')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyrun')
+
+def file_hash(path):
+
+    """ Return the SHA-256 hex digest of the file path.
+
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def check_filename(filename):
+
+    """ Make sure that filename is a plain file name (without path
+        components) and return it.
+
+    """
+    if (not filename or
+        os.path.basename(filename) != filename or
+        filename in ('.', '..')):
+        raise CacheError('invalid file name %r' % filename)
+    return filename
+
+###
+
+class ContentCache:
+
+    """ Content addressed file cache in directory.
+
+    """
+    def __init__(self, directory):
+
+        self.directory = os.path.abspath(directory)
+
+    def blob_path(self, sha256):
+
+        """ Return the path of the blob with the hash sha256 (the file
+            may not exist).
+
+        """
+        sha256 = sha256.lower()
+        return os.path.join(self.directory, 'sha256', sha256[:2], sha256[2:])
+
+    def name_path(self, filename):
+
+        """ Return the path of the name file mapping filename to its
+            hash.
+
+        """
+        return os.path.join(self.directory, 'names', check_filename(filename))
+
+    def get(self, sha256):
+
+        """ Return the path of the blob with the hash sha256 or None, if
+            it is not in the cache.
+
+        """
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            return path
+        return None
+
+    def lookup(self, filename):
+
+        """ Return (path, sha256) of the cached file filename or
+            (None, None), if it is not in the cache.
+
+        """
+        try:
+            with open(self.name_path(filename)) as f:
+                sha256 = f.read().strip()
+        except (IOError, OSError):
+            return None, None
+        path = self.get(sha256)
+        if path is None:
+            return None, None
+        return path, sha256
+
+    def names(self):
+
+        """ Return the list of file names known to the cache.
+
+        """
+        try:
+            filenames = os.listdir(os.path.join(self.directory, 'names'))
+        except OSError:
+            return []
+        return sorted(filename
+                      for filename in filenames
+                      if not filename.startswith('.'))
+
+    def _write_atomic(self, path, write):
+
+        """ Write the file path by calling write(fileobj) on a temporary
+            file, which is then renamed to path.
+
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                result = write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return result
+
+    def add_stream(self, stream, filename, sha256=None):
+
+        """ Add the data read from the file object stream to the cache
+            under the name filename and return (path, sha256) of the
+            cached blob.
+
+            If sha256 is given, the data is verified against it and a
+            CacheError is raised, if it doesn't match.
+
+        """
+        check_filename(filename)
+        tmp_dir = os.path.join(self.directory, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=tmp_dir, prefix='.tmp-')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+            actual = digest.hexdigest()
+            if sha256 is not None and actual != sha256.lower():
+                raise CacheError('hash mismatch for %s: expected %s, got %s' %
+                                 (filename, sha256, actual))
+            path = self.blob_path(actual)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._write_atomic(self.name_path(filename),
+                           lambda f: f.write(actual.encode('ascii') + b'\n'))
+        return path, actual
+
+    def add_file(self, source, filename=None, sha256=None):
+
+        """ Add the file source to the cache under the name filename
+            (defaults to the base name of source) and return (path,
+            sha256) of the cached blob.
+
+        """
+        if filename is None:
+            filename = os.path.basename(source)
+        with open(source, 'rb') as f:
+            return self.add_stream(f, filename, sha256)
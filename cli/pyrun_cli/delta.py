@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.delta - Binary delta updates for PyRun binaries
+
+    Creates and applies binary deltas between two versions of a file,
+    e.g. a PyRun runtime or a PyRun app binary (PyRun with an appended
+    ZIP file), so that updates only need to transfer the changes.
+
+    Both files are first split into named segments following the
+    PyRun binary layout:
+
+    * the ELF header, each ELF section and the section header table
+    * the frozen modules (the _Py_M_<module> arrays referenced by the
+      frozen module table), if the binary has a symbol table
+    * the members and the central directory of an appended ZIP file
+
+    Segments are then compared with the segment of the same name in
+    the old file: unchanged segments are copied, segments of the same
+    size are stored as XOR difference (which is mostly zeros for e.g.
+    shifted addresses in .text and .data) and other segments are split
+    into content defined chunks, so that unchanged chunks are copied
+    even when data was inserted or removed. The operations are
+    compressed with LZMA.
+
+    Deltas store the size and SHA-256 hash of the old and the new
+    file. Applying a delta checks both, so an update either results in
+    exactly the new file or fails.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import json
+import lzma
+import time
+import struct
+import hashlib
+import tempfile
+
+from pyrun_cli import elf
+
+### Globals
+
+# Delta file format
+MAGIC = b'PYRUN-DELTA\n'
+FORMAT_VERSION = 1
+
+# Operations
+OP_COPY = b'C'  # copy size bytes from the old file at offset
+OP_XOR = b'X'   # XOR size bytes from the old file at offset with data
+OP_DATA = b'D'  # new data
+
+# Content defined chunking parameters (gear hash, see FastCDC); the
+# average chunk size is about MIN_CHUNK + 2**CHUNK_BITS
+MIN_CHUNK = 256
+MAX_CHUNK = 8192
+CHUNK_BITS = 10
+CHUNK_MASK = ((1 << CHUNK_BITS) - 1) << (64 - CHUNK_BITS)
+GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes((i,))).digest()[:8], 'little')
+    for i in range(256))
+
+# Minimum ratio of zero bytes in a XOR difference for using it instead
+# of storing the new data
+XOR_MIN_ZEROS = 0.5
+
+# New segments larger than this factor times the size of the old
+# segment of the same name are compared to the complete old file
+SEGMENT_SIZE_FACTOR = 4
+
+# Prefix of the frozen module array symbols (see freeze/makefreeze.py)
+FROZEN_SYMBOL_PREFIX = '_Py_M_'
+
+# ZIP file signatures
+ZIP_END_SIGNATURE = b'PK\x05\x06'
+ZIP_DIR_SIGNATURE = b'PK\x01\x02'
+
+DEFAULT_COMPRESS_PRESET = 9
+
+### Errors
+
+class DeltaError(Exception):
+
+    """ Error raised when creating or applying deltas.
+
+    """
+    pass
+
+### Helpers
+
+def sha256_hash(data):
+
+    return hashlib.sha256(data).hexdigest()
+
+def xor_bytes(data, other):
+
+    """ Return the XOR of the equally sized bytes data and other.
+
+    """
+    size = len(data)
+    return (int.from_bytes(data, 'little') ^
+            int.from_bytes(other, 'little')).to_bytes(size, 'little')
+
+def chunk_boundaries(data):
+
+    """ Return the list of content defined chunk end offsets of data.
+
+    """
+    gear = GEAR
+    mask = CHUNK_MASK
+    size = len(data)
+    boundaries = []
+    start = 0
+    while start < size:
+        end = min(start + MAX_CHUNK, size)
+        boundary = end
+        # The hash only depends on the last 64 bytes, so hashing can
+        # start shortly before the minimum chunk size
+        hash = 0
+        for i in range(max(start, start + MIN_CHUNK - 64),
+                       min(start + MIN_CHUNK, end)):
+            hash = ((hash << 1) + gear[data[i]]) & 0xFFFFFFFFFFFFFFFF
+        for i in range(start + MIN_CHUNK, end):
+            hash = ((hash << 1) + gear[data[i]]) & 0xFFFFFFFFFFFFFFFF
+            if not hash & mask:
+                boundary = i + 1
+                break
+        boundaries.append(boundary)
+        start = boundary
+    return boundaries
+
+def zip_segments(data, start):
+
+    """ Return a list of (name, start, end) segments for a ZIP file
+        stored in data at or after offset start, or an empty list, if
+        no ZIP file is found.
+
+    """
+    end_record = data.rfind(ZIP_END_SIGNATURE, max(start, len(data) - 65557))
+    if end_record < 0 or end_record + 22 > len(data):
+        return []
+    entries, directory_size, directory_offset = struct.unpack_from(
+        '<HII', data, end_record + 10)
+    directory_start = end_record - directory_size
+    # ZIP offsets are either relative to the start of the ZIP file,
+    # which may have been appended to other data, or to the start of
+    # data
+    zip_start = directory_start - directory_offset
+    if directory_start < start or zip_start < 0:
+        return []
+    members = []
+    offset = directory_start
+    for i in range(entries):
+        if data[offset:offset + 4] != ZIP_DIR_SIGNATURE:
+            return []
+        (name_size, extra_size, comment_size) = struct.unpack_from(
+            '<HHH', data, offset + 28)
+        local_offset = struct.unpack_from('<I', data, offset + 42)[0]
+        name = data[offset + 46:offset + 46 + name_size].decode(
+            'utf-8', 'surrogateescape')
+        if zip_start + local_offset < start:
+            return []
+        members.append((zip_start + local_offset, name))
+        offset += 46 + name_size + extra_size + comment_size
+    members.sort()
+    segments = []
+    for i, (member_start, name) in enumerate(members):
+        if i + 1 < len(members):
+            member_end = members[i + 1][0]
+        else:
+            member_end = directory_start
+        segments.append(('zip:' + name, member_start, member_end))
+    segments.append(('zip:central-directory', directory_start, len(data)))
+    return segments
+
+def section_segments(header, symbols):
+
+    """ Return the list of (name, start, end) segments of the ELF section
+        header, splitting out the frozen module arrays in the list of
+        symbols defined in the section.
+
+    """
+    name = 'section:' + header.name
+    section_end = header.offset + header.size
+    frozen = []
+    for symbol in symbols:
+        start = header.offset + symbol.value - header.addr
+        end = start + symbol.size
+        if header.offset <= start and end <= section_end:
+            frozen.append(
+                (start, end,
+                 'frozen:' + symbol.name[len(FROZEN_SYMBOL_PREFIX):]))
+    frozen.sort()
+    segments = []
+    offset = header.offset
+    for start, end, frozen_name in frozen:
+        if start < offset:
+            # Overlapping symbols (aliases)
+            continue
+        if start > offset:
+            segments.append((name, offset, start))
+        segments.append((frozen_name, start, end))
+        name = 'section:%s:after:%s' % (header.name, frozen_name)
+        offset = end
+    if offset < section_end:
+        segments.append((name, offset, section_end))
+    return segments
+
+def elf_segments(data):
+
+    """ Return a list of (name, start, end) segments of the ELF file
+        data and the end offset of the ELF data.
+
+    """
+    try:
+        elf_file = elf.ELFFile('<data>', data)
+    except (elf.ELFError, ValueError, IndexError, struct.error):
+        return [], 0
+    frozen = {}
+    for symbol in elf_file.symbols():
+        if (symbol.name.startswith(FROZEN_SYMBOL_PREFIX) and
+            symbol.size > 0):
+            frozen.setdefault(symbol.section, []).append(symbol)
+    segments = []
+    for index, header in enumerate(elf_file.section_headers):
+        if header.type == elf.SHT_NOBITS or header.size == 0:
+            continue
+        segments.extend(section_segments(header, frozen.get(index, ())))
+    if elf_file.shnum:
+        segments.append(('elf:section-headers',
+                         elf_file.shoff,
+                         elf_file.shoff +
+                         elf_file.shnum * elf_file.shentsize))
+    return segments, elf_file.end_offset
+
+def file_segments(data):
+
+    """ Split data into a list of (name, start, end) segments, following
+        the layout of PyRun binaries.
+
+        The segments cover data without gaps or overlaps; segment
+        names are unique.
+
+    """
+    segments, elf_end = elf_segments(data)
+    segments.extend(zip_segments(data, elf_end))
+    segments.sort(key=lambda segment: segment[1])
+    result = []
+    names = set()
+
+    def add(name, start, end):
+        unique_name = name
+        i = 1
+        while unique_name in names:
+            i += 1
+            unique_name = '%s#%i' % (name, i)
+        names.add(unique_name)
+        result.append((unique_name, start, end))
+
+    offset = 0
+    for name, start, end in segments:
+        if start < offset or end > len(data) or start == end:
+            continue
+        if start > offset:
+            add('gap:' + (result[-1][0] if result else 'start'),
+                offset, start)
+        add(name, start, end)
+        offset = end
+    if offset < len(data):
+        add('gap:' + (result[-1][0] if result else 'start'),
+            offset, len(data))
+    return result
+
+### Delta encoding
+
+class DeltaWriter:
+
+    """ Create the delta operations turning old_data into new_data.
+
+    """
+    def __init__(self, old_data, new_data):
+
+        self.old_data = old_data
+        self.new_data = new_data
+        # List of (op, offset, size or data); data is collected in
+        # bytearrays
+        self.operations = []
+        # Statistics: bytes per operation type
+        self.stats = {'copy': 0, 'xor': 0, 'data': 0}
+        self.changed_segments = []
+        # Chunk index of the complete old file; created on demand
+        self.file_chunks = None
+
+    def copy(self, offset, size):
+
+        self.stats['copy'] += size
+        operations = self.operations
+        if operations and operations[-1][0] == OP_COPY:
+            op, last_offset, last_size = operations[-1]
+            if last_offset + last_size == offset:
+                operations[-1] = (OP_COPY, last_offset, last_size + size)
+                return
+        operations.append((OP_COPY, offset, size))
+
+    def xor(self, offset, data):
+
+        self.stats['xor'] += len(data)
+        operations = self.operations
+        if operations and operations[-1][0] == OP_XOR:
+            op, last_offset, last_data = operations[-1]
+            if last_offset + len(last_data) == offset:
+                last_data.extend(data)
+                return
+        operations.append((OP_XOR, offset, bytearray(data)))
+
+    def data(self, data):
+
+        self.stats['data'] += len(data)
+        operations = self.operations
+        if operations and operations[-1][0] == OP_DATA:
+            operations[-1][2].extend(data)
+        else:
+            operations.append((OP_DATA, None, bytearray(data)))
+
+    def chunk_index(self, start, end):
+
+        """ Return a dict mapping the content defined chunks of the old
+            data start:end to their offsets.
+
+        """
+        if start == 0 and end == len(self.old_data):
+            if self.file_chunks is not None:
+                return self.file_chunks
+        old = self.old_data[start:end]
+        chunks = {}
+        offset = 0
+        for boundary in chunk_boundaries(old):
+            chunks.setdefault(old[offset:boundary], start + offset)
+            offset = boundary
+        if start == 0 and end == len(self.old_data):
+            self.file_chunks = chunks
+        return chunks
+
+    def diff_block(self, offset, data, old_start, old_end):
+
+        """ Add data using a XOR difference with the old data at
+            offset, if possible and useful.
+
+        """
+        size = len(data)
+        if old_start <= offset and offset + size <= old_end:
+            difference = xor_bytes(data, self.old_data[offset:offset + size])
+            if difference.count(0) >= size * XOR_MIN_ZEROS:
+                self.xor(offset, difference)
+                return
+        self.data(data)
+
+    def diff_segment(self, data, old_start, old_end):
+
+        """ Add the operations for the segment data, which replaces
+            the old segment old_start:old_end.
+
+        """
+        old = self.old_data[old_start:old_end]
+        if len(old) == len(data):
+            difference = xor_bytes(data, old)
+            if difference.count(0) >= len(data) * XOR_MIN_ZEROS:
+                self.xor(old_start, difference)
+                return
+        chunks = self.chunk_index(old_start, old_end)
+        # Match the chunks of the new data; unmatched chunks are
+        # compared to the old data following the last match
+        shift = old_start
+        start = 0
+        for end in chunk_boundaries(data):
+            chunk = data[start:end]
+            offset = chunks.get(chunk)
+            if offset is not None:
+                self.copy(offset, len(chunk))
+                shift = offset - start
+            else:
+                self.diff_block(start + shift, chunk, old_start, old_end)
+            start = end
+
+    def run(self):
+
+        """ Create the operations and return them.
+
+        """
+        old_data = self.old_data
+        new_data = self.new_data
+        old_segments = {}
+        old_contents = {}
+        for name, start, end in file_segments(old_data):
+            old_segments[name] = (start, end)
+            old_contents.setdefault(old_data[start:end], start)
+        for name, start, end in file_segments(new_data):
+            data = new_data[start:end]
+            old_start, old_end = old_segments.get(name, (None, None))
+            if old_start is not None and old_data[old_start:old_end] == data:
+                self.copy(old_start, len(data))
+                continue
+            offset = old_contents.get(data)
+            if offset is not None:
+                # Moved or renamed segment
+                self.copy(offset, len(data))
+                continue
+            self.changed_segments.append(name)
+            if (old_start is None or
+                len(data) > SEGMENT_SIZE_FACTOR * (old_end - old_start)):
+                # New segment or the layout changed: compare with the
+                # complete old file
+                old_start = 0
+                old_end = len(old_data)
+            self.diff_segment(data, old_start, old_end)
+        return self.operations
+
+def encode_operations(operations):
+
+    """ Return the binary encoding of the delta operations.
+
+    """
+    parts = []
+    for op, offset, value in operations:
+        if op == OP_COPY:
+            parts.append(op + struct.pack('<QQ', offset, value))
+        elif op == OP_XOR:
+            parts.append(op + struct.pack('<QQ', offset, len(value)))
+            parts.append(value)
+        else:
+            parts.append(op + struct.pack('<Q', len(value)))
+            parts.append(value)
+    return b''.join(parts)
+
+def apply_operations(old_data, operations_data):
+
+    """ Apply the binary encoded delta operations to old_data and return
+        the new data.
+
+    """
+    result = []
+    position = 0
+    size = len(operations_data)
+    while position < size:
+        op = operations_data[position:position + 1]
+        position += 1
+        if op == OP_COPY:
+            offset, length = struct.unpack_from('<QQ', operations_data,
+                                                position)
+            position += 16
+            result.append(old_data[offset:offset + length])
+        elif op == OP_XOR:
+            offset, length = struct.unpack_from('<QQ', operations_data,
+                                                position)
+            position += 16
+            result.append(xor_bytes(old_data[offset:offset + length],
+                                    operations_data[position:
+                                                    position + length]))
+            position += length
+        elif op == OP_DATA:
+            length = struct.unpack_from('<Q', operations_data, position)[0]
+            position += 8
+            result.append(operations_data[position:position + length])
+            position += length
+        else:
+            raise DeltaError('invalid delta operation %r at offset %i' %
+                             (op, position - 1))
+    return b''.join(result)
+
+### Delta files
+
+def write_file_atomic(path, data, mode=None):
+
+    """ Write data to path by writing to a temporary file in the same
+        directory first and then renaming it to path.
+
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.pyrun-delta-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def read_file(path):
+
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError as reason:
+        raise DeltaError('cannot read %s: %s' % (path, reason))
+
+def read_delta(path):
+
+    """ Read the delta file path and return (header, operations data).
+
+    """
+    data = read_file(path)
+    if not data.startswith(MAGIC):
+        raise DeltaError('%s is not a PyRun delta file' % path)
+    offset = len(MAGIC)
+    try:
+        header_size = struct.unpack_from('>I', data, offset)[0]
+        offset += 4
+        header = json.loads(
+            data[offset:offset + header_size].decode('utf-8'))
+    except (struct.error, ValueError) as reason:
+        raise DeltaError('%s: invalid delta header: %s' % (path, reason))
+    if header.get('version') != FORMAT_VERSION:
+        raise DeltaError('%s: unsupported delta format version %r' %
+                         (path, header.get('version')))
+    try:
+        operations = lzma.decompress(data[offset + header_size:])
+    except lzma.LZMAError as reason:
+        raise DeltaError('%s: corrupt delta data: %s' % (path, reason))
+    return header, operations
+
+def create_delta(old, new, output, compress_preset=DEFAULT_COMPRESS_PRESET):
+
+    """ Create the delta file output for updating the file old to the
+        file new.
+
+        Returns a dict with information about the delta.
+
+    """
+    start_time = time.time()
+    old_data = read_file(old)
+    new_data = read_file(new)
+    writer = DeltaWriter(old_data, new_data)
+    operations = encode_operations(writer.run())
+    header = {
+        'version': FORMAT_VERSION,
+        'old_size': len(old_data),
+        'old_sha256': sha256_hash(old_data),
+        'new_size': len(new_data),
+        'new_sha256': sha256_hash(new_data),
+        'new_mode': os.stat(new).st_mode & 0o7777,
+    }
+    header_data = json.dumps(header, sort_keys=True).encode('utf-8')
+    delta_data = b''.join((
+        MAGIC,
+        struct.pack('>I', len(header_data)),
+        header_data,
+        lzma.compress(operations, preset=compress_preset),
+    ))
+    write_file_atomic(output, delta_data)
+    return {
+        'output': output,
+        'size': len(delta_data),
+        'old_sha256': header['old_sha256'],
+        'new_sha256': header['new_sha256'],
+        'new_size': header['new_size'],
+        'changed_segments': writer.changed_segments,
+        'copied': writer.stats['copy'],
+        'xored': writer.stats['xor'],
+        'added': writer.stats['data'],
+        'seconds': round(time.time() - start_time, 3),
+    }
+
+def apply_delta(old, delta, output, sha256=None):
+
+    """ Apply the delta file delta to the file old and write the result
+        to output (which may be the same as old).
+
+        The old file and the result are checked against the hashes
+        stored in the delta. If sha256 is given, the result must also
+        have this SHA-256 hash. Raises a DeltaError in case of
+        mismatches; output is not changed in this case.
+
+        Returns a dict with information about the result.
+
+    """
+    start_time = time.time()
+    header, operations = read_delta(delta)
+    if sha256 is not None and sha256.lower() != header['new_sha256']:
+        raise DeltaError('delta %s does not result in a file with hash %s' %
+                         (delta, sha256))
+    old_data = read_file(old)
+    if (len(old_data) != header['old_size'] or
+        sha256_hash(old_data) != header['old_sha256']):
+        raise DeltaError('%s does not match the delta source file '
+                         '(sha256 %s)' % (old, header['old_sha256']))
+    new_data = apply_operations(old_data, operations)
+    new_hash = sha256_hash(new_data)
+    if new_hash != header['new_sha256']:
+        raise DeltaError('hash mismatch of the result: got %s, expected %s' %
+                         (new_hash, header['new_sha256']))
+    write_file_atomic(output, new_data, mode=header.get('new_mode'))
+    return {
+        'output': output,
+        'size': len(new_data),
+        'sha256': new_hash,
+        'seconds': round(time.time() - start_time, 3),
+    }
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.elf - Minimal ELF reader
+
+    Reads the parts of ELF files needed by pyrun_cli: program and
+    section headers, the symbol table, the dynamic loader (PT_INTERP)
+    and the dynamic section (DT_NEEDED, DT_RPATH, DT_RUNPATH). Also
+    implements the shared library search of the dynamic loader, to
+    determine the shared library closure of a binary.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import glob
+import struct
+import collections
+
+### Globals
+
+ELF_MAGIC = b'\x7fELF'
+
+# Program header types
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+# Section header types
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+
+# Dynamic section tags
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# e_machine to OCI/Go architecture names
+ARCHITECTURES = {
+    3: '386',
+    8: 'mips',
+    20: 'ppc',
+    21: 'ppc64',
+    22: 's390x',
+    40: 'arm',
+    62: 'amd64',
+    183: 'arm64',
+    243: 'riscv64',
+}
+
+# Default library dirs searched by the dynamic loader (after the dirs
+# from /etc/ld.so.conf)
+DEFAULT_LIBRARY_DIRS = (
+    '/lib64',
+    '/usr/lib64',
+    '/lib',
+    '/usr/lib',
+)
+
+ProgramHeader = collections.namedtuple(
+    'ProgramHeader',
+    ('type', 'offset', 'vaddr', 'filesz', 'memsz', 'flags'))
+
+SectionHeader = collections.namedtuple(
+    'SectionHeader',
+    ('name', 'type', 'flags', 'addr', 'offset', 'size', 'link'))
+
+Symbol = collections.namedtuple(
+    'Symbol',
+    ('name', 'value', 'size', 'section'))
+
+### Errors
+
+class ELFError(Exception):
+
+    """ Error raised for invalid or unsupported ELF files.
+
+    """
+    pass
+
+###
+
+class ELFFile:
+
+    """ ELF file header information for the file path.
+
+        If given, data is used as file content instead of reading the
+        file.
+
+    """
+    def __init__(self, path, data=None):
+
+        self.path = path
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.data = data
+        data = self.data
+        if data[:4] != ELF_MAGIC:
+            raise ELFError('%s is not an ELF file' % path)
+        self.elf_class = data[4]
+        if self.elf_class not in (1, 2):
+            raise ELFError('%s: unsupported ELF class %i' %
+                           (path, self.elf_class))
+        self.is_64bit = self.elf_class == 2
+        self.endian = '<' if data[5] == 1 else '>'
+        if self.is_64bit:
+            (self.type, self.machine, version, self.entry,
+             self.phoff, self.shoff, flags, ehsize,
+             self.phentsize, self.phnum,
+             self.shentsize, self.shnum, self.shstrndx) = struct.unpack_from(
+                 self.endian + 'HHIQQQIHHHHHH', data, 16)
+        else:
+            (self.type, self.machine, version, self.entry,
+             self.phoff, self.shoff, flags, ehsize,
+             self.phentsize, self.phnum,
+             self.shentsize, self.shnum, self.shstrndx) = struct.unpack_from(
+                 self.endian + 'HHIIIIIHHHHHH', data, 16)
+        self.program_headers = self._read_program_headers()
+        self.section_headers = self._read_section_headers()
+
+    @property
+    def architecture(self):
+
+        """ OCI architecture name of the file or None, if unknown.
+
+        """
+        return ARCHITECTURES.get(self.machine)
+
+    def _read_program_headers(self):
+
+        headers = []
+        for i in range(self.phnum):
+            offset = self.phoff + i * self.phentsize
+            if self.is_64bit:
+                (p_type, p_flags, p_offset, p_vaddr, p_paddr,
+                 p_filesz, p_memsz, p_align) = struct.unpack_from(
+                     self.endian + 'IIQQQQQQ', self.data, offset)
+            else:
+                (p_type, p_offset, p_vaddr, p_paddr,
+                 p_filesz, p_memsz, p_flags, p_align) = struct.unpack_from(
+                     self.endian + 'IIIIIIII', self.data, offset)
+            headers.append(ProgramHeader(p_type, p_offset, p_vaddr,
+                                         p_filesz, p_memsz, p_flags))
+        return headers
+
+    def _read_section_headers(self):
+
+        raw = []
+        for i in range(self.shnum):
+            offset = self.shoff + i * self.shentsize
+            if self.is_64bit:
+                (sh_name, sh_type, sh_flags, sh_addr, sh_offset,
+                 sh_size, sh_link) = struct.unpack_from(
+                     self.endian + 'IIQQQQI', self.data, offset)
+            else:
+                (sh_name, sh_type, sh_flags, sh_addr, sh_offset,
+                 sh_size, sh_link) = struct.unpack_from(
+                     self.endian + 'IIIIIII', self.data, offset)
+            raw.append((sh_name, sh_type, sh_flags, sh_addr, sh_offset,
+                        sh_size, sh_link))
+        if not raw or self.shstrndx >= len(raw):
+            return []
+        strtab_offset = raw[self.shstrndx][4]
+        return [SectionHeader(self._string(strtab_offset + entry[0]),
+                              *entry[1:])
+                for entry in raw]
+
+    def _string(self, offset):
+
+        end = self.data.find(b'\0', offset)
+        if end < 0:
+            end = len(self.data)
+        return self.data[offset:end].decode('utf-8', 'surrogateescape')
+
+    def section(self, name):
+
+        """ Return the SectionHeader of the section name or None.
+
+        """
+        for header in self.section_headers:
+            if header.name == name:
+                return header
+        return None
+
+    @property
+    def end_offset(self):
+
+        """ File offset of the end of the ELF data.
+
+            Data appended to the ELF file (e.g. the ZIP file of PyRun
+            apps) starts at this offset.
+
+        """
+        end = max(self.phoff + self.phnum * self.phentsize,
+                  self.shoff + self.shnum * self.shentsize)
+        for header in self.program_headers:
+            end = max(end, header.offset + header.filesz)
+        for header in self.section_headers:
+            if header.type != SHT_NOBITS:
+                end = max(end, header.offset + header.size)
+        return end
+
+    def symbols(self):
+
+        """ Return the list of Symbols of the symbol table (.symtab).
+
+            section is the index of the section the symbol is defined
+            in. The list is empty for stripped files.
+
+        """
+        symbols = []
+        for header in self.section_headers:
+            if header.type != SHT_SYMTAB:
+                continue
+            strtab = self.section_headers[header.link].offset
+            if self.is_64bit:
+                format = self.endian + 'IBBHQQ'
+            else:
+                format = self.endian + 'IIIBBH'
+            size = struct.calcsize(format)
+            for offset in range(header.offset,
+                                header.offset + header.size - size + 1,
+                                size):
+                if self.is_64bit:
+                    (st_name, st_info, st_other, st_shndx,
+                     st_value, st_size) = struct.unpack_from(
+                         format, self.data, offset)
+                else:
+                    (st_name, st_value, st_size,
+                     st_info, st_other, st_shndx) = struct.unpack_from(
+                         format, self.data, offset)
+                symbols.append(Symbol(self._string(strtab + st_name),
+                                      st_value, st_size, st_shndx))
+        return symbols
+
+    def vaddr_to_offset(self, vaddr):
+
+        """ Return the file offset of the virtual address vaddr.
+
+        """
+        for header in self.program_headers:
+            if (header.type == PT_LOAD and
+                header.vaddr <= vaddr < header.vaddr + header.filesz):
+                return vaddr - header.vaddr + header.offset
+        raise ELFError('%s: address 0x%x is not mapped' % (self.path, vaddr))
+
+    @property
+    def interpreter(self):
+
+        """ Path of the dynamic loader or None for static binaries.
+
+        """
+        for header in self.program_headers:
+            if header.type == PT_INTERP:
+                return self.data[
+                    header.offset:header.offset + header.filesz].rstrip(
+                        b'\0').decode('utf-8', 'surrogateescape')
+        return None
+
+    def dynamic_entries(self):
+
+        """ Return the list of (tag, value) entries of the dynamic
+            section.
+
+        """
+        entries = []
+        for header in self.program_headers:
+            if header.type != PT_DYNAMIC:
+                continue
+            format = self.endian + ('qQ' if self.is_64bit else 'iI')
+            size = struct.calcsize(format)
+            for offset in range(header.offset,
+                                header.offset + header.filesz,
+                                size):
+                tag, value = struct.unpack_from(format, self.data, offset)
+                if tag == DT_NULL:
+                    break
+                entries.append((tag, value))
+        return entries
+
+    def dynamic_info(self):
+
+        """ Return (needed, rpath, runpath) from the dynamic section;
+            rpath and runpath are lists of directories.
+
+        """
+        entries = self.dynamic_entries()
+        strtab = None
+        for tag, value in entries:
+            if tag == DT_STRTAB:
+                strtab = self.vaddr_to_offset(value)
+        needed = []
+        rpath = []
+        runpath = []
+        if strtab is None:
+            return needed, rpath, runpath
+        for tag, value in entries:
+            if tag == DT_NEEDED:
+                needed.append(self._string(strtab + value))
+            elif tag == DT_RPATH:
+                rpath.extend(self._string(strtab + value).split(':'))
+            elif tag == DT_RUNPATH:
+                runpath.extend(self._string(strtab + value).split(':'))
+        return needed, rpath, runpath
+
+### Shared library search
+
+def read_ld_so_conf(path='/etc/ld.so.conf', seen=None):
+
+    """ Return the list of library dirs configured in path (following
+        include directives).
+
+    """
+    if seen is None:
+        seen = set()
+    if path in seen or not os.path.exists(path):
+        return []
+    seen.add(path)
+    dirs = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('include '):
+                pattern = line[len('include '):].strip()
+                if not os.path.isabs(pattern):
+                    pattern = os.path.join(os.path.dirname(path), pattern)
+                for include in sorted(glob.glob(pattern)):
+                    dirs.extend(read_ld_so_conf(include, seen))
+            elif not line.startswith('hwcap '):
+                dirs.append(line)
+    return dirs
+
+def library_dirs():
+
+    """ Return the list of system library dirs, in search order.
+
+    """
+    dirs = []
+    for directory in read_ld_so_conf() + list(DEFAULT_LIBRARY_DIRS):
+        if directory not in dirs and os.path.isdir(directory):
+            dirs.append(directory)
+    return dirs
+
+def elf_header(path):
+
+    """ Return (ELF class, machine) of the ELF file path or None, if
+        path is not an ELF file.
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(20)
+    except OSError:
+        return None
+    if len(header) < 20 or header[:4] != ELF_MAGIC:
+        return None
+    endian = '<' if header[5] == 1 else '>'
+    return header[4], struct.unpack_from(endian + 'H', header, 18)[0]
+
+def _expand_origin(directory, origin):
+
+    return directory.replace('$ORIGIN', origin).replace('${ORIGIN}', origin)
+
+def find_library(name, elf_file, system_dirs):
+
+    """ Return the path of the library name needed by elf_file or None,
+        if not found.
+
+        The search uses DT_RPATH (if there's no DT_RUNPATH), DT_RUNPATH
+        and then the system_dirs. Only libraries with the same ELF class
+        and machine are accepted.
+
+    """
+    if '/' in name:
+        return name if os.path.exists(name) else None
+    needed, rpath, runpath = elf_file.dynamic_info()
+    origin = os.path.dirname(os.path.abspath(elf_file.path))
+    dirs = []
+    if not runpath:
+        dirs.extend(_expand_origin(d, origin) for d in rpath if d)
+    dirs.extend(_expand_origin(d, origin) for d in runpath if d)
+    dirs.extend(system_dirs)
+    for directory in dirs:
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        if elf_header(path) == (elf_file.elf_class, elf_file.machine):
+            return os.path.normpath(path)
+    return None
+
+def library_closure(paths, system_dirs=None):
+
+    """ Return the shared library closure of the ELF files in the list
+        paths as sorted list of library paths, including the dynamic
+        loader.
+
+        Raises an ELFError, if a library cannot be found.
+
+    """
+    if system_dirs is None:
+        system_dirs = library_dirs()
+    result = set()
+    # Real paths of the libraries in result; libraries which are
+    # available under several names (e.g. the dynamic loader) are only
+    # added once
+    real_paths = set()
+    pending = list(paths)
+    seen = set()
+
+    def add(library):
+        real_path = os.path.realpath(library)
+        if real_path in real_paths:
+            return
+        real_paths.add(real_path)
+        result.add(library)
+        pending.append(library)
+
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        elf_file = ELFFile(path)
+        interpreter = elf_file.interpreter
+        if interpreter:
+            add(interpreter)
+        needed, rpath, runpath = elf_file.dynamic_info()
+        for name in needed:
+            library = find_library(name, elf_file, system_dirs)
+            if library is None:
+                raise ELFError('%s: needed library %s not found' %
+                               (path, name))
+            add(library)
+    return sorted(result)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.env - Create and clone PyRun environments via the store
+
+    Environments are described by a manifest (.pyrun-env.json in the
+    environment root) listing the directories, symlinks and files with
+    their content hashes. Files are kept in the FileStore and
+    materialized in the environment as hard links (or reflinks or
+    copies), so that a new environment only needs a directory tree and
+    a few links.
+
+    Scripts with a "#!<env root>/..." shebang line (e.g. bin/pip) and
+    absolute symlinks into the environment are relocated, i.e. written
+    per environment.
+
+    "env create" installs PyRun and the packages once per distinct set
+    of distribution files (see pyrun_cli.install) and stores the
+    resulting manifest as template in <store>/envs/, so later creations
+    of the same set only need to materialize the manifest.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import concurrent.futures
+
+
+### Globals
+
+# Manifest file name and format version
+MANIFEST = '.pyrun-env.json'
+MANIFEST_VERSION = 1
+
+DEFAULT_JOBS = 8
+
+### Errors
+
+class EnvError(Exception):
+
+    """ Error raised for environment problems.
+
+    """
+    pass
+
+### Helpers
+
+def relocate_prefix(root):
+
+    """ Return the shebang prefix of scripts which need to be relocated
+        for the environment root.
+
+    """
+    return b'#!' + os.fsencode(root) + b'/'
+
+def relocate_data(data, old_root, new_root):
+
+    """ Return data with the shebang prefix for old_root replaced by the
+        one for new_root.
+
+    """
+    old = relocate_prefix(old_root)
+    if not data.startswith(old):
+        return data
+    return relocate_prefix(new_root) + data[len(old):]
+
+def relocate_link(link, old_root, new_root):
+
+    """ Return the symlink target link relocated from old_root to
+        new_root.
+
+    """
+    if link == old_root or link.startswith(old_root + os.sep):
+        return new_root + link[len(old_root):]
+    return link
+
+def read_manifest(path):
+
+    """ Read the manifest file path and return the manifest dictionary.
+
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise EnvError('unsupported manifest version in %s' % path)
+    return manifest
+
+def write_manifest(manifest, path):
+
+    """ Write the manifest dictionary to path (atomically).
+
+    """
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def check_target(target):
+
+    """ Make sure that target does not exist or is an empty directory.
+
+    """
+    if os.path.lexists(target):
+        if not os.path.isdir(target) or os.listdir(target):
+            raise EnvError('%s already exists and is not empty' % target)
+
+###
+
+class EnvironmentManager:
+
+    """ Create, clone and ingest environments using a FileStore.
+
+    """
+    def __init__(self, file_store, jobs=DEFAULT_JOBS, log=None):
+
+        self.store = file_store
+        self.jobs = max(1, jobs)
+        self.log = log or (lambda message: None)
+
+    @property
+    def templates_dir(self):
+
+        return os.path.join(self.store.directory, 'envs')
+
+    ### Ingesting
+
+    def _add_file(self, path, relocate):
+
+        """ Add the file path to the store and return (sha256,
+            executable, relocate flag).
+
+        """
+        executable = os.access(path, os.X_OK)
+        with open(path, 'rb') as f:
+            head = f.read(len(relocate))
+        sha256, executable, blob = self.store.add(path, executable)
+        return sha256, executable, head == relocate
+
+    def ingest(self, source):
+
+        """ Add all files of the environment source to the store and
+            return its manifest dictionary.
+
+            Files which are recorded in an existing manifest of source
+            and still hard linked to the store are not hashed again.
+
+        """
+        source = os.path.abspath(source)
+        if not os.path.isdir(source):
+            raise EnvError('%s is not a directory' % source)
+        old_files = {}
+        old_manifest_path = os.path.join(source, MANIFEST)
+        if os.path.exists(old_manifest_path):
+            old_manifest = read_manifest(old_manifest_path)
+            if old_manifest.get('root') == source:
+                old_files = old_manifest['files']
+        relocate = relocate_prefix(source)
+        dirs = []
+        symlinks = {}
+        files = {}
+        to_add = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            reldir = os.path.relpath(dirpath, source)
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                relpath = os.path.normpath(os.path.join(reldir, name))
+                if relpath == MANIFEST:
+                    continue
+                if os.path.islink(path):
+                    symlinks[relpath] = os.readlink(path)
+                elif os.path.isdir(path):
+                    dirs.append(relpath)
+                elif os.path.isfile(path):
+                    entry = old_files.get(relpath)
+                    if (entry is not None and
+                        self.store.is_linked(path, entry[0], entry[1])):
+                        files[relpath] = entry
+                    else:
+                        to_add.append(relpath)
+            # os.walk() does not descend into symlinked dirs
+            dirnames[:] = [name for name in dirnames
+                           if not os.path.islink(os.path.join(dirpath, name))]
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            results = executor.map(
+                lambda relpath: self._add_file(os.path.join(source, relpath),
+                                               relocate),
+                to_add)
+            for relpath, (sha256, executable, needs_relocation) in zip(
+                    to_add, results):
+                files[relpath] = [sha256, executable, needs_relocation]
+        return {
+            'version': MANIFEST_VERSION,
+            'root': source,
+            'dirs': sorted(dirs),
+            'symlinks': symlinks,
+            'files': files,
+        }
+
+    ### Materializing
+
+    def materialize(self, manifest, target):
+
+        """ Create the environment described by manifest in target.
+
+            Returns a dictionary with statistics.
+
+        """
+        target = os.path.abspath(target)
+        check_target(target)
+        old_root = manifest['root']
+        methods = {}
+        os.makedirs(target, exist_ok=True)
+        for relpath in manifest['dirs']:
+            os.makedirs(os.path.join(target, relpath), exist_ok=True)
+
+        def create_file(item):
+            relpath, (sha256, executable, needs_relocation) = item
+            path = os.path.join(target, relpath)
+            if needs_relocation:
+                data = relocate_data(self.store.read(sha256, executable),
+                                     old_root, target)
+                self.store.write(data, path, executable)
+                return 'relocated'
+            return self.store.materialize(sha256, executable, path)
+
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            for method in executor.map(create_file,
+                                       sorted(manifest['files'].items())):
+                methods[method] = methods.get(method, 0) + 1
+        for relpath, link in sorted(manifest['symlinks'].items()):
+            os.symlink(relocate_link(link, old_root, target),
+                       os.path.join(target, relpath))
+
+        new_manifest = dict(manifest, root=target)
+        write_manifest(new_manifest, os.path.join(target, MANIFEST))
+        return {
+            'target': target,
+            'files': len(manifest['files']),
+            'symlinks': len(manifest['symlinks']),
+            'dirs': len(manifest['dirs']),
+            'methods': methods,
+        }
+
+    ### Commands
+
+    def clone(self, source, target):
+
+        """ Clone the environment source to target.
+
+            The files of source are added to the store, if needed.
+            Returns a dictionary with statistics.
+
+        """
+        start = time.time()
+        self.log('Scanning %s' % source)
+        manifest = self.ingest(source)
+        self.log('Creating %s' % target)
+        result = self.materialize(manifest, target)
+        result['source'] = os.path.abspath(source)
+        result['seconds'] = round(time.time() - start, 3)
+        return result
+
+    def create(self, target, installer, packages=None,
+               pyrun_distribution=None):
+
+        """ Create a new environment in target with PyRun and the list of
+            packages installed using the pyrun_cli.install.Installer
+            installer. See Installer.resolve() for the parameters.
+
+            Returns a dictionary with statistics.
+
+        """
+        start = time.time()
+        check_target(os.path.abspath(target))
+        candidates = installer.resolve(packages, pyrun_distribution)
+        pyrun_candidate, wheel_candidates = candidates
+
+        # Fetch all files, to get their hashes for the template key
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            fetched = list(executor.map(installer.fetch,
+                                        [pyrun_candidate] + wheel_candidates))
+        pyrun_candidate, *wheel_candidates = [
+            candidate._replace(url=path, sha256=sha256)
+            for candidate, (path, sha256) in zip(
+                [pyrun_candidate] + wheel_candidates, fetched)]
+        key = hashlib.sha256(json.dumps([
+            MANIFEST_VERSION,
+            installer.libversion,
+            installer.pyrun_executable,
+            [candidate.sha256
+             for candidate in [pyrun_candidate] + wheel_candidates],
+            ]).encode('ascii')).hexdigest()
+        template = os.path.join(self.templates_dir, key + '.json')
+
+        if os.path.exists(template):
+            self.log('Using environment template %s' % key)
+            manifest = read_manifest(template)
+        else:
+            self.log('Creating environment template %s' % key)
+            os.makedirs(self.templates_dir, exist_ok=True)
+            build_dir = tempfile.mkdtemp(dir=self.templates_dir,
+                                         prefix='.tmp-')
+            try:
+                installer.set_target(build_dir)
+                installer.install_candidates(pyrun_candidate,
+                                             wheel_candidates)
+                manifest = self.ingest(build_dir)
+            finally:
+                shutil.rmtree(build_dir)
+            write_manifest(manifest, template)
+
+        self.log('Creating %s' % target)
+        result = self.materialize(manifest, target)
+        result['template'] = key
+        result['seconds'] = round(time.time() - start, 3)
+        return result
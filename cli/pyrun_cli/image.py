@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.image - Build minimal OCI images for PyRun applications
+
+    Writes an OCI image layout tarball (which also includes a Docker
+    compatible manifest.json, so that it can be used with "docker
+    load", "podman load", skopeo, crane, etc.) without needing a
+    container runtime or base image. The image only contains:
+
+    * base layer: the shared library closure of all ELF files in the
+      image (including the dynamic loader), CA certificates and a
+      minimal /etc
+    * runtime layer: the PyRun binary (and lib/ of the installation,
+      except site-packages)
+    * site-packages layer
+    * app layer: the application ZIP file, script or directory
+    * pycache layer (optional): a bytecode cache for site-packages and
+      the app, used via PYRUN_PYCACHE
+
+    The layers are ordered by how often they change, so that updates
+    of the app only need to push and pull the app (and pycache) layer.
+    Layer tar files are deterministic: entries are sorted, owners are
+    root and all timestamps are set to a fixed value (SOURCE_DATE_EPOCH
+    or 0), so that identical content results in identical layer
+    digests.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import io
+import json
+import gzip
+import time
+import hashlib
+import tarfile
+import tempfile
+import posixpath
+import concurrent.futures
+
+from pyrun_cli import elf, bytecode
+
+### Globals
+
+# Image paths
+PREFIX = '/opt/pyrun'
+APP_DIR = '/app'
+CA_CERTS_PATH = '/etc/ssl/certs/ca-certificates.crt'
+
+# CA certificate bundles of common Linux distributions
+CA_CERTS_SEARCH_PATHS = (
+    '/etc/ssl/certs/ca-certificates.crt',
+    '/etc/pki/tls/certs/ca-bundle.crt',
+    '/etc/ssl/ca-bundle.pem',
+    '/etc/ssl/cert.pem',
+)
+
+# Minimal /etc files
+ETC_FILES = {
+    '/etc/passwd': (b'root:x:0:0:root:/root:/sbin/nologin\n'
+                    b'nobody:x:65534:65534:nobody:/nonexistent:'
+                    b'/sbin/nologin\n'),
+    '/etc/group': b'root:x:0:\nnobody:x:65534:\n',
+    '/etc/nsswitch.conf': b'passwd: files\ngroup: files\n'
+                          b'hosts: files dns\n',
+}
+
+DEFAULT_TAG = 'pyrun-app:latest'
+DEFAULT_COMPRESS_LEVEL = 9
+
+# Media types
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+OCI_CONFIG = 'application/vnd.oci.image.config.v1+json'
+OCI_LAYER = 'application/vnd.oci.image.layer.v1.tar+gzip'
+
+### Errors
+
+class ImageError(Exception):
+
+    """ Error raised when building images.
+
+    """
+    pass
+
+### Helpers
+
+def default_timestamp():
+
+    """ Return the timestamp to use for files and the image: the value
+        of SOURCE_DATE_EPOCH or 0.
+
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if value:
+        return int(value)
+    return 0
+
+def find_ca_certs():
+
+    """ Return the path of the system CA certificate bundle or None.
+
+    """
+    for path in CA_CERTS_SEARCH_PATHS:
+        if os.path.isfile(path):
+            return path
+    return None
+
+def is_elf_file(path):
+
+    """ Return True, if path is an ELF file.
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == elf.ELF_MAGIC
+    except OSError:
+        return False
+
+def sha256_digest(data):
+
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+def iso_timestamp(timestamp):
+
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+def write_tar(entries, timestamp):
+
+    """ Return the bytes of a deterministic tar file with the entries
+        given as dictionary mapping image paths to (type, value, mode)
+        with type being 'dir', 'file' (value: source path), 'data'
+        (value: bytes) or 'symlink' (value: link target).
+
+        Parent directories are added automatically.
+
+    """
+    entries = dict(entries)
+    for path in list(entries):
+        parent = posixpath.dirname(path)
+        while parent not in ('/', ''):
+            entries.setdefault(parent, ('dir', None, 0o755))
+            parent = posixpath.dirname(parent)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w',
+                      format=tarfile.PAX_FORMAT) as archive:
+        for path in sorted(entries):
+            kind, value, mode = entries[path]
+            info = tarfile.TarInfo(path.lstrip('/'))
+            info.mtime = timestamp
+            info.mode = mode
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            if kind == 'dir':
+                info.type = tarfile.DIRTYPE
+                archive.addfile(info)
+            elif kind == 'symlink':
+                info.type = tarfile.SYMTYPE
+                info.linkname = value
+                archive.addfile(info)
+            elif kind == 'data':
+                info.size = len(value)
+                archive.addfile(info, io.BytesIO(value))
+            else:
+                info.size = os.path.getsize(value)
+                with open(value, 'rb') as f:
+                    archive.addfile(info, f)
+    return buffer.getvalue()
+
+def gzip_data(data, compress_level=DEFAULT_COMPRESS_LEVEL):
+
+    """ Return the gzip compressed data, without file name and time
+        stamp in the gzip header.
+
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer,
+                       compresslevel=compress_level, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+###
+
+class Layer:
+
+    """ Image layer under construction.
+
+    """
+    def __init__(self, name):
+
+        self.name = name
+        # Image path -> (type, value, mode); see write_tar()
+        self.entries = {}
+        # Source trees included in the layer (used to check whether
+        # shared libraries are already included)
+        self.source_dirs = []
+
+    def __len__(self):
+
+        return len(self.entries)
+
+    def add_file(self, path, source, mode=None):
+
+        if mode is None:
+            mode = 0o755 if os.access(source, os.X_OK) else 0o644
+        self.entries[path] = ('file', source, mode)
+
+    def add_data(self, path, data, mode=0o644):
+
+        self.entries[path] = ('data', data, mode)
+
+    def add_symlink(self, path, target):
+
+        self.entries[path] = ('symlink', target, 0o777)
+
+    def add_dir(self, path, mode=0o755):
+
+        self.entries[path] = ('dir', None, mode)
+
+    def add_tree(self, path, source, exclude=()):
+
+        """ Add the directory tree source as path. exclude may be given
+            as list of source paths to skip.
+
+        """
+        source = os.path.abspath(source)
+        self.source_dirs.append(source)
+        exclude = set(os.path.abspath(p) for p in exclude)
+        self.add_dir(path)
+        for dirpath, dirnames, filenames in os.walk(source):
+            reldir = os.path.relpath(dirpath, source)
+            for name in sorted(dirnames + filenames):
+                source_path = os.path.join(dirpath, name)
+                if source_path in exclude:
+                    continue
+                image_path = posixpath.normpath(posixpath.join(
+                    path, reldir.replace(os.sep, '/'), name))
+                if os.path.islink(source_path):
+                    self.add_symlink(image_path, os.readlink(source_path))
+                elif os.path.isdir(source_path):
+                    self.add_dir(image_path)
+                elif os.path.isfile(source_path):
+                    self.add_file(image_path, source_path)
+            dirnames[:] = [
+                name for name in dirnames
+                if os.path.join(dirpath, name) not in exclude and
+                not os.path.islink(os.path.join(dirpath, name))]
+
+    def elf_files(self):
+
+        """ Return the list of source paths of the ELF files in the
+            layer.
+
+        """
+        return [value
+                for kind, value, mode in self.entries.values()
+                if kind == 'file' and is_elf_file(value)]
+
+    def contains_source(self, path):
+
+        """ Return True, if the source file path is included in one of
+            the source trees of the layer.
+
+        """
+        path = os.path.realpath(path)
+        for directory in self.source_dirs:
+            directory = os.path.realpath(directory)
+            if path.startswith(directory + os.sep):
+                return True
+        return False
+
+    def build(self, timestamp, compress_level=DEFAULT_COMPRESS_LEVEL):
+
+        """ Return (compressed layer data, diff_id, digest).
+
+        """
+        data = write_tar(self.entries, timestamp)
+        diff_id = sha256_digest(data)
+        compressed = gzip_data(data, compress_level)
+        return compressed, diff_id, sha256_digest(compressed)
+
+class ImageBuilder:
+
+    """ Build an OCI image for a PyRun installation or binary.
+
+        installation is the directory of a PyRun installation (e.g.
+        created with "pyrun_cli install" or "env create"); pyrun may
+        be given instead, to only use the PyRun binary.
+
+    """
+    def __init__(self, installation=None, pyrun=None, app=None,
+                 site_packages=True, ca_certs=None, extra_libraries=(),
+                 timestamp=None, compress_level=DEFAULT_COMPRESS_LEVEL,
+                 pycache=None, jobs=4, log=None):
+
+        if installation is None and pyrun is None:
+            raise ImageError('either a PyRun installation or a PyRun '
+                             'binary is needed')
+        if installation is not None:
+            installation = os.path.abspath(installation)
+            pyrun = os.path.join(installation, 'bin', 'pyrun')
+        if not os.path.exists(pyrun):
+            raise ImageError('PyRun binary %s not found' % pyrun)
+        self.log = log or (lambda message: None)
+        self.installation = installation
+        self.pyrun = os.path.abspath(pyrun)
+        self.app = app
+        self.site_packages = site_packages
+        if ca_certs is None:
+            ca_certs = find_ca_certs()
+            if ca_certs is None:
+                self.log('Warning: no CA certificates found')
+        # False or None: don't add CA certificates
+        self.ca_certs = ca_certs
+        self.extra_libraries = extra_libraries
+        if timestamp is None:
+            timestamp = default_timestamp()
+        self.timestamp = timestamp
+        self.compress_level = compress_level
+        # Image path of the bytecode cache dir or None
+        self.pycache = pycache
+        self.jobs = max(1, jobs)
+
+    @property
+    def pyrun_name(self):
+
+        """ File name of the PyRun binary, e.g. pyrun3.12.
+
+        """
+        return os.path.basename(os.path.realpath(self.pyrun))
+
+    @property
+    def executable(self):
+
+        """ Path of the PyRun executable in the image.
+
+        """
+        return posixpath.join(PREFIX, 'bin', 'pyrun')
+
+    @property
+    def app_path(self):
+
+        """ Path of the app in the image or None.
+
+        """
+        if self.app is None:
+            return None
+        return posixpath.join(APP_DIR, os.path.basename(
+            os.path.abspath(self.app)))
+
+    def site_packages_dir(self):
+
+        """ Return the site-packages dir of the installation or None.
+
+        """
+        if self.installation is None:
+            return None
+        lib_dir = os.path.join(self.installation, 'lib')
+        for name in sorted(os.listdir(lib_dir)) if os.path.isdir(
+                lib_dir) else ():
+            path = os.path.join(lib_dir, name, 'site-packages')
+            if name.startswith('python') and os.path.isdir(path):
+                return path
+        return None
+
+    def runtime_layer(self):
+
+        layer = Layer('runtime')
+        bin_dir = posixpath.join(PREFIX, 'bin')
+        layer.add_file(posixpath.join(bin_dir, self.pyrun_name),
+                       os.path.realpath(self.pyrun), 0o755)
+        if self.pyrun_name != 'pyrun':
+            layer.add_symlink(posixpath.join(bin_dir, 'pyrun'),
+                              self.pyrun_name)
+        if self.installation is not None:
+            lib_dir = os.path.join(self.installation, 'lib')
+            if os.path.isdir(lib_dir):
+                site_packages = self.site_packages_dir()
+                layer.add_tree(posixpath.join(PREFIX, 'lib'), lib_dir,
+                               exclude=[site_packages] if site_packages
+                               else [])
+        return layer
+
+    def site_packages_layer(self):
+
+        layer = Layer('site-packages')
+        site_packages = self.site_packages_dir()
+        if self.site_packages and site_packages is not None:
+            relpath = os.path.relpath(site_packages, self.installation)
+            layer.add_tree(posixpath.join(PREFIX, relpath.replace(
+                os.sep, '/')), site_packages)
+        return layer
+
+    def app_layer(self):
+
+        layer = Layer('app')
+        if self.app is None:
+            return layer
+        if os.path.isdir(self.app):
+            layer.add_tree(self.app_path, self.app)
+        elif os.path.isfile(self.app):
+            layer.add_file(self.app_path, self.app, 0o644)
+        else:
+            raise ImageError('app %s not found' % self.app)
+        return layer
+
+    def pycache_sources(self):
+
+        """ Return the list of (source, image path) tuples of the Python
+            files to compile into the bytecode cache.
+
+        """
+        sources = []
+        if self.installation is not None:
+            lib_dir = os.path.join(self.installation, 'lib')
+            site_packages = self.site_packages_dir()
+            for source in bytecode.find_sources(lib_dir):
+                if (not self.site_packages and site_packages is not None and
+                    source.startswith(site_packages + os.sep)):
+                    continue
+                relpath = os.path.relpath(source, lib_dir)
+                sources.append((source, posixpath.join(
+                    PREFIX, 'lib', relpath.replace(os.sep, '/'))))
+        if self.app is not None and (os.path.isdir(self.app) or
+                                     self.app.endswith('.py')):
+            # ZIP files are not supported by the bytecode cache
+            sources.extend(bytecode.map_sources(self.app, self.app_path))
+        return sources
+
+    def pycache_layer(self):
+
+        layer = Layer('pycache')
+        if self.pycache is None:
+            return layer
+        sources = self.pycache_sources()
+        if not sources:
+            return layer
+        compiler = bytecode.BytecodeCompiler(self.pyrun,
+                                             jobs=self.jobs,
+                                             log=self.log)
+        with tempfile.TemporaryDirectory() as directory:
+            bytecode.fill_pycache(directory, sources, compiler,
+                                  log=self.log)
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    relpath = os.path.relpath(path, directory)
+                    with open(path, 'rb') as f:
+                        layer.add_data(posixpath.join(
+                            self.pycache, relpath.replace(os.sep, '/')),
+                                       f.read())
+        return layer
+
+    def base_layer(self, layers):
+
+        """ Return the base layer for the list of other layers: the
+            shared library closure of their ELF files, the CA
+            certificates and /etc files.
+
+        """
+        layer = Layer('base')
+        elf_files = list(self.extra_libraries)
+        for other in layers:
+            elf_files.extend(other.elf_files())
+        try:
+            libraries = elf.library_closure(elf_files)
+        except elf.ELFError as reason:
+            raise ImageError(str(reason))
+        for library in libraries + list(self.extra_libraries):
+            if any(other.contains_source(library) for other in layers):
+                continue
+            layer.add_file(os.path.abspath(library).replace(os.sep, '/'),
+                           os.path.realpath(library), 0o755)
+        if self.ca_certs:
+            layer.add_file(CA_CERTS_PATH, os.path.realpath(self.ca_certs),
+                           0o644)
+        for path, data in ETC_FILES.items():
+            layer.add_data(path, data)
+        layer.add_dir('/tmp', 0o1777)
+        return layer
+
+    def config(self, diff_ids, layers, entrypoint=None, cmd=None, env=(),
+               workdir=None, user=None, labels=None):
+
+        """ Return the OCI image config dictionary.
+
+        """
+        if entrypoint is None:
+            entrypoint = [self.executable]
+            if self.app_path is not None:
+                # pyrun runs the __main__.py of app directories
+                if (os.path.isdir(self.app) and
+                    not os.path.isfile(os.path.join(self.app,
+                                                    '__main__.py'))):
+                    raise ImageError('app directory %s has no __main__.py; '
+                                     'please use --entrypoint' % self.app)
+                entrypoint.append(self.app_path)
+        environment = ['PATH=%s/bin:/usr/bin:/bin' % PREFIX]
+        if self.ca_certs:
+            environment.append('SSL_CERT_FILE=%s' % CA_CERTS_PATH)
+        if self.pycache is not None:
+            environment.append('PYRUN_PYCACHE=%s' % self.pycache)
+        environment.extend(env)
+        config = {
+            'Entrypoint': entrypoint,
+            'Env': environment,
+            'WorkingDir': workdir or (APP_DIR if self.app else '/'),
+        }
+        if cmd:
+            config['Cmd'] = cmd
+        if user:
+            config['User'] = user
+        if labels:
+            config['Labels'] = labels
+        created = iso_timestamp(self.timestamp)
+        return {
+            'created': created,
+            'architecture': elf.ELFFile(
+                os.path.realpath(self.pyrun)).architecture or 'unknown',
+            'os': 'linux',
+            'config': config,
+            'rootfs': {
+                'type': 'layers',
+                'diff_ids': diff_ids,
+            },
+            'history': [{
+                'created': created,
+                'created_by': 'pyrun_cli image: %s layer' % layer.name,
+            } for layer in layers],
+        }
+
+    def build(self, output, tag=DEFAULT_TAG, **config_options):
+
+        """ Write the image as OCI image layout tar file to output.
+
+            config_options are passed to .config().
+
+            Returns a dictionary with information about the image.
+
+        """
+        layers = [self.runtime_layer(),
+                  self.site_packages_layer(),
+                  self.app_layer(),
+                  self.pycache_layer()]
+        layers.insert(0, self.base_layer(layers))
+        layers = [layer for layer in layers if len(layer)]
+
+        self.log('Building %i layers' % len(layers))
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            built = list(executor.map(
+                lambda layer: layer.build(self.timestamp,
+                                          self.compress_level),
+                layers))
+
+        diff_ids = [diff_id for data, diff_id, digest in built]
+        config = self.config(diff_ids, layers, **config_options)
+        config_data = json.dumps(config, sort_keys=True,
+                                 separators=(',', ':')).encode('utf-8')
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': OCI_MANIFEST,
+            'config': {
+                'mediaType': OCI_CONFIG,
+                'digest': sha256_digest(config_data),
+                'size': len(config_data),
+            },
+            'layers': [{
+                'mediaType': OCI_LAYER,
+                'digest': digest,
+                'size': len(data),
+            } for data, diff_id, digest in built],
+        }
+        manifest_data = json.dumps(manifest, sort_keys=True,
+                                   separators=(',', ':')).encode('utf-8')
+        manifest_digest = sha256_digest(manifest_data)
+        index = {
+            'schemaVersion': 2,
+            'manifests': [{
+                'mediaType': OCI_MANIFEST,
+                'digest': manifest_digest,
+                'size': len(manifest_data),
+                'annotations': {
+                    'org.opencontainers.image.ref.name': tag,
+                },
+            }],
+        }
+
+        def blob_path(digest):
+            return 'blobs/sha256/' + digest.split(':', 1)[1]
+
+        docker_manifest = [{
+            'Config': blob_path(sha256_digest(config_data)),
+            'RepoTags': [tag],
+            'Layers': [blob_path(digest)
+                       for data, diff_id, digest in built],
+        }]
+        entries = {
+            '/oci-layout': ('data', b'{"imageLayoutVersion":"1.0.0"}', 0o644),
+            '/index.json': ('data', json.dumps(
+                index, sort_keys=True).encode('utf-8'), 0o644),
+            '/manifest.json': ('data', json.dumps(
+                docker_manifest, sort_keys=True).encode('utf-8'), 0o644),
+            '/' + blob_path(sha256_digest(config_data)): (
+                'data', config_data, 0o644),
+            '/' + blob_path(manifest_digest): ('data', manifest_data, 0o644),
+        }
+        for data, diff_id, digest in built:
+            entries['/' + blob_path(digest)] = ('data', data, 0o644)
+        archive = write_tar(entries, self.timestamp)
+        with open(output, 'wb') as f:
+            f.write(archive)
+        return {
+            'output': os.path.abspath(output),
+            'tag': tag,
+            'digest': manifest_digest,
+            'size': sum(len(data) for data, diff_id, digest in built),
+            'layers': [{
+                'name': layer.name,
+                'files': len(layer),
+                'digest': digest,
+                'size': len(data),
+            } for layer, (data, diff_id, digest) in zip(layers, built)],
+        }
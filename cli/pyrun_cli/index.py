@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.index - Package indexes and wheel selection
+
+    Two kinds of indexes are supported:
+
+    * DirectoryIndex: a local directory with wheels and PyRun
+      distributions, either flat or with one subdirectory per
+      (normalized) project name, as used by PEP 503 simple indexes;
+      this serves as stand-in for PyPI in offline setups
+
+    * PyPIIndex: the PyPI JSON API
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import re
+import json
+import collections
+import urllib.parse
+import urllib.request
+
+### Globals
+
+# PyPI JSON API base URL
+PYPI_URL = 'https://pypi.org/pypi'
+
+# Download URL for PyRun distributions
+PYRUN_DOWNLOAD_URL = 'https://downloads.egenix.com/python/'
+
+# Network timeout in seconds
+TIMEOUT = 60
+
+# Oldest manylinux glibc minor version to consider
+MANYLINUX_MIN_GLIBC_MINOR = 5
+
+# Wheel file name, see PEP 427
+WHEEL_FILENAME_RE = re.compile(
+    r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?'
+    r'-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$')
+
+# File found in an index: url may be a local path; sha256 may be None,
+# if unknown
+Candidate = collections.namedtuple(
+    'Candidate', ('filename', 'url', 'sha256', 'version'))
+
+### Errors
+
+class PackageIndexError(Exception):
+
+    """ Error raised in case a package cannot be found or an index
+        cannot be accessed.
+
+    """
+    pass
+
+### Helpers
+
+def normalize_name(name):
+
+    """ Return the normalized project name as defined in PEP 503.
+
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def parse_wheel_filename(filename):
+
+    """ Parse the wheel filename and return (name, version, tags), with
+        tags being the set of (python, abi, platform) tuples supported
+        by the wheel.
+
+        Returns None, if filename is not a valid wheel file name.
+
+    """
+    match = WHEEL_FILENAME_RE.match(filename)
+    if match is None:
+        return None
+    tags = set()
+    for python in match.group('python').split('.'):
+        for abi in match.group('abi').split('.'):
+            for platform in match.group('platform').split('.'):
+                tags.add((python, abi, platform))
+    return match.group('name'), match.group('version'), tags
+
+def version_key(version):
+
+    """ Return a sort key for the version string version.
+
+        This is a simplified version of the PEP 440 ordering: numeric
+        release parts are compared as numbers, pre-releases sort before
+        the final release and post-releases after it.
+
+    """
+    match = re.match(r'^v?(\d+(?:\.\d+)*)(.*)$', version.lower())
+    if match is None:
+        return ((), -2, version)
+    release = tuple(int(x) for x in match.group(1).split('.'))
+    # Strip trailing zeros, so that 1.0 == 1.0.0
+    while release and release[-1] == 0:
+        release = release[:-1]
+    suffix = match.group(2).lstrip('.-_')
+    if not suffix:
+        return (release, 0, '')
+    if suffix.startswith(('post', 'rev', 'r')):
+        return (release, 1, suffix)
+    return (release, -1, suffix)
+
+def is_prerelease(version):
+
+    """ Return True, if version is a pre-release or development version.
+
+    """
+    return re.search(r'(a|b|c|rc|alpha|beta|pre|preview|dev)\d*',
+                     version.lower()) is not None
+
+def glibc_version():
+
+    """ Return the glibc version as (major, minor) tuple or None, if not
+        available.
+
+    """
+    try:
+        value = os.confstr('CS_GNU_LIBC_VERSION')
+    except (AttributeError, ValueError, OSError):
+        return None
+    if not value:
+        return None
+    match = re.search(r'(\d+)\.(\d+)', value)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def platform_tags(platform):
+
+    """ Return the list of wheel platform tags supported on the PyRun
+        platform (e.g. 'linux-x86_64'), best match first.
+
+    """
+    platform = platform.replace('-', '_').replace('.', '_')
+    tags = []
+    if platform.startswith('linux_'):
+        arch = platform[len('linux_'):]
+        if arch in ('i386', 'i586', 'i486'):
+            arch = 'i686'
+        glibc = glibc_version()
+        if glibc is not None and glibc[0] == 2:
+            for minor in range(glibc[1], MANYLINUX_MIN_GLIBC_MINOR - 1, -1):
+                tags.append('manylinux_2_%i_%s' % (minor, arch))
+                if minor == 17:
+                    tags.append('manylinux2014_%s' % arch)
+                elif minor == 12:
+                    tags.append('manylinux2010_%s' % arch)
+                elif minor == 5:
+                    tags.append('manylinux1_%s' % arch)
+        tags.append('linux_%s' % arch)
+    else:
+        tags.append(platform)
+    tags.append('any')
+    return tags
+
+def supported_tags(python_version, platform):
+
+    """ Return the list of (python, abi, platform) wheel tags supported
+        by a PyRun for python_version (e.g. '3.12') on platform, best
+        match first.
+
+    """
+    major, minor = (int(x) for x in python_version.split('.')[:2])
+    nodot = '%i%i' % (major, minor)
+    platforms = platform_tags(platform)
+    binary_platforms = [p for p in platforms if p != 'any']
+    tags = []
+    # CPython specific wheels
+    for plat in binary_platforms:
+        tags.append(('cp' + nodot, 'cp' + nodot, plat))
+    for plat in binary_platforms:
+        for version in range(minor, 1, -1):
+            tags.append(('cp%i%i' % (major, version), 'abi3', plat))
+    for plat in binary_platforms:
+        tags.append(('cp' + nodot, 'none', plat))
+    # Generic wheels
+    for plat in binary_platforms:
+        tags.append(('py' + nodot, 'none', plat))
+        tags.append(('py%i' % major, 'none', plat))
+    tags.append(('cp' + nodot, 'none', 'any'))
+    for version in range(minor, -1, -1):
+        tags.append(('py%i%i' % (major, version), 'none', 'any'))
+    tags.append(('py%i' % major, 'none', 'any'))
+    return tags
+
+def select_wheel(candidates, name, version, tags, prereleases=False):
+
+    """ Return the best Candidate from candidates for the project name
+        in version (None selects the latest version) which is compatible
+        with the list of tags.
+
+        Raises a PackageIndexError, if no suitable wheel is found.
+
+    """
+    tag_priority = dict((tag, i) for i, tag in enumerate(tags))
+    project = normalize_name(name)
+    best = None
+    best_key = None
+    for candidate in candidates:
+        info = parse_wheel_filename(candidate.filename)
+        if info is None:
+            continue
+        wheel_name, wheel_version, wheel_tags = info
+        if normalize_name(wheel_name) != project:
+            continue
+        if version is not None:
+            if version_key(wheel_version) != version_key(version):
+                continue
+        elif not prereleases and is_prerelease(wheel_version):
+            continue
+        priorities = [tag_priority[tag]
+                      for tag in wheel_tags
+                      if tag in tag_priority]
+        if not priorities:
+            continue
+        key = (version_key(wheel_version), -min(priorities))
+        if best is None or key > best_key:
+            best = candidate._replace(version=wheel_version)
+            best_key = key
+    if best is None:
+        raise PackageIndexError('no compatible wheel found for %s%s' %
+                                (name, '==%s' % version if version else ''))
+    return best
+
+def urlopen(url, timeout=TIMEOUT, context=None):
+
+    """ Open url and return the response object.
+
+        Raises a PackageIndexError in case of problems.
+
+    """
+    try:
+        return urllib.request.urlopen(url, timeout=timeout, context=context)
+    except (OSError, ValueError) as reason:
+        raise PackageIndexError('could not open %s: %s' % (url, reason))
+
+###
+
+class DirectoryIndex:
+
+    """ Local directory used as package index.
+
+        Files are searched for in the directory itself and in the
+        subdirectory named after the normalized project name.
+
+    """
+    def __init__(self, directory):
+
+        self.directory = os.path.abspath(directory)
+
+    def __repr__(self):
+
+        return '%s(%r)' % (self.__class__.__name__, self.directory)
+
+    def _list(self, directory):
+
+        try:
+            return os.listdir(directory)
+        except OSError:
+            return []
+
+    def find_file(self, filename):
+
+        """ Return a Candidate for filename or None, if not found.
+
+        """
+        path = os.path.join(self.directory, filename)
+        if os.path.isfile(path):
+            return Candidate(filename, path, None, None)
+        return None
+
+    def candidates(self, name, version=None):
+
+        """ Return a list of Candidates for the project name.
+
+            version is only a hint and the list may include other
+            versions as well.
+
+        """
+        project = normalize_name(name)
+        result = []
+        for directory in (self.directory,
+                          os.path.join(self.directory, project)):
+            for filename in self._list(directory):
+                if not filename.endswith('.whl'):
+                    continue
+                info = parse_wheel_filename(filename)
+                if info is None or normalize_name(info[0]) != project:
+                    continue
+                result.append(Candidate(filename,
+                                        os.path.join(directory, filename),
+                                        None,
+                                        info[1]))
+        return result
+
+class PyPIIndex:
+
+    """ PyPI (or a compatible mirror) accessed via the JSON API.
+
+    """
+    def __init__(self, url=PYPI_URL, context=None):
+
+        self.url = url.rstrip('/')
+        self.context = context
+
+    def __repr__(self):
+
+        return '%s(%r)' % (self.__class__.__name__, self.url)
+
+    def find_file(self, filename):
+
+        """ PyRun distributions are not available on PyPI.
+
+        """
+        return None
+
+    def candidates(self, name, version=None):
+
+        """ Return a list of Candidates for the project name.
+
+            Only the files of version are returned, if given, and the
+            files of the latest release otherwise.
+
+        """
+        if version:
+            url = '%s/%s/%s/json' % (self.url, urllib.parse.quote(name),
+                                     urllib.parse.quote(version))
+        else:
+            url = '%s/%s/json' % (self.url, urllib.parse.quote(name))
+        with urlopen(url, context=self.context) as response:
+            try:
+                data = json.load(response)
+            except ValueError as reason:
+                raise PackageIndexError('invalid JSON data from %s: %s' %
+                                        (url, reason))
+        release = data['info']['version']
+        result = []
+        for entry in data.get('urls', ()):
+            if entry.get('packagetype') != 'bdist_wheel':
+                continue
+            if entry.get('yanked'):
+                continue
+            result.append(Candidate(entry['filename'],
+                                    entry['url'],
+                                    entry.get('digests', {}).get('sha256'),
+                                    release))
+        return result
+
+class DownloadSite:
+
+    """ Download site for PyRun distributions.
+
+    """
+    def __init__(self, url=PYRUN_DOWNLOAD_URL):
+
+        self.url = url.rstrip('/') + '/'
+
+    def __repr__(self):
+
+        return '%s(%r)' % (self.__class__.__name__, self.url)
+
+    def find_file(self, filename):
+
+        """ Return a Candidate for filename; the file is only checked
+            when downloading it.
+
+        """
+        return Candidate(filename, self.url + filename, None, None)
+
+    def candidates(self, name, version=None):
+
+        return []
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.install - Install PyRun into a directory
+
+    Replacement for the install-pyrun script: the PyRun distribution,
+    setuptools, pip and the packages from a requirements file are
+    resolved via the content addressed cache, optional local index
+    directories and (unless running offline) the download site and
+    PyPI. Wheels are installed directly, without running pip or
+    setup.py. Downloads and unpacking are run concurrently.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import re
+import time
+import tarfile
+import platform
+import concurrent.futures
+
+from pyrun_cli import cache, index, wheels
+
+### Globals
+
+# Defaults, see install-pyrun
+DEFAULT_PYRUN_VERSION = '2.6.0'
+DEFAULT_PYTHON_VERSION = '3.12'
+DEFAULT_PYTHON_UNICODE = 'ucs4'
+DEFAULT_JOBS = 8
+
+# Packages installed by default (in installation order)
+DEFAULT_PACKAGES = ('setuptools', 'pip')
+
+# Requirement line: "name" or "name==version"; extras and environment
+# markers are not supported
+REQUIREMENT_RE = re.compile(
+    r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*'
+    r'(==\s*(?P<version>[A-Za-z0-9._+!-]+))?\s*$')
+
+### Errors
+
+class InstallError(Exception):
+
+    """ Error raised in case the installation fails.
+
+    """
+    pass
+
+### Helpers
+
+def default_platform():
+
+    """ Return the PyRun platform string for the current machine (as
+        used in the PyRun distribution file names).
+
+    """
+    system = platform.system().lower()
+    machine = platform.machine()
+    if system == 'darwin':
+        system = 'macosx'
+        release = platform.mac_ver()[0]
+        if release:
+            system = 'macosx-%s' % '.'.join(release.split('.')[:2])
+    elif system.startswith('freebsd'):
+        release = platform.release().split('-')[0]
+        system = 'freebsd-%s' % release
+    if machine in ('i386', 'i486', 'i586', 'i686'):
+        machine = 'i686' if system == 'linux' else 'i386'
+    elif machine == 'amd64':
+        machine = 'x86_64'
+    return '%s-%s' % (system, machine)
+
+def pyrun_distribution_name(pyrun_version, python_version, python_unicode,
+                            platform):
+
+    """ Return the file name of the PyRun binary distribution.
+
+    """
+    return 'egenix-pyrun-%s-py%s_%s-%s.tgz' % (
+        pyrun_version, python_version, python_unicode, platform)
+
+def parse_requirements(path):
+
+    """ Parse the requirements file path and return a list of (name,
+        version) tuples; version is None, if not pinned.
+
+        Only simple requirements are supported, e.g. as written by
+        "pip freeze". Dependencies are not resolved, so the file has to
+        list all needed packages.
+
+    """
+    requirements = []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            match = REQUIREMENT_RE.match(line)
+            if match is None:
+                raise InstallError(
+                    '%s:%i: unsupported requirement %r; only "name" and '
+                    '"name==version" are supported' % (path, lineno, line))
+            requirements.append((match.group('name'), match.group('version')))
+    return requirements
+
+def extract_distribution(path, target):
+
+    """ Extract the PyRun distribution archive path into target.
+
+    """
+    try:
+        with tarfile.open(path, 'r:*') as archive:
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(target, filter='data')
+            else:
+                archive.extractall(target)
+    except tarfile.TarError as reason:
+        raise InstallError('could not extract %s: %s' % (path, reason))
+
+###
+
+class Installer:
+
+    """ Install PyRun and a set of packages into target.
+
+    """
+    def __init__(self, target,
+                 cache_dir=None,
+                 index_dirs=(),
+                 pyrun_version=DEFAULT_PYRUN_VERSION,
+                 python_version=DEFAULT_PYTHON_VERSION,
+                 python_unicode=DEFAULT_PYTHON_UNICODE,
+                 platform=None,
+                 pyrun_executable=None,
+                 pypi_url=index.PYPI_URL,
+                 download_url=index.PYRUN_DOWNLOAD_URL,
+                 offline=False,
+                 jobs=DEFAULT_JOBS,
+                 log=None):
+
+        if python_version.startswith('2.'):
+            raise InstallError('Python 2 PyRun installations are not '
+                               'supported; please use install-pyrun')
+        self.cache = cache.ContentCache(cache_dir or cache.default_cache_dir())
+        self.pyrun_version = pyrun_version
+        self.python_version = python_version
+        self.python_unicode = python_unicode
+        self.platform = platform or default_platform()
+        self.jobs = max(1, jobs)
+        self.offline = offline
+        self.log = log or (lambda message: None)
+
+        # Index lookup order: local directories first, then the remote
+        # sites
+        self.local_indexes = [index.DirectoryIndex(d) for d in index_dirs]
+        if offline:
+            self.remote_indexes = []
+        else:
+            self.remote_indexes = [index.PyPIIndex(pypi_url),
+                                   index.DownloadSite(download_url)]
+        self.indexes = self.local_indexes + self.remote_indexes
+
+        self.libversion = python_version
+        self.pyrun_executable = pyrun_executable or 'pyrun'
+        self.set_target(target)
+        self.tags = index.supported_tags(python_version, self.platform)
+
+    def set_target(self, target):
+
+        """ Set the installation directory to target.
+
+        """
+        self.target = os.path.abspath(target)
+        self.scheme = wheels.InstallScheme(self.target, self.libversion,
+                                           self.pyrun_executable)
+
+    ### Resolving
+
+    def resolve_file(self, filename):
+
+        """ Return a Candidate for the file filename.
+
+            The local index directories are checked first, then the
+            cache and then the remote indexes.
+
+        """
+        for package_index in self.local_indexes:
+            candidate = package_index.find_file(filename)
+            if candidate is not None:
+                return candidate
+        path, sha256 = self.cache.lookup(filename)
+        if path is not None:
+            return index.Candidate(filename, path, sha256, None)
+        for package_index in self.remote_indexes:
+            candidate = package_index.find_file(filename)
+            if candidate is not None:
+                return candidate
+        raise InstallError('%s not found in the cache or indexes' % filename)
+
+    def resolve_wheel(self, name, version=None):
+
+        """ Return a Candidate for the best wheel of the project name in
+            version (None means: latest version).
+
+            Pinned versions are looked up in the cache first, then the
+            indexes are searched in order. The first index with a
+            compatible wheel is used. Unpinned versions fall back to the
+            latest cached wheel, if no index has one (e.g. when running
+            offline).
+
+        """
+        if version is not None:
+            candidate = self._cached_wheel(name, version)
+            if candidate is not None:
+                return candidate
+        errors = []
+        for package_index in self.indexes:
+            try:
+                candidates = package_index.candidates(name, version)
+                return index.select_wheel(candidates, name, version,
+                                          self.tags)
+            except index.PackageIndexError as reason:
+                errors.append('%r: %s' % (package_index, reason))
+        if version is None:
+            candidate = self._cached_wheel(name, version)
+            if candidate is not None:
+                return candidate
+        raise InstallError('could not find a wheel for %s%s: %s' % (
+            name, '==%s' % version if version else '',
+            '; '.join(errors) or 'not in the cache and no index available'))
+
+    def _cached_wheel(self, name, version):
+
+        """ Return a Candidate for a cached wheel of the project name in
+            version or None.
+
+        """
+        candidates = [index.Candidate(filename, None, None, None)
+                      for filename in self.cache.names()
+                      if filename.endswith('.whl')]
+        try:
+            candidate = index.select_wheel(candidates, name, version,
+                                           self.tags)
+        except index.PackageIndexError:
+            return None
+        path, sha256 = self.cache.lookup(candidate.filename)
+        if path is None:
+            return None
+        return candidate._replace(url=path, sha256=sha256)
+
+    ### Fetching
+
+    def fetch(self, candidate):
+
+        """ Fetch the file of candidate into the cache, if needed, and
+            return (path, sha256) of the cached file.
+
+        """
+        url = candidate.url
+        if '://' not in url:
+            # Local files may be rebuilt under the same name, so they
+            # are always identified by their hash
+            sha256 = candidate.sha256 or cache.file_hash(url)
+            path = self.cache.get(sha256)
+            if path is not None:
+                return path, sha256
+            self.log('Adding %s to the cache' % candidate.filename)
+            return self.cache.add_file(url, candidate.filename, sha256)
+        if candidate.sha256 is not None:
+            path = self.cache.get(candidate.sha256)
+            if path is not None:
+                return path, candidate.sha256
+        else:
+            # Released distribution files are never changed, so the
+            # file name identifies the content
+            path, sha256 = self.cache.lookup(candidate.filename)
+            if path is not None:
+                return path, sha256
+        if self.offline:
+            raise InstallError('cannot download %s in offline mode' % url)
+        self.log('Downloading %s' % url)
+        with index.urlopen(url) as response:
+            return self.cache.add_stream(response, candidate.filename,
+                                         candidate.sha256)
+
+    ### Installation
+
+    def resolve(self, packages=None, pyrun_distribution=None):
+
+        """ Resolve the PyRun distribution and the list of packages,
+            given as (name, version) tuples, concurrently. packages
+            defaults to DEFAULT_PACKAGES in their latest versions.
+
+            pyrun_distribution may be given to use a local PyRun
+            distribution file instead of resolving it.
+
+            Returns (pyrun_candidate, wheel_candidates).
+
+        """
+        if packages is None:
+            packages = [(name, None) for name in DEFAULT_PACKAGES]
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            if pyrun_distribution is not None:
+                pyrun_future = None
+                pyrun_candidate = index.Candidate(
+                    os.path.basename(pyrun_distribution),
+                    os.path.abspath(pyrun_distribution),
+                    None, None)
+            else:
+                filename = pyrun_distribution_name(
+                    self.pyrun_version, self.python_version,
+                    self.python_unicode, self.platform)
+                pyrun_future = executor.submit(self.resolve_file, filename)
+            wheel_futures = [executor.submit(self.resolve_wheel,
+                                             name, version)
+                             for name, version in packages]
+            if pyrun_future is not None:
+                pyrun_candidate = pyrun_future.result()
+            wheel_candidates = [future.result() for future in wheel_futures]
+        return pyrun_candidate, wheel_candidates
+
+    def install(self, packages=None, pyrun_distribution=None):
+
+        """ Install PyRun and the list of packages into the target
+            directory. See .resolve() for the parameters.
+
+            Returns a dictionary with a summary of the installation.
+
+        """
+        start = time.time()
+        candidates = self.resolve(packages, pyrun_distribution)
+        result = self.install_candidates(*candidates)
+        result['seconds'] = round(time.time() - start, 3)
+        return result
+
+    def install_candidates(self, pyrun_candidate, wheel_candidates):
+
+        """ Install the PyRun distribution pyrun_candidate and the
+            wheels in the list wheel_candidates into the target
+            directory.
+
+            All files are downloaded in parallel. The PyRun
+            distribution is extracted first, the wheels are then
+            installed in parallel, as soon as they are available in
+            the cache.
+
+        """
+        start = time.time()
+        if os.path.exists(os.path.join(self.scheme.scripts, 'pyrun')):
+            raise InstallError('%s already contains a PyRun installation' %
+                               self.target)
+        os.makedirs(self.target, exist_ok=True)
+
+        def unpack(candidate, fetched, unpack_file):
+            path, sha256 = fetched
+            self.log('Installing %s' % candidate.filename)
+            unpack_file(path)
+            return {
+                'filename': candidate.filename,
+                'version': candidate.version,
+                'sha256': sha256,
+            }
+
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            pyrun_fetch = executor.submit(self.fetch, pyrun_candidate)
+            wheel_fetches = {
+                executor.submit(self.fetch, candidate): i
+                for i, candidate in enumerate(wheel_candidates)}
+
+            # Extract the PyRun distribution before installing wheels
+            # into the same tree: tarfile creates missing parent dirs
+            # using a check-then-os.makedirs() sequence, which fails
+            # with a FileExistsError when racing with other writers
+            pyrun_result = unpack(
+                pyrun_candidate,
+                pyrun_fetch.result(),
+                lambda path: extract_distribution(path, self.target))
+
+            wheel_futures = [None] * len(wheel_candidates)
+            for future in concurrent.futures.as_completed(wheel_fetches):
+                i = wheel_fetches[future]
+                wheel_futures[i] = executor.submit(
+                    unpack,
+                    wheel_candidates[i],
+                    future.result(),
+                    lambda path: wheels.install_wheel(path, self.scheme))
+            wheel_results = [future.result() for future in wheel_futures]
+
+        self.link_executable()
+        return {
+            'target': self.target,
+            'executable': self.scheme.executable,
+            'site_packages': self.scheme.site_packages,
+            'pyrun': pyrun_result,
+            'packages': wheel_results,
+            'seconds': round(time.time() - start, 3),
+        }
+
+    def link_executable(self):
+
+        """ Make sure that bin/<executable> exists and points to the
+            PyRun binary of the distribution.
+
+        """
+        bin_dir = self.scheme.scripts
+        executable = self.scheme.executable
+        if os.path.exists(executable):
+            return
+        pyrun = os.path.join(bin_dir, 'pyrun')
+        if not os.path.exists(pyrun):
+            raise InstallError('PyRun distribution does not contain '
+                               'bin/pyrun')
+        if os.path.lexists(executable):
+            os.remove(executable)
+        os.symlink('pyrun', executable)
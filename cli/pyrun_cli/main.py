@@ -7,7 +7,10 @@
     License: Apache-2.0
 
 """
+import os
 import sys
+import json
+import inspect
 import argparse
 import textwrap
 
@@ -21,6 +24,12 @@ def command(method):
 
     """ Decorator to declare a command method.
 
+        The method's doc-string is used as help text for the command.
+        Underscores in the method name are written as dashes on the
+        command line.
+        Command line arguments for the command are added by the method
+        named "<command>_arguments", if available.
+
     """
     _commands.add(method.__name__)
     return method
@@ -42,39 +51,648 @@ class PyRunCLI:
     # Commands method dictionary; initialized in .__init__()
     commands = None
 
+    # Parsed command line options; set in .parse_argv()
+    options = None
+
     def __init__(self):
         self.commands = _commands.copy()
 
     def parse_argv(self, argv):
         # Command parser
+        prog = argv[0]
+        if os.path.basename(prog) == '__main__.py':
+            # Run via "python -m pyrun_cli"
+            prog = 'pyrun_cli'
         main_parser = argparse.ArgumentParser(
-            prog=argv[0] or self.APP_NAME,
+            prog=prog or self.APP_NAME,
             description=self.APP_DESCRIPTION,
             epilog=self.APP_EPILOG,
         )
-        main_parser.add_argument(
-            'command',
-            nargs=1,
-            type=str,
-            choices=self.commands,
+        subparsers = main_parser.add_subparsers(
+            dest='command',
+            metavar='command',
         )
+        subparsers.required = True
+        for name in sorted(self.commands):
+            method = getattr(self, name)
+            doc = inspect.cleandoc(method.__doc__ or '')
+            parser = subparsers.add_parser(
+                name.replace('_', '-'),
+                help=doc.split('\n\n')[0],
+                description=doc,
+                formatter_class=argparse.RawDescriptionHelpFormatter,
+            )
+            add_arguments = getattr(self, name + '_arguments', None)
+            if add_arguments is not None:
+                add_arguments(parser)
         self.main_parser = main_parser
+        self.options = main_parser.parse_args(argv[1:])
+        return self.options
+
+    def log(self, message):
+        if not getattr(self.options, 'quiet', False):
+            sys.stderr.write(message + '\n')
+            sys.stderr.flush()
+
+    def add_install_options(self, parser):
+        from pyrun_cli import install
+        parser.add_argument(
+            '--python', default=install.DEFAULT_PYTHON_VERSION,
+            help='Python version to install (default: %(default)s)')
+        parser.add_argument(
+            '--python-unicode', default=install.DEFAULT_PYTHON_UNICODE,
+            help='Python Unicode variant (default: %(default)s)')
+        parser.add_argument(
+            '--pyrun', default=install.DEFAULT_PYRUN_VERSION,
+            help='PyRun version to install (default: %(default)s)')
+        parser.add_argument(
+            '--platform', default=None,
+            help='PyRun platform to install (default: current platform)')
+        parser.add_argument(
+            '--pyrun-distribution', default=None,
+            help='use this PyRun distribution file')
+        parser.add_argument(
+            '--pyrun-executable', default=None,
+            help='name of the PyRun executable (default: pyrun)')
+        parser.add_argument(
+            '--setuptools-version', default=None,
+            help='setuptools version to install (default: latest)')
+        parser.add_argument(
+            '--pip-version', default=None,
+            help='pip version to install (default: latest)')
+        parser.add_argument(
+            '-m', '--minimal', action='store_true',
+            help='only install PyRun, no setuptools and pip')
+        parser.add_argument(
+            '-r', '--requirements', action='append', default=[],
+            help='install the wheels listed in this requirements file; '
+            'entries have to be "name" or "name==version" and include all '
+            'dependencies (e.g. pip freeze output)')
+        parser.add_argument(
+            '--cache', default=None,
+            help='cache directory (default: $PYRUN_CACHE or ~/.cache/pyrun)')
+        parser.add_argument(
+            '--index-dir', action='append', default=[],
+            help='local directory with wheels and PyRun distributions to '
+            'use instead of PyPI and the download site; may be given more '
+            'than once')
+        parser.add_argument(
+            '--pypi-url', default=None,
+            help='PyPI JSON API URL (default: https://pypi.org/pypi)')
+        parser.add_argument(
+            '--offline', action='store_true',
+            help='only use the cache and index directories')
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=install.DEFAULT_JOBS,
+            help='number of concurrent downloads and unpack operations '
+            '(default: %(default)s)')
+        self.add_output_options(parser)
+
+    def add_output_options(self, parser):
+        parser.add_argument(
+            '--json', action='store_true',
+            help='write a JSON summary of the result to stdout')
+        parser.add_argument(
+            '-q', '--quiet', action='store_true',
+            help='only output errors')
+
+    def output_result(self, result):
+        if self.options.json:
+            json.dump(result, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write('\n')
+
+    def create_installer(self, target):
+        from pyrun_cli import install, index
+        options = self.options
+        packages = []
+        if not options.minimal:
+            packages.append(('setuptools', options.setuptools_version))
+            packages.append(('pip', options.pip_version))
+        for path in options.requirements:
+            for name, version in install.parse_requirements(path):
+                # Requirements override the default versions
+                project = index.normalize_name(name)
+                packages = [(n, v) for n, v in packages
+                            if index.normalize_name(n) != project]
+                packages.append((name, version))
+        installer = install.Installer(
+            target,
+            cache_dir=options.cache,
+            index_dirs=options.index_dir,
+            pyrun_version=options.pyrun,
+            python_version=options.python,
+            python_unicode=options.python_unicode,
+            platform=options.platform,
+            pyrun_executable=options.pyrun_executable,
+            pypi_url=options.pypi_url or index.PYPI_URL,
+            offline=options.offline,
+            jobs=options.jobs,
+            log=self.log)
+        return installer, packages
+
+    def install_arguments(self, parser):
+        parser.add_argument(
+            'target',
+            help='installation directory')
+        self.add_install_options(parser)
 
     @command
     def install(self):
-        pass
 
+        """ Install PyRun, setuptools and pip into a directory.
+
+            The PyRun distribution and the wheels are taken from the
+            cache, if available, then from the --index-dir directories
+            and finally downloaded (unless --offline is given). All
+            files are stored in the content addressed cache, so later
+            installations don't need network access.
+
+        """
+        installer, packages = self.create_installer(self.options.target)
+        result = installer.install(
+            packages,
+            pyrun_distribution=self.options.pyrun_distribution)
+        self.output_result(result)
+        self.log('Installed PyRun in %s (%.1f seconds)' % (
+            result['target'], result['seconds']))
+        self.log('To run eGenix PyRun, use %s' % result['executable'])
+        return 0
+
+    def env_arguments(self, parser):
+        from pyrun_cli import store, env
+        subparsers = parser.add_subparsers(
+            dest='env_command',
+            metavar='env_command',
+        )
+        subparsers.required = True
+        create_parser = subparsers.add_parser(
+            'create',
+            help='create a new environment with PyRun, setuptools and pip')
+        create_parser.add_argument(
+            'target',
+            help='environment directory')
+        self.add_install_options(create_parser)
+        clone_parser = subparsers.add_parser(
+            'clone',
+            help='clone an existing environment')
+        clone_parser.add_argument(
+            'source',
+            help='environment to clone')
+        clone_parser.add_argument(
+            'target',
+            help='new environment directory')
+        clone_parser.add_argument(
+            '-j', '--jobs', type=int, default=env.DEFAULT_JOBS,
+            help='number of concurrent hash and link operations '
+            '(default: %(default)s)')
+        self.add_output_options(clone_parser)
+        for env_parser in (create_parser, clone_parser):
+            env_parser.add_argument(
+                '--store', default=None,
+                help='store directory; should be on the same file system '
+                'as the environments (default: $PYRUN_STORE or the store '
+                'subdir of the cache)')
+            env_parser.add_argument(
+                '--link', default=store.AUTO, choices=store.LINK_METHODS,
+                help='how to create files from the store; "auto" uses hard '
+                'links and falls back to reflinks and copies '
+                '(default: %(default)s)')
+
+    @command
+    def env(self):
+
+        """ Create or clone PyRun environments using a content
+            addressed store.
+
+            Identical files are shared between all environments using
+            hard links (or reflinks), so new environments are created
+            in milliseconds, need almost no extra disk space and share
+            the page cache for .so and .pyc files.
+
+            Note: Files in environments must not be modified in place.
+
+        """
+        from pyrun_cli import store, env
+        options = self.options
+        file_store = store.FileStore(
+            options.store or store.default_store_dir(),
+            method=options.link)
+        manager = env.EnvironmentManager(file_store,
+                                         jobs=options.jobs,
+                                         log=self.log)
+        if options.env_command == 'create':
+            installer, packages = self.create_installer(options.target)
+            result = manager.create(
+                options.target,
+                installer,
+                packages,
+                pyrun_distribution=options.pyrun_distribution)
+        else:
+            result = manager.clone(options.source, options.target)
+        self.output_result(result)
+        self.log('Created environment %s in %.3f seconds (%s)' % (
+            result['target'],
+            result['seconds'],
+            ', '.join('%s: %i' % item
+                      for item in sorted(result['methods'].items()))))
+        return 0
+
+    def image_arguments(self, parser):
+        from pyrun_cli import image
+        parser.add_argument(
+            'output',
+            help='image tar file to write')
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument(
+            '--installation', default=None,
+            help='PyRun installation or environment to use for the image')
+        source.add_argument(
+            '--pyrun-binary', default=None,
+            help='only use this PyRun binary (without site-packages)')
+        parser.add_argument(
+            '--app', default=None,
+            help='app ZIP file, script or directory to add to the image '
+            '(in /app/)')
+        parser.add_argument(
+            '--no-site-packages', action='store_true',
+            help="don't add the site-packages of the installation")
+        parser.add_argument(
+            '--tag', default=image.DEFAULT_TAG,
+            help='image name and tag (default: %(default)s)')
+        parser.add_argument(
+            '--entrypoint', default=None,
+            help='entry point command line (default: pyrun and the app '
+            'ZIP file or script)')
+        parser.add_argument(
+            '--cmd', default=None,
+            help='default arguments passed to the entry point')
+        parser.add_argument(
+            '-e', '--env', action='append', default=[],
+            help='set the environment variable NAME=VALUE in the image; '
+            'may be given more than once')
+        parser.add_argument(
+            '--workdir', default=None,
+            help='working directory (default: /app if an app is given)')
+        parser.add_argument(
+            '--user', default=None,
+            help='user to run the entry point as, e.g. 65534 for nobody')
+        parser.add_argument(
+            '--ca-certs', default=None,
+            help='CA certificate bundle to add (default: the system one)')
+        parser.add_argument(
+            '--no-ca-certs', action='store_true',
+            help="don't add CA certificates")
+        parser.add_argument(
+            '--add-library', action='append', default=[],
+            help='add this shared library and its dependencies, e.g. '
+            'libraries loaded via dlopen(); may be given more than once')
+        parser.add_argument(
+            '--timestamp', type=int, default=None,
+            help='time stamp for all files (default: $SOURCE_DATE_EPOCH '
+            'or 0)')
+        parser.add_argument(
+            '--pycache', default=None, metavar='PATH',
+            help='add a bytecode cache for the installation and app at '
+            'PATH (e.g. /var/cache/pyrun) and set PYRUN_PYCACHE to it')
+        parser.add_argument(
+            '--compress-level', type=int, default=image.DEFAULT_COMPRESS_LEVEL,
+            help='gzip compression level for the layers '
+            '(default: %(default)s)')
+        self.add_output_options(parser)
+
+    @command
+    def image(self):
+
+        """ Build a minimal OCI image tar file for a PyRun app.
+
+            The image contains the PyRun binary, its shared library
+            closure, CA certificates, site-packages and the app, in
+            layers ordered by how often they change. No container
+            runtime or base image is needed. Load the image with e.g.
+            "docker load -i <output>" or "podman load -i <output>".
+
+        """
+        import shlex
+        from pyrun_cli import image
+        options = self.options
+        for value in options.env:
+            if '=' not in value:
+                raise image.ImageError('invalid environment setting %r; '
+                                       'use NAME=VALUE' % value)
+        builder = image.ImageBuilder(
+            installation=options.installation,
+            pyrun=options.pyrun_binary,
+            app=options.app,
+            site_packages=not options.no_site_packages,
+            ca_certs=False if options.no_ca_certs else options.ca_certs,
+            extra_libraries=options.add_library,
+            timestamp=options.timestamp,
+            compress_level=options.compress_level,
+            pycache=options.pycache,
+            log=self.log)
+        result = builder.build(
+            options.output,
+            tag=options.tag,
+            entrypoint=(shlex.split(options.entrypoint)
+                        if options.entrypoint else None),
+            cmd=shlex.split(options.cmd) if options.cmd else None,
+            env=options.env,
+            workdir=options.workdir,
+            user=options.user)
+        self.output_result(result)
+        for layer in result['layers']:
+            self.log('  %-14s %6i files %10i bytes  %s' % (
+                layer['name'], layer['files'], layer['size'],
+                layer['digest']))
+        self.log('Wrote image %s (%s, %i bytes compressed)' % (
+            result['output'], result['tag'], result['size']))
+        return 0
+
+    def delta_arguments(self, parser):
+        from pyrun_cli import delta
+        subparsers = parser.add_subparsers(
+            dest='delta_command',
+            metavar='delta_command',
+        )
+        subparsers.required = True
+        create_parser = subparsers.add_parser(
+            'create',
+            help='create a delta for updating old to new')
+        create_parser.add_argument(
+            'old',
+            help='old version of the file')
+        create_parser.add_argument(
+            'new',
+            help='new version of the file')
+        create_parser.add_argument(
+            'delta',
+            help='delta file to write')
+        create_parser.add_argument(
+            '--compress-level', type=int,
+            default=delta.DEFAULT_COMPRESS_PRESET, choices=range(10),
+            metavar='0-9',
+            help='LZMA compression preset (default: %(default)s)')
+        apply_parser = subparsers.add_parser(
+            'apply',
+            help='apply a delta to the old version of a file')
+        apply_parser.add_argument(
+            'old',
+            help='old version of the file')
+        apply_parser.add_argument(
+            'delta',
+            help='delta file to apply')
+        apply_parser.add_argument(
+            'output', nargs='?', default=None,
+            help='file to write (default: update old in place)')
+        apply_parser.add_argument(
+            '--sha256', default=None,
+            help='expected SHA-256 hash of the result; checked in '
+            'addition to the hash stored in the delta')
+        for delta_parser in (create_parser, apply_parser):
+            self.add_output_options(delta_parser)
+
+    @command
+    def delta(self):
+
+        """ Create or apply binary deltas for PyRun binaries.
+
+            Deltas follow the layout of PyRun binaries (ELF sections,
+            frozen modules and the members of an appended ZIP file),
+            so that changing a few modules results in deltas of a few
+            KB. Applying a delta checks the SHA-256 hashes of the old
+            file and of the result; the output file is only written if
+            both match.
+
+        """
+        from pyrun_cli import delta
+        options = self.options
+        if options.delta_command == 'create':
+            result = delta.create_delta(
+                options.old,
+                options.new,
+                options.delta,
+                compress_preset=options.compress_level)
+            self.output_result(result)
+            self.log('Wrote delta %s (%i bytes for %i bytes, '
+                     '%i changed segments) in %.3f seconds' % (
+                         result['output'], result['size'],
+                         result['new_size'],
+                         len(result['changed_segments']),
+                         result['seconds']))
+        else:
+            result = delta.apply_delta(
+                options.old,
+                options.delta,
+                options.output or options.old,
+                sha256=options.sha256)
+            self.output_result(result)
+            self.log('Wrote %s (sha256 %s) in %.3f seconds' % (
+                result['output'], result['sha256'], result['seconds']))
+        return 0
+
+    def optimize_site_arguments(self, parser):
+        from pyrun_cli import bytecode
+        parser.add_argument(
+            'target',
+            help='PyRun installation or site-packages dir')
+        parser.add_argument(
+            '--python', default=None,
+            help='PyRun interpreter to compile with (default: bin/pyrun '
+            'of the installation)')
+        parser.add_argument(
+            '-O', '--optimization-levels', default='0,1,2',
+            help='comma separated optimization levels to compile for '
+            '(default: %(default)s)')
+        parser.add_argument(
+            '--strip-sources', action='store_true',
+            help='remove the .py files; only the first optimization level '
+            'is compiled for these, since Python ignores optimized .pyc '
+            'files without source')
+        parser.add_argument(
+            '--keep-source', action='append', default=[], metavar='PATTERN',
+            help='don\'t strip .py files matching the pattern (relative to '
+            'site-packages, e.g. "mypkg/templates/*"); may be given '
+            'multiple times')
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=bytecode.DEFAULT_JOBS,
+            help='number of parallel compile processes '
+            '(default: %(default)s)')
+        self.add_output_options(parser)
+
+    @command
+    def optimize_site(self):
+
+        """ Compile all site-packages modules to unchecked hash based
+            .pyc files for optimization levels 0, 1 and 2.
+
+            Python then imports the modules without checking the
+            source files and -O/-OO runs don't need to recompile them,
+            which speeds up imports in immutable deployments (e.g.
+            read-only containers). Optionally, the .py files are
+            removed.
+
+            Note: The .pyc files are not updated when .py files
+            change, so don't use this for installations which are
+            still modified.
+
+        """
+        from pyrun_cli import bytecode
+        options = self.options
+        levels = bytecode.parse_levels(options.optimization_levels)
+        python, site_packages = bytecode.find_installation(
+            options.target, options.python)
+        compiler = bytecode.BytecodeCompiler(python,
+                                             jobs=options.jobs,
+                                             log=self.log)
+        result = bytecode.optimize_site(
+            site_packages,
+            compiler,
+            levels=levels,
+            strip_sources=options.strip_sources,
+            keep_sources=options.keep_source,
+            log=self.log)
+        self.output_result(result)
+        self.log('Wrote %i .pyc files for %i modules (%i sources stripped) '
+                 'in %.3f seconds' % (
+                     result['pyc_files'], result['modules'],
+                     result['stripped'], result['seconds']))
+        return 0
+
+    def pycache_arguments(self, parser):
+        from pyrun_cli import bytecode
+        parser.add_argument(
+            'directory',
+            help='bytecode cache dir to fill (use as PYRUN_PYCACHE)')
+        parser.add_argument(
+            '--installation', default=None,
+            help='compile the lib/ files (incl. site-packages) of this '
+            'PyRun installation')
+        parser.add_argument(
+            '--app', action='append', default=[], metavar='PATH',
+            help='compile this app dir or script; may be given multiple '
+            'times')
+        parser.add_argument(
+            '--script', action='append', default=[], metavar='PATH',
+            help='compile this main script; may be given multiple times')
+        parser.add_argument(
+            '--map', action='append', default=[], metavar='PATH=RUNTIME',
+            help='files under PATH are used as RUNTIME at run time, e.g. '
+            'in a container image; may be given multiple times')
+        parser.add_argument(
+            '--python', default=None,
+            help='PyRun interpreter to compile with (default: bin/pyrun '
+            'of the installation)')
+        parser.add_argument(
+            '-O', '--optimization-levels', default='0,1,2',
+            help='comma separated optimization levels to compile for '
+            '(default: %(default)s)')
+        parser.add_argument(
+            '--invalidation-mode', default='checked-hash',
+            choices=sorted(bytecode.INVALIDATION_MODES),
+            help='how Python checks that the .pyc files are up to date '
+            '(default: %(default)s)')
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=bytecode.DEFAULT_JOBS,
+            help='number of parallel compile processes '
+            '(default: %(default)s)')
+        self.add_output_options(parser)
+
+    @command
+    def pycache(self):
+
+        """ Fill a bytecode cache dir for use with PYRUN_PYCACHE.
+
+            PyRun uses the dir given in PYRUN_PYCACHE as
+            sys.pycache_prefix, also for the main script. Filling the
+            cache when building an image or volume lets containers
+            with read-only file systems start without compiling
+            anything. Use --map when the files are available under
+            different paths at run time.
+
+        """
+        from pyrun_cli import bytecode
+        options = self.options
+        levels = bytecode.parse_levels(options.optimization_levels)
+        mapping = []
+        for value in options.map:
+            path, sep, runtime_path = value.partition('=')
+            if not sep or not path or not os.path.isabs(runtime_path):
+                raise bytecode.BytecodeError(
+                    'invalid mapping %r; use PATH=RUNTIME with an absolute '
+                    'RUNTIME path' % value)
+            mapping.append((os.path.abspath(path), runtime_path))
+        # Longest paths first
+        mapping.sort(key=lambda item: len(item[0]), reverse=True)
+
+        def runtime_path(path):
+            path = os.path.abspath(path)
+            for prefix, runtime_prefix in mapping:
+                if path == prefix or path.startswith(prefix + os.sep):
+                    return runtime_prefix + path[len(prefix):]
+            return path
+
+        python = options.python
+        paths = options.app + options.script
+        if options.installation is not None:
+            python, site_packages = bytecode.find_installation(
+                options.installation, python)
+            paths.insert(0, os.path.dirname(site_packages))
+        if python is None:
+            raise bytecode.BytecodeError(
+                'please specify the PyRun interpreter using --python or '
+                '--installation')
+        if not paths:
+            raise bytecode.BytecodeError('nothing to compile; please use '
+                                         '--installation, --app or --script')
+        sources = []
+        for path in paths:
+            if not os.path.exists(path):
+                raise bytecode.BytecodeError('%s not found' % path)
+            sources.extend(bytecode.map_sources(path, runtime_path(path)))
+        compiler = bytecode.BytecodeCompiler(python,
+                                             jobs=options.jobs,
+                                             log=self.log)
+        result = bytecode.fill_pycache(
+            os.path.abspath(options.directory),
+            sources,
+            compiler,
+            levels=levels,
+            mode=bytecode.INVALIDATION_MODES[options.invalidation_mode],
+            log=self.log)
+        self.output_result(result)
+        self.log('Wrote %i .pyc files for %i modules in %.3f seconds' % (
+            result['pyc_files'], result['modules'], result['seconds']))
+        return 0
 
     def main(self, argv):
+        from pyrun_cli import cache, index, install, wheels, store, env, \
+             image, delta, bytecode
+        errors = (
+            cache.CacheError,
+            index.PackageIndexError,
+            install.InstallError,
+            wheels.WheelError,
+            store.StoreError,
+            env.EnvError,
+            image.ImageError,
+            delta.DeltaError,
+            bytecode.BytecodeError,
+        )
         self.parse_argv(argv)
+        try:
+            return getattr(self, self.options.command.replace('-', '_'))()
+        except errors as reason:
+            sys.stderr.write('%s: error: %s\n' % (
+                self.main_parser.prog, reason))
+            return 1
 
 ###
 
 def entry_point(argv):
     cli = PyRunCLI()
-    cli.main(sys.argv)
+    return cli.main(argv)
 
 ###
 
 if __name__ == '__main__':
-    cli = PyRunCLI()
+    sys.exit(entry_point(sys.argv))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.store - Content addressed file store for environments
+
+    The store keeps one read-only copy of every file used in PyRun
+    environments, addressed by the SHA-256 hash of its content (and
+    the executable flag, since hard links share the file mode):
+
+        <store>/files/<2 hex chars>/<62 hex chars>[-x]
+
+    Environment files are materialized from the store as hard links
+    (the default; all environments then share the same inodes and
+    thus the page cache for .so and .pyc files), reflinks (copy on
+    write clones on file systems supporting them, e.g. XFS or Btrfs)
+    or plain copies.
+
+    Note: Hard linked files must not be modified in place, since this
+    would change the file in all environments. Tools like pip replace
+    files instead of rewriting them, which is safe.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import errno
+import shutil
+import tempfile
+
+from pyrun_cli import cache
+
+### Globals
+
+# Link methods
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+COPY = 'copy'
+AUTO = 'auto'
+LINK_METHODS = (AUTO, HARDLINK, REFLINK, COPY)
+
+# ioctl() request code for cloning files on Linux (FICLONE from
+# linux/fs.h)
+FICLONE = 0x40049409
+
+### Errors
+
+class StoreError(Exception):
+
+    """ Error raised by the store.
+
+    """
+    pass
+
+### Helpers
+
+def default_store_dir():
+
+    """ Return the default store dir: $PYRUN_STORE or the "store"
+        subdir of the default cache dir.
+
+    """
+    path = os.environ.get('PYRUN_STORE')
+    if path:
+        return path
+    return os.path.join(cache.default_cache_dir(), 'store')
+
+def reflink(source, target):
+
+    """ Create target as reflink (copy on write clone) of source.
+
+        Raises an OSError, if the file system does not support this.
+
+    """
+    import fcntl
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError:
+                dst.close()
+                os.remove(target)
+                raise
+
+###
+
+class FileStore:
+
+    """ Content addressed store in directory.
+
+    """
+    def __init__(self, directory, method=AUTO):
+
+        if method not in LINK_METHODS:
+            raise StoreError('unknown link method %r' % method)
+        self.directory = os.path.abspath(directory)
+        self.method = method
+
+    def blob_path(self, sha256, executable=False):
+
+        """ Return the path of the store file for content hash sha256
+            (the file may not exist).
+
+        """
+        sha256 = sha256.lower()
+        return os.path.join(self.directory, 'files', sha256[:2],
+                            sha256[2:] + ('-x' if executable else ''))
+
+    def add(self, path, executable=None, sha256=None):
+
+        """ Add the file path to the store and return (sha256,
+            executable, blob path).
+
+            executable defaults to the executable flag of path. sha256
+            may be given, if known, to avoid hashing the file.
+
+        """
+        if executable is None:
+            executable = os.access(path, os.X_OK)
+        if sha256 is None:
+            sha256 = cache.file_hash(path)
+        blob = self.blob_path(sha256, executable)
+        if os.path.exists(blob):
+            return sha256, executable, blob
+        directory = os.path.dirname(blob)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temp_path)
+            if cache.file_hash(temp_path) != sha256:
+                raise StoreError('%s changed while adding it to the store' %
+                                 path)
+            # Store files are read-only, to protect them against
+            # accidental modification via hard links
+            os.chmod(temp_path, 0o555 if executable else 0o444)
+            os.replace(temp_path, blob)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return sha256, executable, blob
+
+    def is_linked(self, path, sha256, executable):
+
+        """ Return True, if path is a hard link to the store file for
+            sha256 and executable.
+
+        """
+        try:
+            path_stat = os.lstat(path)
+            blob_stat = os.stat(self.blob_path(sha256, executable))
+        except OSError:
+            return False
+        return (path_stat.st_ino == blob_stat.st_ino and
+                path_stat.st_dev == blob_stat.st_dev)
+
+    def materialize(self, sha256, executable, target):
+
+        """ Create the file target from the store file for sha256 and
+            executable using the store's link method.
+
+            Returns the method used.
+
+        """
+        blob = self.blob_path(sha256, executable)
+        if not os.path.exists(blob):
+            raise StoreError('%s is missing in the store' % blob)
+        if os.path.lexists(target):
+            os.remove(target)
+        method = self.method
+        if method in (AUTO, HARDLINK):
+            try:
+                os.link(blob, target)
+                return HARDLINK
+            except OSError as reason:
+                # Fall back to reflinks or copies across file systems
+                # and when reaching the link count limit
+                if (method == HARDLINK or
+                    reason.errno not in (errno.EXDEV, errno.EMLINK,
+                                         errno.EPERM, errno.ENOTSUP)):
+                    raise
+        if method in (AUTO, REFLINK):
+            try:
+                reflink(blob, target)
+                method = REFLINK
+            except (OSError, ImportError):
+                if method == REFLINK:
+                    raise
+                shutil.copyfile(blob, target)
+                method = COPY
+        else:
+            shutil.copyfile(blob, target)
+        os.chmod(target, 0o755 if executable else 0o644)
+        return method
+
+    def write(self, data, target, executable=False):
+
+        """ Write data to the file target, without using the store
+            (e.g. for files which have to be modified per environment).
+
+        """
+        if os.path.lexists(target):
+            os.remove(target)
+        with open(target, 'wb') as f:
+            f.write(data)
+        os.chmod(target, 0o755 if executable else 0o644)
+
+    def read(self, sha256, executable):
+
+        """ Return the content of the store file for sha256 and
+            executable.
+
+        """
+        with open(self.blob_path(sha256, executable), 'rb') as f:
+            return f.read()
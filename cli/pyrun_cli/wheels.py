@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+    pyrun_cli.wheels - Install wheels without running pip
+
+    Implements the parts of the wheel installation (PEP 427) needed to
+    set up a PyRun installation: unpacking into site-packages, moving
+    .data/ entries into place, rewriting script shebangs, creating the
+    console script wrappers and writing INSTALLER and RECORD.
+
+    Written by Marc-Andre Lemburg.
+    Copyright (c) 2024, eGenix.com Software GmbH; mailto:info@egenix.com
+    License: Apache-2.0
+
+"""
+import os
+import re
+import csv
+import base64
+import hashlib
+import zipfile
+import configparser
+
+### Globals
+
+# Value written to the INSTALLER file of installed distributions
+INSTALLER = 'pyrun_cli'
+
+# Console script wrapper, as generated by pip
+SCRIPT_TEMPLATE = """\
+#!%(executable)s
+# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(func)s())
+"""
+
+# Entry point spec "module:attr.attr"
+ENTRY_POINT_RE = re.compile(
+    r'^(?P<module>[\w.]+)\s*(:\s*(?P<attrs>[\w.]+))?\s*(\[.*\])?\s*$')
+
+### Errors
+
+class WheelError(Exception):
+
+    """ Error raised for invalid or unsupported wheels.
+
+    """
+    pass
+
+### Helpers
+
+def record_hash(data):
+
+    """ Return the RECORD hash entry for the bytes data.
+
+    """
+    digest = hashlib.sha256(data).digest()
+    return 'sha256=' + base64.urlsafe_b64encode(digest).rstrip(b'=').decode(
+        'ascii')
+
+def safe_path(base, relpath):
+
+    """ Return the path of relpath inside the directory base.
+
+        Raises a WheelError, if relpath would point outside of base.
+
+    """
+    path = os.path.normpath(os.path.join(base, relpath))
+    if (os.path.isabs(relpath) or
+        os.path.commonpath([base, path]) != base):
+        raise WheelError('unsafe path in wheel: %r' % relpath)
+    return path
+
+def find_dist_info(names):
+
+    """ Return the .dist-info directory name found in the list of wheel
+        member names.
+
+    """
+    for name in names:
+        parts = name.split('/')
+        if (len(parts) == 2 and
+            parts[0].endswith('.dist-info') and
+            parts[1] == 'WHEEL'):
+            return parts[0]
+    raise WheelError('wheel does not contain a .dist-info/WHEEL file')
+
+def rewrite_shebang(data, executable):
+
+    """ Return the script data with a "#!python" shebang line replaced
+        by a shebang pointing to executable.
+
+    """
+    if data.startswith(b'#!python'):
+        end = data.find(b'\n')
+        if end < 0:
+            end = len(data)
+        return b'#!' + os.fsencode(executable) + data[end:]
+    return data
+
+def console_scripts(entry_points_data):
+
+    """ Return a list of (name, module, attrs) for the console_scripts
+        defined in the entry_points.txt data.
+
+    """
+    parser = configparser.ConfigParser(delimiters=('=',))
+    parser.optionxform = str
+    parser.read_string(entry_points_data)
+    if not parser.has_section('console_scripts'):
+        return []
+    result = []
+    for name, spec in parser.items('console_scripts'):
+        match = ENTRY_POINT_RE.match(spec)
+        if match is None or not match.group('attrs'):
+            raise WheelError('invalid console script entry point %s = %s' %
+                             (name, spec))
+        result.append((name, match.group('module'), match.group('attrs')))
+    return result
+
+###
+
+class InstallScheme:
+
+    """ Target directories of a PyRun installation.
+
+    """
+    def __init__(self, prefix, libversion, executable):
+
+        self.prefix = os.path.abspath(prefix)
+        self.site_packages = os.path.join(
+            self.prefix, 'lib', 'python' + libversion, 'site-packages')
+        self.scripts = os.path.join(self.prefix, 'bin')
+        self.headers = os.path.join(
+            self.prefix, 'include', 'python' + libversion)
+        self.data = self.prefix
+        # Interpreter used in script shebangs
+        self.executable = os.path.join(self.scripts, executable)
+
+    def data_dir(self, key):
+
+        """ Return the target directory for the .data/<key>/ wheel
+            entries.
+
+        """
+        if key in ('purelib', 'platlib'):
+            return self.site_packages
+        elif key == 'scripts':
+            return self.scripts
+        elif key == 'headers':
+            return self.headers
+        elif key == 'data':
+            return self.data
+        raise WheelError('unsupported .data/ directory %r in wheel' % key)
+
+def install_wheel(path, scheme):
+
+    """ Install the wheel file path using the InstallScheme scheme.
+
+        Returns the name of the .dist-info directory.
+
+    """
+    records = []
+
+    def write_file(target, data, mode):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        with open(target, 'wb') as f:
+            f.write(data)
+        os.chmod(target, mode)
+        records.append((target, record_hash(data), len(data)))
+
+    with zipfile.ZipFile(path) as wheel:
+        names = wheel.namelist()
+        dist_info = find_dist_info(names)
+        data_prefix = dist_info[:-len('.dist-info')] + '.data/'
+        record_name = dist_info + '/RECORD'
+        for info in wheel.infolist():
+            name = info.filename
+            if name.endswith('/') or name == record_name:
+                continue
+            data = wheel.read(info)
+            # Executable bits are stored in the upper bits of
+            # external_attr
+            mode = 0o755 if (info.external_attr >> 16) & 0o111 else 0o644
+            if name.startswith(data_prefix):
+                key, sep, relpath = name[len(data_prefix):].partition('/')
+                base = scheme.data_dir(key)
+                if key == 'scripts':
+                    data = rewrite_shebang(data, scheme.executable)
+                    mode = 0o755
+            else:
+                base, relpath = scheme.site_packages, name
+            write_file(safe_path(base, relpath), data, mode)
+
+        # Console scripts
+        entry_points_name = dist_info + '/entry_points.txt'
+        if entry_points_name in names:
+            entry_points = wheel.read(entry_points_name).decode('utf-8')
+            for name, module, attrs in console_scripts(entry_points):
+                import_name = attrs.split('.')[0]
+                script = SCRIPT_TEMPLATE % {
+                    'executable': scheme.executable,
+                    'module': module,
+                    'import_name': import_name,
+                    'func': attrs,
+                }
+                write_file(safe_path(scheme.scripts, name),
+                           script.encode('utf-8'), 0o755)
+
+    # INSTALLER and RECORD
+    dist_info_dir = os.path.join(scheme.site_packages, dist_info)
+    write_file(os.path.join(dist_info_dir, 'INSTALLER'),
+               (INSTALLER + '\n').encode('ascii'), 0o644)
+    record_path = os.path.join(dist_info_dir, 'RECORD')
+    with open(record_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for target, hash_value, size in records:
+            writer.writerow((os.path.relpath(target, scheme.site_packages),
+                             hash_value,
+                             size))
+        writer.writerow((os.path.relpath(record_path, scheme.site_packages),
+                         '',
+                         ''))
+    return dist_info
@@ -68,6 +68,14 @@ Options:
               Replace prefix with f in the source path references
               contained in the resulting binary.
 
+-L libname:   Build a shared runtime: link the frozen modules, config
+              and Python library (including the static extensions)
+              into the shared library libname and create a small
+              launcher executable for the script, which loads it.
+              The Python library has to be compiled as position
+              independent code (e.g. CFLAGS=-fPIC). Only supported
+              with the GNU linker.
+
 Arguments:
 
 script:       The Python script to be executed by the resulting binary.
@@ -103,6 +111,7 @@ import makeconfig
 import makefreeze
 import makemakefile
 import parsesetup
+import sizereport
 import bkfile
 
 
@@ -122,6 +131,7 @@ def main():
     win = sys.platform[:3] == 'win'
     replace_paths = []                  # settable with -r option
     error_if_any_missing = 0
+    shared_lib = None                   # settable with -L option
 
     # default the exclude list for each platform
     if win: exclude = exclude + [
@@ -160,7 +170,7 @@ def main():
 
     # Now parse the command line with the extras inserted.
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'r:a:dEe:hmo:p:P:qs:wX:x:l:')
+        opts, args = getopt.getopt(sys.argv[1:], 'r:a:dEe:hmo:p:P:qs:wX:x:l:L:')
     except getopt.error as msg:
         usage('getopt error: ' + str(msg))
 
@@ -198,6 +208,10 @@ def main():
             error_if_any_missing = 1
         if o == '-l':
             addn_link.append(a)
+        if o == '-L':
+            if win:
+                usage("-L libname option not supported on Windows")
+            shared_lib = a
         if o == '-a':
             modulefinder.AddPackagePath(*a.split("=", 2))
         if o == '-r':
@@ -397,7 +411,7 @@ def main():
 
     # generate output for frozen modules
     files = makefreeze.makefreeze(base, dict, debug, custom_entry_point,
-                                  fail_import)
+                                  fail_import, shared=bool(shared_lib))
 
     # look for unfrozen modules (builtin and of unknown origin)
     builtins = []
@@ -464,6 +478,12 @@ def main():
     cflags = ['$(BASECFLAGS)', '$(OPT)']
     cppflags = defines + includes
     libs = [os.path.join(libdir, '$(LDLIBRARY)')]
+    if shared_lib:
+        # Compile as PIC and include all of the Python library, so
+        # that the launcher and shared extensions find the complete
+        # Python API in the shared library
+        cflags.append('$(CCSHARED)')
+        libs = ['-Wl,--whole-archive'] + libs + ['-Wl,--no-whole-archive']
 
     somevars = {}
     if os.path.exists(makefile_in):
@@ -478,7 +498,11 @@ def main():
             ['$(MODLIBS)', '$(LIBS)', '$(SYSLIBS)']
 
     with bkfile.open(makefile, 'w') as outfp:
-        makemakefile.makemakefile(outfp, somevars, files, base_target)
+        makemakefile.makemakefile(outfp, somevars, files, base_target,
+                                  shared_lib)
+
+    # write the binary size attribution report
+    sizereport.write_report(base + 'sizereport.json', dict, builtins)
 
     # Done!
 
@@ -487,6 +511,8 @@ def main():
         print('to build the target:', base_target)
     else:
         print('Now run "make" to build the target:', base_target)
+    if shared_lib:
+        print('The target needs the shared runtime', shared_lib)
 
 
 # Print usage message and exit
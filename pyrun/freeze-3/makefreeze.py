@@ -12,6 +12,14 @@ header = """
 
 static struct _frozen _PyImport_FrozenModules[] = {
 """
+
+# Header used for shared runtimes: the table is exported from the
+# shared library and set by the launcher (see launcher_entry_point)
+shared_header = """
+#include "Python.h"
+
+struct _frozen _PyFreeze_FrozenModules[] = {
+"""
 trailer = """\
     {0, 0, 0} /* sentinel */
 };
@@ -52,7 +60,88 @@ main(int argc, char **argv)
 
 """
 
-default_entry_point = """
+# Prefetching of the frozen code region, used by the entry points.
+#
+# If the PYRUN_PREFETCH environment variable is set to 1, the kernel is
+# asked to read ahead the read-only segments (text and rodata, which
+# includes the frozen modules) of the object containing the frozen
+# modules table using madvise(MADV_WILLNEED). This avoids the many
+# small page faults when cold starting from slow storage. With 2, the
+# segments are additionally marked with MADV_HUGEPAGE, so that kernels
+# supporting transparent huge pages for read-only file mappings
+# (CONFIG_READ_ONLY_THP_FOR_FS) can map them using huge pages, which
+# reduces iTLB misses. Only supported on Linux.
+prefetch_code = """
+
+#if defined(__linux__)
+#include <link.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+struct prefetch_request {
+        uintptr_t address;
+        int hugepages;
+};
+
+static int
+prefetch_object(struct dl_phdr_info *info, size_t size, void *data)
+{
+        struct prefetch_request *request = (struct prefetch_request *)data;
+        uintptr_t pagesize = (uintptr_t)sysconf(_SC_PAGESIZE);
+        uintptr_t start, end;
+        int i, found = 0;
+
+        /* Only handle the object containing the address */
+        for (i = 0; i < info->dlpi_phnum; i++) {
+                const ElfW(Phdr) *phdr = &info->dlpi_phdr[i];
+                start = info->dlpi_addr + phdr->p_vaddr;
+                if (phdr->p_type == PT_LOAD &&
+                    request->address >= start &&
+                    request->address < start + phdr->p_memsz)
+                        found = 1;
+        }
+        if (!found)
+                return 0;
+
+        /* Advise on the read-only segments */
+        for (i = 0; i < info->dlpi_phnum; i++) {
+                const ElfW(Phdr) *phdr = &info->dlpi_phdr[i];
+                if (phdr->p_type != PT_LOAD || (phdr->p_flags & PF_W))
+                        continue;
+                start = (info->dlpi_addr + phdr->p_vaddr) & ~(pagesize - 1);
+                end = info->dlpi_addr + phdr->p_vaddr + phdr->p_filesz;
+                madvise((void *)start, end - start, MADV_WILLNEED);
+#ifdef MADV_HUGEPAGE
+                if (request->hugepages)
+                        madvise((void *)start, end - start, MADV_HUGEPAGE);
+#endif
+        }
+        return 1;
+}
+
+static void
+prefetch_frozen_code(const void *address)
+{
+        struct prefetch_request request;
+        const char *value = getenv("PYRUN_PREFETCH");
+
+        if (value == NULL || value[0] == '\\0' || value[0] == '0')
+                return;
+        request.address = (uintptr_t)address;
+        request.hugepages = (value[0] == '2');
+        dl_iterate_phdr(prefetch_object, &request);
+}
+#else
+static void
+prefetch_frozen_code(const void *address)
+{
+}
+#endif
+"""
+
+default_entry_point = prefetch_code + """
 
 int
 main(int argc, char **argv)
@@ -64,12 +153,37 @@ main(int argc, char **argv)
         Py_NoSiteFlag++;        /* Don't import site.py */
 
         PyImport_FrozenModules = _PyImport_FrozenModules;
+        prefetch_frozen_code(_PyImport_FrozenModules);
         return Py_FrozenMain(argc, argv);
 }
 
 """
 
-def makefreeze(base, dict, debug=0, entry_point=None, fail_import=()):
+# Entry point of the launcher for shared runtimes; written to
+# launcher.c
+launcher_entry_point = """
+#include "Python.h"
+
+extern struct _frozen _PyFreeze_FrozenModules[];
+""" + prefetch_code + """
+
+int
+main(int argc, char **argv)
+{
+        extern int Py_FrozenMain(int, char **);
+
+        /* Disabled, since we want to default to non-optimized mode: */
+        /* Py_OptimizeFlag++; */
+        Py_NoSiteFlag++;        /* Don't import site.py */
+
+        PyImport_FrozenModules = _PyFreeze_FrozenModules;
+        prefetch_frozen_code(_PyFreeze_FrozenModules);
+        return Py_FrozenMain(argc, argv);
+}
+"""
+
+def makefreeze(base, dict, debug=0, entry_point=None, fail_import=(),
+               shared=False):
     if entry_point is None: entry_point = default_entry_point
     done = []
     files = []
@@ -95,7 +209,7 @@ def makefreeze(base, dict, debug=0, entry_point=None, fail_import=()):
     with bkfile.open(base + 'frozen.c', 'w') as outfp:
         for mod, mangled, size in done:
             outfp.write('extern const unsigned char _Py_M_%s[];\n' % mangled)
-        outfp.write(header)
+        outfp.write(shared_header if shared else header)
         for mod, mangled, size in done:
             if PY311GE:
                 # New 3.11 format for packages
@@ -116,7 +230,11 @@ def makefreeze(base, dict, debug=0, entry_point=None, fail_import=()):
         for mod in fail_import:
             outfp.write('\t{"%s", NULL, 0},\n' % (mod,))
         outfp.write(trailer)
-        outfp.write(entry_point)
+        if not shared:
+            outfp.write(entry_point)
+    if shared:
+        with bkfile.open(base + 'launcher.c', 'w') as outfp:
+            outfp.write(launcher_entry_point)
     return files
 
 
@@ -23,7 +23,7 @@ def filter_module_ldflags(value):
     ]
     return ' '.join(shared_libs)
 
-def makemakefile(outfp, makevars, files, target):
+def makemakefile(outfp, makevars, files, target, shared_lib=None):
     outfp.write("# Makefile generated by freeze.py script\n\n")
 
     keys = sorted(makevars.keys())
@@ -46,6 +46,30 @@ def makemakefile(outfp, makevars, files, target):
             files[i] = dest
             deps.append(dest)
 
+    if shared_lib:
+        # Shared runtime: link everything into shared_lib and build
+        # target as launcher for it (see makefreeze.launcher_entry_point)
+        outfp.write("launcher.o: launcher.c\n")
+        outfp.write("\t$(CC) $(PY_CFLAGS) $(PY_CPPFLAGS) -c launcher.c\n")
+        outfp.write("\n%s: %s\n" % (shared_lib, ' '.join(deps)))
+        outfp.write("\t$(LINKCC) -shared $(PY_LDFLAGS) %s -o %s $(LDLAST)\n" %
+                    (' '.join(files), shared_lib))
+        outfp.write("\n%s: launcher.o %s\n" % (target, shared_lib))
+        outfp.write("\t$(LINKCC) $(PY_LDFLAGS) launcher.o -L. -l:%s -o %s $(LDLAST)\n" %
+                    (shared_lib, target))
+        # Debug variant: a launcher for an unstripped copy of shared_lib,
+        # so that stripping shared_lib doesn't affect it
+        debug_target = target + '-debug'
+        debug_lib = '%s-debug%s' % os.path.splitext(shared_lib)
+        outfp.write("\n%s: %s\n" % (debug_lib, shared_lib))
+        outfp.write("\tcp %s %s\n" % (shared_lib, debug_lib))
+        outfp.write("\n%s: launcher.o %s\n" % (debug_target, debug_lib))
+        outfp.write("\t$(LINKCC) $(PY_LDFLAGS) launcher.o -L. -l:%s -o %s $(LDLAST)\n" %
+                    (debug_lib, debug_target))
+        outfp.write("\nclean:\n\t-rm -f *.o %s %s %s %s\n" % (
+            target, shared_lib, debug_target, debug_lib))
+        return
+
     outfp.write("\n%s: %s\n" % (target, ' '.join(deps)))
     outfp.write("\t$(LINKCC) $(PY_LDFLAGS) $(LINKFORSHARED) %s -o %s $(LDLAST)\n" %
                 (' '.join(files), target))
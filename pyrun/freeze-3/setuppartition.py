@@ -0,0 +1,259 @@
+#! /usr/bin/env python3
+
+"""Usage driven static/shared partitioning of Setup files.
+
+usage: setuppartition.py [options] Setup trace...
+
+Reads the module lines of the *static* section of the Setup file
+(e.g. pyrun/Setup.PyRun-3.12) and the import traces, and moves the
+cold, large static modules to the *shared* section (built as
+lib-dynload extensions, which are only loaded when imported) or to
+the *disabled* section (to build them separately, e.g. as optional
+add-on packs). Hot modules and modules on the keep list stay static.
+
+Each trace is the module usage of one binary (e.g. one app). These
+trace formats are supported:
+
+* import time traces as written by -X importtime or PYRUN_IMPORTTIME,
+
+* JSON runtime reports as written by PYRUN_REPORT=json:<path>.
+
+The size of the modules is taken from the sizereport.json written by
+freeze.py. A report with the resulting size change and the estimated
+startup change for each trace is printed to stdout.
+
+Options:
+
+-s report:    sizereport.json of the current build (required)
+-b results:   JSON results of tests/bench_imports.py; adds the
+              measured import times of the moved modules to the report
+-o file:      write the new Setup file to file; default: don't write
+-k module:    always keep module static; may be given more than once
+-u fraction:  minimum fraction of the traces which have to import a
+              module for it to be hot; default 0.0, i.e. all modules
+              imported by at least one trace are hot
+-m size:      minimum compressed size in bytes of cold modules to move;
+              smaller ones stay static; default 16384
+-c section:   section for the cold modules: shared or disabled;
+              default shared
+-l us:        estimated cost of loading a shared extension in
+              microseconds, used for the startup estimate; default 150
+-h:           print this help message
+"""
+
+import getopt
+import json
+import re
+import sys
+
+import sizereport
+
+# Modules which are always kept static: they are needed for running
+# pyrun itself (e.g. importing from the ZIP files appended to
+# multi-app binaries)
+default_keep_static = ['zlib', 'binascii', '_struct', 'math', 'select',
+                       'fcntl', '_posixsubprocess']
+
+# Setup file lines
+module_line = re.compile(r'^([A-Za-z_][A-Za-z0-9_.]*)\s+[^=\s]')
+section_line = re.compile(r'^\*(static|shared|disabled)\*\s*$')
+importtime_line = re.compile(
+    r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S+)\s*$')
+
+
+# Setup files
+
+def read_setup(filename):
+    """ Return (lines, static) for the Setup file filename.
+
+        static maps the module names of the *static* section to their
+        line index.
+    """
+    with open(filename) as infp:
+        lines = infp.read().splitlines()
+    static = {}
+    section = 'static'
+    for i, line in enumerate(lines):
+        m = section_line.match(line)
+        if m:
+            section = m.group(1)
+            continue
+        if section != 'static':
+            continue
+        m = module_line.match(line)
+        if m:
+            static[m.group(1)] = i
+    return lines, static
+
+
+def partition_setup(lines, static, cold, section='shared'):
+    """ Return the lines of the Setup file with the static modules
+        cold moved to the *section* section.
+    """
+    moved = sorted(static[mod] for mod in cold)
+    if not moved:
+        return list(lines)
+    marker = '*%s*' % section
+    block = ['',
+             '# Cold static modules moved here by setuppartition.py',
+             ] + [lines[i] for i in moved] + ['']
+    moved_lines = set(moved)
+    result = [line for i, line in enumerate(lines) if i not in moved_lines]
+    for i, line in enumerate(result):
+        if line.strip() == marker:
+            result[i + 1:i + 1] = block
+            break
+    else:
+        result.extend(['', '# --- Moved by setuppartition.py ---', '',
+                       marker] + block)
+    return result
+
+
+# Traces
+
+def read_trace(filename):
+    """ Return a dict mapping the module names imported in the trace
+        filename to their import time in microseconds (or None, if not
+        available).
+    """
+    with open(filename) as infp:
+        data = infp.read()
+    if data.lstrip().startswith('{'):
+        report = json.loads(data)
+        return dict.fromkeys(report['modules'])
+    modules = {}
+    for line in data.splitlines():
+        m = importtime_line.match(line)
+        if m:
+            modules[m.group(3)] = int(m.group(1))
+    return modules
+
+
+def module_usage(traces):
+    """ Return a dict mapping module names to the fraction of traces
+        importing them.
+    """
+    usage = {}
+    for modules in traces.values():
+        for mod in modules:
+            usage[mod] = usage.get(mod, 0) + 1
+    for mod in usage:
+        usage[mod] = usage[mod] / len(traces)
+    return usage
+
+
+# Partitioning
+
+def cold_modules(static, sizes, usage, keep=(), min_usage=0.0,
+                 min_size=16384):
+    """ Return the sorted list of cold static modules to move.
+    """
+    cold = []
+    for mod in static:
+        if mod in keep:
+            continue
+        if usage.get(mod, 0.0) > 0.0 and usage[mod] >= min_usage:
+            # Hot module
+            continue
+        entry = sizes.get(mod)
+        if entry is None or (entry['compressed_size'] or 0) < min_size:
+            continue
+        cold.append(mod)
+    return sorted(cold)
+
+
+def show(cold, sizes, traces, load_us=150, bench=None):
+    total_size = 0
+    total_compressed = 0
+    print('Modules to move out of the binary:')
+    print()
+    print('%10s %10s %10s  %s' % ('size', 'compressed', 'import_us', 'name'))
+    for mod in cold:
+        entry = sizes[mod]
+        size = entry['object_size'] or 0
+        compressed = entry['compressed_size'] or 0
+        total_size = total_size + size
+        total_compressed = total_compressed + compressed
+        import_us = '-'
+        if bench and mod in bench:
+            import_us = '%.0f' % bench[mod]['time_us']
+        print('%10d %10d %10s  %s' % (size, compressed, import_us, mod))
+    print()
+    print('Size change per binary: %+d bytes (%+d bytes compressed)' % (
+        -total_size, -total_compressed))
+    print()
+    print('Estimated startup change per trace:')
+    print()
+    for filename, modules in sorted(traces.items()):
+        loaded = [mod for mod in cold if mod in modules]
+        print('%+10.0f us  %s (%d moved modules imported)' % (
+            len(loaded) * load_us, filename, len(loaded)))
+
+
+def usage(msg=None):
+    sys.stdout = sys.stderr
+    if msg:
+        print('Error:', msg)
+    print(__doc__)
+    sys.exit(2)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 's:b:o:k:u:m:c:l:h')
+    except getopt.error as msg:
+        usage('getopt error: ' + str(msg))
+    size_report = None
+    bench = None
+    output = None
+    keep = list(default_keep_static)
+    min_usage = 0.0
+    min_size = 16384
+    section = 'shared'
+    load_us = 150
+    for o, a in opts:
+        if o == '-h':
+            print(__doc__)
+            return
+        if o == '-s':
+            size_report = a
+        if o == '-b':
+            with open(a) as infp:
+                bench = json.load(infp)['results']
+        if o == '-o':
+            output = a
+        if o == '-k':
+            keep.append(a)
+        if o == '-u':
+            min_usage = float(a)
+        if o == '-m':
+            min_size = int(a)
+        if o == '-c':
+            if a not in ('shared', 'disabled'):
+                usage('-c section must be shared or disabled')
+            section = a
+        if o == '-l':
+            load_us = float(a)
+    if size_report is None:
+        usage('-s report is required')
+    if len(args) < 2:
+        usage('a Setup file and at least one trace are required')
+
+    lines, static = read_setup(args[0])
+    sizes = sizereport.read_report(size_report)['extensions']
+    traces = {}
+    for filename in args[1:]:
+        traces[filename] = read_trace(filename)
+    cold = cold_modules(static, sizes, module_usage(traces), keep,
+                        min_usage, min_size)
+    show(cold, sizes, traces, load_us, bench)
+    if output:
+        with open(output, 'w') as outfp:
+            outfp.write('\n'.join(partition_setup(lines, static, cold,
+                                                  section)) + '\n')
+        print()
+        print('Wrote', output)
+
+
+if __name__ == '__main__':
+    main()
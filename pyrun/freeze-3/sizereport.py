@@ -0,0 +1,322 @@
+#! /usr/bin/env python3
+
+"""Binary size attribution report for frozen programs.
+
+usage: sizereport.py show report.json [count]
+       sizereport.py diff old-report.json new-report.json [count]
+
+The report is written by freeze.py (as sizereport.json in the output
+directory) and lists:
+
+* the marshal size of each frozen module,
+
+* the size of the object files of each statically linked extension
+  module, i.e. the size of their allocated ELF sections (.text, .data,
+  .rodata, etc.; .bss is reported separately, since it does not take
+  up space in the binary),
+
+* the compressed size of each of these, which approximates the
+  contribution to compressed binaries (e.g. UPX) and distribution
+  archives. LZMA is used for this, if available, zlib otherwise.
+
+Object files are looked up in the Python build directory, using the
+Setup files found in its Modules/ directory. Extensions without
+available object files (or non-ELF object files) are reported with
+their file size or None.
+"""
+
+import json
+import marshal
+import os
+import struct
+import sys
+import sysconfig
+
+import parsesetup
+import checkextensions
+
+try:
+    import lzma
+except ImportError:
+    # The _lzma module is not always available
+    lzma = None
+    import zlib
+
+# Setup files to search for the sources of static extensions (in
+# this order)
+setup_files = ['Setup.local', 'Setup.bootstrap', 'Setup.stdlib', 'Setup']
+
+# ELF constants
+SHF_ALLOC = 0x2
+SHT_NOBITS = 8
+
+
+def compressed_size(data):
+    if lzma is None:
+        return len(zlib.compress(data, 9))
+    return len(lzma.compress(data, preset=9))
+
+
+# Sizes of frozen modules
+
+def frozen_module_sizes(dict):
+    sizes = {}
+    for mod in sorted(dict.keys()):
+        m = dict[mod]
+        if not m.__code__:
+            continue
+        data = marshal.dumps(m.__code__)
+        sizes[mod] = {
+            'package': bool(m.__path__),
+            'marshal_size': len(data),
+            'compressed_size': compressed_size(data),
+            }
+    return sizes
+
+
+# Sizes of static extensions
+
+def elf_sections(filename):
+    """ Return a list of (name, flags, type, size, data) for the sections
+        of the ELF file filename or None, if it's not an ELF file.
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    if data[:4] != b'\x7fELF':
+        return None
+    is64 = data[4] == 2
+    endian = '<' if data[5] == 1 else '>'
+    if is64:
+        shoff, = struct.unpack_from(endian + 'Q', data, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from(endian + 'HHH',
+                                                        data, 0x3a)
+        shfmt = endian + 'IIQQQQIIQQ'
+    else:
+        shoff, = struct.unpack_from(endian + 'I', data, 0x20)
+        shentsize, shnum, shstrndx = struct.unpack_from(endian + 'HHH',
+                                                        data, 0x2e)
+        shfmt = endian + 'IIIIIIIIII'
+    headers = [struct.unpack_from(shfmt, data, shoff + i * shentsize)
+               for i in range(shnum)]
+    strtab = headers[shstrndx]
+    strtab_data = data[strtab[4]:strtab[4] + strtab[5]]
+    sections = []
+    for (name, type, flags, addr, offset, size,
+         link, info, align, entsize) in headers:
+        name = strtab_data[name:strtab_data.index(b'\0', name)]
+        if type == SHT_NOBITS:
+            section_data = b''
+        else:
+            section_data = data[offset:offset + size]
+        sections.append((name.decode('ascii', 'replace'), flags, type,
+                         size, section_data))
+    return sections
+
+
+def object_size(filename):
+    """ Return (size, bss_size, compressed size) for the object file
+        filename.
+    """
+    sections = elf_sections(filename)
+    if sections is None:
+        # Not an ELF file: use the file size
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+        return len(data), 0, compressed_size(data)
+    size = 0
+    bss_size = 0
+    contents = []
+    for name, flags, type, section_size, data in sections:
+        if not flags & SHF_ALLOC:
+            continue
+        if type == SHT_NOBITS:
+            bss_size = bss_size + section_size
+        else:
+            size = size + section_size
+            contents.append(data)
+    return size, bss_size, compressed_size(b''.join(contents))
+
+
+def read_setup_files(builddir):
+    setups = []
+    for name in setup_files:
+        filename = os.path.join(builddir, 'Modules', name)
+        if os.path.isfile(filename):
+            setups.append(parsesetup.getsetupinfo(filename))
+    return setups
+
+
+def extension_objects(mod, builddir, setups):
+    """ Return the list of object files for the static extension mod.
+    """
+    for mods, vars in setups:
+        if mod not in mods:
+            continue
+        objects = []
+        for w in mods[mod]:
+            w = checkextensions.treatword(w)
+            if not w:
+                continue
+            w = checkextensions.expandvars(w, vars)
+            for w in w.split():
+                if w[:1] in ('-', '$') or w[-2:] != '.o':
+                    continue
+                if not os.path.isabs(w):
+                    w = os.path.join(builddir, 'Modules', w)
+                objects.append(w)
+        return objects
+    return []
+
+
+def extension_sizes(builtins, builddir=None):
+    if builddir is None:
+        builddir = sysconfig.get_config_var('abs_builddir')
+    setups = []
+    if builddir and os.path.isdir(builddir):
+        setups = read_setup_files(builddir)
+    sizes = {}
+    for mod in sorted(builtins):
+        objects = [obj
+                   for obj in extension_objects(mod, builddir, setups)
+                   if os.path.isfile(obj)]
+        entry = {
+            'objects': objects,
+            'object_size': None,
+            'bss_size': None,
+            'compressed_size': None,
+            }
+        if objects:
+            entry['object_size'] = 0
+            entry['bss_size'] = 0
+            entry['compressed_size'] = 0
+            for obj in objects:
+                size, bss_size, compressed = object_size(obj)
+                entry['object_size'] += size
+                entry['bss_size'] += bss_size
+                entry['compressed_size'] += compressed
+        sizes[mod] = entry
+    return sizes
+
+
+# Report
+
+def totals(entries, *keys):
+    result = {}
+    for key in keys:
+        result[key] = sum(entry[key] or 0 for entry in entries.values())
+    return result
+
+
+def make_report(dict, builtins, builddir=None):
+    frozen = frozen_module_sizes(dict)
+    extensions = extension_sizes(builtins, builddir)
+    return {
+        'python_version': sys.version.split()[0],
+        'platform': sysconfig.get_platform(),
+        'compression': 'zlib' if lzma is None else 'lzma',
+        'frozen_modules': frozen,
+        'extensions': extensions,
+        'totals': {
+            'frozen_modules': totals(frozen,
+                                     'marshal_size', 'compressed_size'),
+            'extensions': totals(extensions,
+                                 'object_size', 'bss_size',
+                                 'compressed_size'),
+            },
+        }
+
+
+def write_report(filename, dict, builtins, builddir=None):
+    report = make_report(dict, builtins, builddir)
+    with open(filename, 'w') as outfp:
+        json.dump(report, outfp, indent=1, sort_keys=True)
+    return report
+
+
+def read_report(filename):
+    with open(filename) as infp:
+        return json.load(infp)
+
+
+# Output
+
+def flatten(report):
+    """ Return a dict mapping 'kind:name' to (size, compressed size).
+    """
+    entries = {}
+    for mod, entry in report['frozen_modules'].items():
+        entries['frozen:' + mod] = (entry['marshal_size'],
+                                    entry['compressed_size'])
+    for mod, entry in report['extensions'].items():
+        entries['extension:' + mod] = (entry['object_size'] or 0,
+                                       entry['compressed_size'] or 0)
+    return entries
+
+
+def show(report, count=None):
+    entries = flatten(report)
+    print('Python %s (%s)' % (report['python_version'], report['platform']))
+    print()
+    for kind, values in sorted(report['totals'].items()):
+        print('%-16s' % kind, ', '.join('%s=%d' % item
+                                         for item in sorted(values.items())))
+    print()
+    print('%10s %10s  %s' % ('size', 'compressed', 'name'))
+    ranked = sorted(entries.items(), key=lambda item: -item[1][1])
+    for name, (size, compressed) in ranked[:count]:
+        print('%10d %10d  %s' % (size, compressed, name))
+
+
+def diff(old, new, count=None):
+    old_entries = flatten(old)
+    new_entries = flatten(new)
+    changes = []
+    for name in set(old_entries) | set(new_entries):
+        old_size, old_compressed = old_entries.get(name, (0, 0))
+        new_size, new_compressed = new_entries.get(name, (0, 0))
+        if (old_size, old_compressed) == (new_size, new_compressed):
+            continue
+        if name not in old_entries:
+            status = 'added'
+        elif name not in new_entries:
+            status = 'removed'
+        else:
+            status = 'changed'
+        changes.append((name, status,
+                        new_size - old_size,
+                        new_compressed - old_compressed))
+    print('Python %s -> %s' % (old['python_version'], new['python_version']))
+    print()
+    total_size = sum(change[2] for change in changes)
+    total_compressed = sum(change[3] for change in changes)
+    print('%+10d %+10d  total' % (total_size, total_compressed))
+    print()
+    print('%10s %10s  %-8s %s' % ('size', 'compressed', 'status', 'name'))
+    changes.sort(key=lambda change: -abs(change[3]))
+    for name, status, size, compressed in changes[:count]:
+        print('%+10d %+10d  %-8s %s' % (size, compressed, status, name))
+
+
+def usage():
+    sys.stdout = sys.stderr
+    print(__doc__)
+    sys.exit(2)
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        usage()
+    command = args[0]
+    if command == 'show' and len(args) in (2, 3):
+        count = int(args[2]) if len(args) == 3 else None
+        show(read_report(args[1]), count)
+    elif command == 'diff' and len(args) in (3, 4):
+        count = int(args[3]) if len(args) == 4 else None
+        diff(read_report(args[1]), read_report(args[2]), count)
+    else:
+        usage()
+
+
+if __name__ == '__main__':
+    main()
@@ -180,6 +180,13 @@ else:
         '_sha512',
     ])
 
+# The subinterpreter pool needs the per-interpreter GIL support added
+# in Python 3.12
+if PY312GE:
+    include_list.extend([
+        'pyrun_pool',
+    ])
+
 # List of modules to always exclude from the list of modules
 #
 # Note: These modules are only excluded from the generated
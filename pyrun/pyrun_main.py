@@ -37,9 +37,23 @@ from pyrun_config import (
 
 ### Globals
 
+# Startup phase timings: list of (phase, time) tuples (see
+# pyrun_record_phase())
+try:
+    from time import perf_counter as pyrun_clock
+except ImportError:
+    # Python 2
+    from time import time as pyrun_clock
+pyrun_phase_times = [('init', pyrun_clock())]
+
 # PyRun properties (set in pyrun_main() below)
 pyrun_mode = 'script'
 pyrun_app = 'pyrun'
+pyrun_app_module = None
+
+# Package in the appended ZIP file of multi-app binaries, which holds
+# the entry points of the apps (see pyrun_find_app_module())
+pyrun_apps_package = 'pyrun_apps'
 
 # Options
 pyrun_verbose = int(os.environ.get('PYRUN_VERBOSE', 0))
@@ -57,6 +71,160 @@ pyrun_unbuffered = int(os.environ.get('PYTHONUNBUFFERED', 0))
 pyrun_optimized = int(os.environ.get('PYTHONOPTIMIZE', 0))
 pyrun_dontwritebytecode = False
 
+# Line processing mode for -n/-p: None, 'n' (loop) or 'p' (loop and
+# print each line); see pyrun_line_loop_code()
+pyrun_line_mode = None
+pyrun_field_separator = None
+pyrun_begin_code = ''
+pyrun_end_code = ''
+
+# Block size used for reading and writing in line processing mode
+pyrun_line_blocksize = 1 << 20
+
+# Freeze all objects created during startup using gc.freeze(), so that
+# forked processes don't touch their memory pages when running a
+# collection. This is enabled by default on all platforms supporting
+# fork(), except macOS (where forking is unsafe and multiprocessing uses
+# spawn), for every run: checking the multiprocessing start method would
+# mean importing multiprocessing at startup and apps may also fork
+# their workers directly (e.g. prefork servers). Frozen objects are
+# never collected, so apps creating many temporary cycles during
+# startup may want to disable this.
+pyrun_gc_freeze = int(os.environ.get(
+    'PYRUN_GCFREEZE',
+    hasattr(os, 'fork') and sys.platform != 'darwin'))
+
+# Use a fast bootstrap for multiprocessing child processes started by
+# pyrun itself (see pyrun_is_multiprocessing_child())
+pyrun_fastspawn = int(os.environ.get('PYRUN_FASTSPAWN', 1))
+
+# Patterns of the code run by multiprocessing when starting its child
+# processes via "sys.executable [flags] -c <code> [args]", together
+# with the args following the code (see
+# pyrun_is_multiprocessing_child()); the forkserver gets passed the
+# repr() of a list and a dict of strings
+pyrun_multiprocessing_str = (r"'(?:[^'\\\n]|\\.)*'"
+                             r'|"(?:[^"\\\n]|\\.)*"')
+pyrun_multiprocessing_list = r'\[(?:(?:%(str)s)(?:, (?:%(str)s))*)?\]' % {
+    'str': pyrun_multiprocessing_str}
+pyrun_multiprocessing_dict = (
+    r'\{(?:(?:%(str)s): (?:%(str)s|%(list)s)'
+    r'(?:, (?:%(str)s): (?:%(str)s|%(list)s))*)?\}' % {
+        'str': pyrun_multiprocessing_str,
+        'list': pyrun_multiprocessing_list})
+pyrun_multiprocessing_commands = (
+    # spawn start method
+    (r'from multiprocessing\.spawn import spawn_main; '
+     r'spawn_main\(\w+=\d+(?:, \w+=\d+)*\)',
+     ['--multiprocessing-fork']),
+    # forkserver start method
+    (r'from multiprocessing\.forkserver import main; '
+     r'main\(\d+, \d+, (?:%s|None), \*\*%s\)' % (
+         pyrun_multiprocessing_list, pyrun_multiprocessing_dict),
+     []),
+    # Resource tracker (Python 3.8+) and semaphore tracker
+    (r'from multiprocessing\.resource_tracker import main;main\(\d+\)',
+     []),
+    (r'from multiprocessing\.semaphore_tracker import main;main\(\d+\)',
+     []),
+    )
+
+# Interpreter flags passed on to the child processes by multiprocessing
+# (see subprocess._args_from_interpreter_flags())
+pyrun_multiprocessing_flags = r'-[BbdEIOPqSsv]+$'
+
+# Environment variable used to hand the final sys.path of the parent
+# process (after .pth file processing and site.main()) to
+# multiprocessing child processes, as os.pathsep separated list; the
+# interpreter flags are passed on by multiprocessing on the command line
+pyrun_multiprocessing_path_env = 'PYRUN_MULTIPROCESSING_PATH'
+
+# sys.path handed over by the parent process, if running as
+# multiprocessing child process using the fast bootstrap
+pyrun_multiprocessing_path = None
+
+# Trace imports and write the import times in the format used by
+# CPython's -X importtime on exit: "1" writes to stderr, other values
+# are used as file name (see pyrun_install_import_tracer())
+pyrun_importtime = os.environ.get('PYRUN_IMPORTTIME', '')
+if pyrun_importtime == '0':
+    pyrun_importtime = ''
+
+# Profile the script and write the results to this file on exit (see
+# pyrun_start_profiler())
+pyrun_profile = os.environ.get('PYRUN_PROFILE', '')
+
+# Trace memory allocations of the script and write the top allocations
+# to this file on exit (see pyrun_start_tracemalloc())
+pyrun_tracemalloc = os.environ.get('PYRUN_TRACEMALLOC', '')
+
+# Enable the Linux perf trampoline (Python 3.12+), so that perf can
+# resolve Python functions (see pyrun_enable_perf_trampoline())
+pyrun_perf = int(os.environ.get('PYRUN_PERF', 0))
+
+# Shared bytecode cache dir used as sys.pycache_prefix (Python 3.8+);
+# see pyrun_setup_pycache_prefix()
+pyrun_pycache = os.environ.get('PYRUN_PYCACHE', '')
+
+# Write a machine readable runtime report on exit: "json:<path>", with
+# path "-" for stderr (see pyrun_write_report())
+pyrun_report = os.environ.get('PYRUN_REPORT', '')
+
+# Globals written to the "config" section of the report; these must not
+# include code (e.g. -c scripts in pyrun_script or pyrun_argv), since
+# reports may be collected from production systems
+pyrun_report_config = (
+    'pyrun_name',
+    'pyrun_version',
+    'pyrun_libversion',
+    'pyrun_release',
+    'pyrun_build',
+    'pyrun_mode',
+    'pyrun_app',
+    'pyrun_executable',
+    'pyrun_dir',
+    'pyrun_binary',
+    'pyrun_prefix',
+    'pyrun_bindir',
+    'pyrun_verbose',
+    'pyrun_debug',
+    'pyrun_as_module',
+    'pyrun_as_string',
+    'pyrun_bytecode',
+    'pyrun_ignore_environment',
+    'pyrun_ignore_pth_files',
+    'pyrun_skip_site_main',
+    'pyrun_skip_user_site',
+    'pyrun_safe_path',
+    'pyrun_inspect',
+    'pyrun_unbuffered',
+    'pyrun_optimized',
+    'pyrun_dontwritebytecode',
+    'pyrun_line_mode',
+    'pyrun_batch',
+    'pyrun_gc_freeze',
+    'pyrun_fastspawn',
+    'pyrun_importtime',
+    'pyrun_profile',
+    'pyrun_tracemalloc',
+    'pyrun_perf',
+    'pyrun_pycache',
+    'pyrun_report',
+    )
+
+# RSS in kB when starting the script (only determined for reports)
+pyrun_script_rss = None
+
+# Set by pyrun_start_script()
+pyrun_script_started = False
+
+# Batch mode: file with jobs to run (- for stdin); see pyrun_run_batch()
+pyrun_batch = None
+
+# Sampling interval in seconds used for profiling with collapsed stack
+# output
+pyrun_profile_interval = 0.001
+
 ### Python 2 vs. 3
 
 # Runtime flags
@@ -71,9 +239,16 @@ if PY3:
 
     # Python 3 does not include the execfile() builtin
     def pyrun_exec_code_file(filename, globals_dict, locals_dict=None):
-        with open(filename, 'r', encoding='utf-8') as file:
-            source = file.read()
-        code = compile(source, filename, 'exec', optimize=pyrun_optimized)
+        if pyrun_pycache:
+            # Use the .pyc file from the bytecode cache, if valid
+            from importlib.machinery import SourceFileLoader
+            code = SourceFileLoader('__main__', filename).get_code(
+                '__main__')
+        else:
+            with open(filename, 'r', encoding='utf-8') as file:
+                source = file.read()
+            code = compile(source, filename, 'exec',
+                           optimize=pyrun_optimized)
         pyrun_exec_code(code, globals_dict, locals_dict)
 
     # Python 3 no longer has raw_input(). Use input() instead
@@ -130,7 +305,7 @@ Version: %s %s
 
 Available PyRun command line options:
 
--b:       run the given <script> file as bytecode
+-b:       run the given <script> file as bytecode (.pyc format; - for stdin)
 -c:       compile and run <script> directly as Python code
 -d:       enable debug mode (-dd for level 2)
 -h:       show this help text
@@ -149,10 +324,61 @@ Available PyRun command line options:
 -V:       print the pyrun version and exit
 -W arg:   add arg as warning filter
 -3:       not implemented; only for compatibility with Python
--X arg:   not implemented; only for compatibility with Python
+-X arg:   only -X importtime and -X perf are supported; others are ignored
+
+Line processing options (awk/perl style; the code is given via -c or as <script>):
+
+-n:       run the code for each input line, available as line (without
+          line end), with the line number in NR
+-p:       same as -n, but print line after running the code
+-F sep:   split each line at sep into the list F (-F ' ' splits at
+          whitespace)
+--begin code: run code before processing the first line
+--end code:   run code after processing the last line
+
+Input is read from the files given as parameters or stdin.
+
+Batch mode:
+
+--batch file: run the jobs listed in file (- for stdin) one after another
+          in the same process and write the results to stdout; see
+          pyrun_run_batch() for the job and result formats
 
 Most Python environment variables are supported.
 
+Available PyRun environment variables:
+
+PYRUN_DEBUG=n:       same as using -d n times
+PYRUN_VERBOSE=n:     same as using -v n times
+PYRUN_HTTPSVERIFY=0: disable HTTPS certificate verification
+PYRUN_GCFREEZE=0|1:  disable/enable freezing the startup objects using
+                     gc.freeze() (default: enabled for all runs on
+                     platforms supporting fork(), except macOS)
+PYRUN_FASTSPAWN=0:   disable the fast bootstrap for multiprocessing child
+                     processes (these use the sys.path of the parent
+                     instead of processing .pth files and site.main())
+PYRUN_IMPORTTIME=1|file: write import times to stderr or file on exit
+                     (same format as -X importtime); works in app mode
+PYRUN_PROFILE=file:  profile the script and write the stats to file on exit
+                     (.txt: text, .collapsed/.folded: sampled collapsed
+                     stacks for flame graphs, others: pstats format)
+PYRUN_TRACEMALLOC=file: trace memory allocations and write the top
+                     allocations to file on exit (.snapshot: write a
+                     tracemalloc snapshot instead)
+PYRUN_PERF=1:        enable the perf trampoline (same as -X perf); frozen
+                     modules are mapped to the stdlib in PYRUN_PERF_SRCDIR
+                     (default: stdlib path of the Python build) on exit;
+                     maps of forked processes ending with os._exit() (e.g.
+                     multiprocessing workers) keep the <pyrun>/ paths
+PYRUN_REPORT=json:path: write a JSON report with the configuration,
+                     sys.path, startup timings, modules, RSS and gc stats
+                     to path on exit (- for stderr)
+PYRUN_PREFETCH=1|2:  read ahead the frozen code region at startup (Linux);
+                     2 also requests transparent huge pages for it
+PYRUN_PYCACHE=dir:   use dir as shared bytecode cache (sys.pycache_prefix,
+                     3.8+), also for the main script; prefill it using
+                     "pyrun_cli pycache"
+
 Without options, the given <script> file is loaded and run. Parameters
 are passed to the script via sys.argv as normal.
 
@@ -204,7 +430,17 @@ pyrun_inspect = %(pyrun_inspect)r
 pyrun_unbuffered = %(pyrun_unbuffered)r
 pyrun_optimized = %(pyrun_optimized)r
 pyrun_dontwritebytecode = %(pyrun_dontwritebytecode)r
+pyrun_line_mode = %(pyrun_line_mode)r
+pyrun_field_separator = %(pyrun_field_separator)r
+pyrun_batch = %(pyrun_batch)r
 pyrun_safe_path = %(pyrun_safe_path)r
+pyrun_gc_freeze = %(pyrun_gc_freeze)r
+pyrun_fastspawn = %(pyrun_fastspawn)r
+pyrun_importtime = %(pyrun_importtime)r
+pyrun_profile = %(pyrun_profile)r
+pyrun_tracemalloc = %(pyrun_tracemalloc)r
+pyrun_perf = %(pyrun_perf)r
+pyrun_report = %(pyrun_report)r
 
 """ % globals()).splitlines()
     if extra_lines:
@@ -212,6 +448,145 @@ pyrun_safe_path = %(pyrun_safe_path)r
     for line in info_text:
         sys.stderr.write('%s\n' % line)
 
+def pyrun_record_phase(phase):
+
+    """ Record the end of startup phase phase.
+
+    """
+    pyrun_phase_times.append((phase, pyrun_clock()))
+
+def pyrun_rss():
+
+    """ Return the current RSS in kB or None, if not available.
+
+        Only supported on Linux. On other platforms, the peak RSS is
+        returned, if available.
+
+    """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes
+        maxrss = maxrss // 1024
+    return maxrss
+
+def pyrun_module_source(name, module):
+
+    """ Return the source of the module name as one of 'builtin',
+        'frozen', 'shared', 'zip', 'file' or 'other'.
+
+    """
+    if name in sys.builtin_module_names:
+        return 'builtin'
+    loader = getattr(module, '__loader__', None)
+    spec = getattr(module, '__spec__', None)
+    if (getattr(spec, 'origin', None) == 'frozen' or
+        getattr(loader, '__name__', None) == 'FrozenImporter'):
+        return 'frozen'
+    if PY2:
+        import imp
+        if imp.is_frozen(name):
+            return 'frozen'
+    if type(loader).__name__ == 'zipimporter':
+        return 'zip'
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return 'other'
+    if filename.endswith(('.so', '.pyd', '.dylib')):
+        return 'shared'
+    return 'file'
+
+def pyrun_write_report():
+
+    """ Write the runtime report requested by pyrun_report.
+
+        The report is a JSON object with these entries:
+
+        'config'       - pyrun configuration and options (the globals
+                         listed in pyrun_report_config)
+        'sys_path'     - final sys.path
+        'phases'       - startup phase durations in ms, in the order
+                         of the phases
+        'startup_ms'   - total startup time until the script was run
+        'modules'      - dict mapping loaded module names to their
+                         source (see pyrun_module_source())
+        'module_counts' - number of modules per source
+        'rss_kb'       - dict with the RSS at script start and at exit
+        'gc'           - gc statistics
+
+    """
+    import json
+    import gc
+    report_format, sep, path = pyrun_report.partition(':')
+    if report_format != 'json' or not path:
+        pyrun_log_warning('Unsupported PYRUN_REPORT value %r; '
+                          'use json:<path>' % pyrun_report)
+        return
+
+    # Configuration
+    config = {}
+    for name in pyrun_report_config:
+        config[name] = globals().get(name)
+
+    # Startup phases
+    phases = []
+    for i in range(1, len(pyrun_phase_times)):
+        phase, end = pyrun_phase_times[i]
+        start = pyrun_phase_times[i - 1][1]
+        phases.append([phase, (end - start) * 1000.0])
+    startup_ms = (pyrun_phase_times[-1][1] -
+                  pyrun_phase_times[0][1]) * 1000.0
+
+    # Modules
+    modules = {}
+    module_counts = {}
+    for name, module in list(sys.modules.items()):
+        if module is None:
+            continue
+        source = pyrun_module_source(name, module)
+        modules[name] = source
+        module_counts[source] = module_counts.get(source, 0) + 1
+
+    # GC statistics
+    gc_stats = {
+        'count': gc.get_count(),
+        'threshold': gc.get_threshold(),
+        }
+    if hasattr(gc, 'get_stats'):
+        gc_stats['generations'] = gc.get_stats()
+    if hasattr(gc, 'get_freeze_count'):
+        gc_stats['freeze_count'] = gc.get_freeze_count()
+
+    report = {
+        'config': config,
+        'sys_path': sys.path,
+        'phases': phases,
+        'startup_ms': startup_ms,
+        'modules': modules,
+        'module_counts': module_counts,
+        'rss_kb': {
+            'script_start': pyrun_script_rss,
+            'exit': pyrun_rss(),
+            },
+        'gc': gc_stats,
+        }
+    data = json.dumps(report, indent=1, sort_keys=True)
+    if path == '-':
+        sys.stderr.write(data + '\n')
+    else:
+        with open(path, 'w') as file:
+            file.write(data + '\n')
+
 def pyrun_log(line):
 
     """ Log a line to stderr.
@@ -233,6 +608,35 @@ def pyrun_log_warning(line):
     """
     sys.stderr.write('%s warning: %s\n' % (pyrun_name, line))
 
+def pyrun_sigterm_handler(signum, frame):
+
+    """ SIGTERM handler installed by pyrun_register_exit_hook().
+
+        Raises SystemExit, so that the exit hooks get run.
+
+    """
+    sys.exit(128 + signum)
+
+def pyrun_register_exit_hook(hook):
+
+    """ Register hook to be called without arguments when pyrun
+        exits.
+
+        The hooks are run via atexit, i.e. on normal exit and when
+        calling sys.exit(). To also run them when receiving SIGTERM,
+        a SIGTERM handler is installed, which raises SystemExit. This
+        is only done, if no other handler is set yet.
+
+    """
+    import atexit
+    atexit.register(hook)
+    try:
+        import signal
+    except ImportError:
+        return
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, pyrun_sigterm_handler)
+
 def pyrun_parse_cmdline():
 
     """ Parse the pyrun command line arguments.
@@ -244,10 +648,12 @@ def pyrun_parse_cmdline():
     import getopt
 
     # Parse sys.argv
-    valid_options = 'vVmcbiESdOu3h?sBPRIW:X:'
+    valid_options = 'vVmcbiESdOu3h?sBPRIW:X:npF:'
+    valid_long_options = ['begin=', 'end=', 'batch=']
     try:
         parsed_options, remaining_argv = getopt.getopt(pyrun_argv[1:],
-                                                       valid_options)
+                                                       valid_options,
+                                                       valid_long_options)
     except getopt.GetoptError as reason:
         pyrun_help(['*** Problem parsing command line: %s' % reason])
         sys.exit(1)
@@ -374,12 +780,49 @@ def pyrun_parse_cmdline():
                 warnings._setoption(value)
 
         elif arg == '-X':
-            # Implementation specific options: not implemented
-            if pyrun_debug:
+            # Implementation specific options: only importtime is
+            # supported
+            if value == 'importtime':
+                global pyrun_importtime
+                if not pyrun_importtime:
+                    pyrun_importtime = '1'
+                    pyrun_install_import_tracer()
+            elif value == 'perf':
+                global pyrun_perf
+                if not pyrun_perf:
+                    pyrun_perf = 1
+                    pyrun_enable_perf_trampoline()
+            elif pyrun_debug:
                 pyrun_log_warning(
                     'Command line option -X is not supported. '
                     'Ignoring the option.')
 
+        elif arg in ('-n', '-p'):
+            # Run the code for each input line
+            global pyrun_line_mode
+            if pyrun_line_mode != 'p':
+                pyrun_line_mode = arg[1]
+
+        elif arg == '-F':
+            # Field separator for line processing mode
+            global pyrun_field_separator
+            pyrun_field_separator = value
+
+        elif arg == '--begin':
+            # Code to run before line processing
+            global pyrun_begin_code
+            pyrun_begin_code = value
+
+        elif arg == '--end':
+            # Code to run after line processing
+            global pyrun_end_code
+            pyrun_end_code = value
+
+        elif arg == '--batch':
+            # Run the jobs listed in the given file
+            global pyrun_batch
+            pyrun_batch = value
+
         # XXX Add more standard Python command line options here
 
         # Note: There's a general problem with some options, since by
@@ -425,8 +868,87 @@ def pyrun_parse_cmdline():
         sys._setflag('dont_write_bytecode', pyrun_dontwritebytecode)
         sys.dont_write_bytecode = pyrun_dontwritebytecode
 
+    # Batch mode runs the jobs from the batch file only
+    if pyrun_batch is not None and (pyrun_as_string or
+                                    pyrun_as_module or
+                                    pyrun_line_mode or
+                                    remaining_argv):
+        pyrun_log_error(
+            'Option --batch cannot be combined with a script, -c, -m, '
+            '-n or -p. Try pyrun -h for help.')
+        sys.exit(1)
+    if pyrun_batch is not None and PY2:
+        pyrun_log_error('Option --batch is not supported for Python 2.')
+        sys.exit(1)
+
+    # Line processing mode always runs the first argument as code
+    if (pyrun_field_separator is not None or
+        pyrun_begin_code or
+        pyrun_end_code) and not pyrun_line_mode:
+        pyrun_log_error(
+            'Options -F, --begin and --end need -n or -p. '
+            'Try pyrun -h for help.')
+        sys.exit(1)
+    if pyrun_line_mode:
+        if PY2:
+            pyrun_log_error(
+                'Options -n and -p are not supported for Python 2.')
+            sys.exit(1)
+        if pyrun_as_module or not remaining_argv:
+            pyrun_log_error(
+                'Missing code argument for -n/-p. Try pyrun -h for help.')
+            sys.exit(1)
+        pyrun_as_string = True
+
     # Remove pyrun options from sys.argv
     sys.argv[:] = remaining_argv
+    pyrun_record_phase('cmdline')
+
+def pyrun_is_multiprocessing_child():
+
+    """ Return True, if pyrun was started as child process by
+        multiprocessing (using the spawn or forkserver start methods,
+        or as resource tracker).
+
+        multiprocessing runs these as "sys.executable [flags] -c
+        <code> [args]", passing the interpreter flags of the parent
+        process on the command line. The command line has to match
+        one of these exactly (see pyrun_multiprocessing_commands), so
+        that app binaries don't run arbitrary -c code.
+
+    """
+    try:
+        i = pyrun_argv.index('-c', 1)
+    except ValueError:
+        return False
+    if i + 1 >= len(pyrun_argv):
+        return False
+    code = pyrun_argv[i + 1]
+    if not code.startswith('from multiprocessing.'):
+        return False
+    import re
+    flags = pyrun_argv[1:i]
+    while flags:
+        flag = flags.pop(0)
+        if flag == '-X' and flags:
+            flags.pop(0)
+        elif not (flag.startswith('-W') or
+                  re.match(pyrun_multiprocessing_flags, flag)):
+            return False
+    for code_pattern, args in pyrun_multiprocessing_commands:
+        if (re.match(code_pattern + '$', code) and
+            pyrun_argv[i + 2:] == args):
+            return True
+    return False
+
+def pyrun_export_site_settings():
+
+    """ Hand the current sys.path to multiprocessing child processes
+        via the environment, so that they don't have to set it up
+        again (see pyrun_setup_site()).
+
+    """
+    os.environ[pyrun_multiprocessing_path_env] = os.pathsep.join(sys.path)
 
 def pyrun_normpath(path,
 
@@ -514,6 +1036,108 @@ def pyrun_enable_unbuffered_mode():
         sys.stdout = stdout
         sys.stderr = stderr
 
+def pyrun_enable_block_buffered_stdout():
+
+    """ Enable block buffering with a large buffer for sys.stdout.
+
+        Used in line processing mode, to batch the writes of many
+        short lines into few system calls.
+
+    """
+    import io
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        # No real file; leave as is
+        return
+    sys.stdout.flush()
+    stdout = io.open(fileno, 'w',
+                     buffering=pyrun_line_blocksize,
+                     encoding=sys.stdout.encoding,
+                     errors=sys.stdout.errors,
+                     closefd=False)
+    # Let TextIOWrapper collect larger chunks before passing them to
+    # the buffer as well (default: 8192 bytes)
+    if hasattr(stdout, '_CHUNK_SIZE'):
+        stdout._CHUNK_SIZE = pyrun_line_blocksize
+    sys.stdout = stdout
+
+# Template for the loop used in line processing mode (-n/-p). The loop
+# runs inside a function, so that the user code can use fast local
+# variables; BEGIN and END code share these locals with the loop. The
+# pyrun_*_code placeholder statements are replaced with the parsed user
+# code, see pyrun_line_loop_code().
+pyrun_line_loop_template = """\
+def pyrun_line_loop(pyrun_files, pyrun_decoder, pyrun_write):
+    pyrun_begin_code
+    NR = 0
+    for pyrun_file in pyrun_files:
+        pyrun_decode = pyrun_decoder()
+        pyrun_rest = ''
+        while True:
+            pyrun_block = pyrun_file.read(%(blocksize)i)
+            pyrun_lines = (
+                pyrun_rest +
+                pyrun_decode(pyrun_block, not pyrun_block)).split('\\n')
+            pyrun_rest = pyrun_lines.pop()
+            if not pyrun_block and pyrun_rest:
+                # Last line without line end
+                pyrun_lines.append(pyrun_rest)
+            for line in pyrun_lines:
+                NR += 1
+%(split)s
+                pyrun_line_code
+%(print_line)s
+            if not pyrun_block:
+                break
+    pyrun_end_code
+"""
+
+def pyrun_line_loop_code(code, filename):
+
+    """ Return the code object defining the pyrun_line_loop() function
+        running code for each input line, according to the line
+        processing options.
+
+        The user code is parsed on its own and its statements are
+        grafted into the parsed loop template, so that the code is used
+        as is (without reindenting it, which would change multi-line
+        string literals) and error line numbers refer to the user code.
+
+    """
+    import ast
+
+    if pyrun_field_separator is None:
+        split = ''
+    elif pyrun_field_separator == ' ':
+        split = ' ' * 16 + 'F = line.split()'
+    else:
+        split = ' ' * 16 + 'F = line.split(%r)' % pyrun_field_separator
+    if pyrun_line_mode == 'p':
+        print_line = ' ' * 16 + 'pyrun_write(line + "\\n")'
+    else:
+        print_line = ''
+    source = pyrun_line_loop_template % dict(
+        blocksize=pyrun_line_blocksize,
+        split=split,
+        print_line=print_line,
+        )
+    user_code = {
+        'pyrun_begin_code': ast.parse(pyrun_begin_code, filename).body,
+        'pyrun_line_code': ast.parse(code, filename).body,
+        'pyrun_end_code': ast.parse(pyrun_end_code, filename).body,
+        }
+
+    class Grafter(ast.NodeTransformer):
+        def visit_Expr(self, node):
+            if (isinstance(node.value, ast.Name) and
+                node.value.id in user_code):
+                return user_code[node.value.id]
+            return node
+
+    tree = Grafter().visit(ast.parse(source, filename))
+    return compile(tree, filename, 'exec')
+
 def pyrun_run_site_main():
 
     """ Import the site module
@@ -533,6 +1157,31 @@ def pyrun_run_site_main():
         pyrun_log('  sys.path after importing site:')
         for path in sys.path:
             pyrun_log('    %s' % path)
+    pyrun_record_phase('site')
+
+def pyrun_setup_pycache_prefix():
+
+    """ Use the bytecode cache dir given by PYRUN_PYCACHE as
+        sys.pycache_prefix.
+
+        This allows sharing a pre-populated cache of .pyc files
+        between many processes or containers (see "pyrun_cli
+        pycache"), e.g. when the application is stored on a read-only
+        file system. Scripts run by pyrun also use the cache.
+
+        Only available in Python 3.8+.
+
+    """
+    global pyrun_pycache
+    if not hasattr(sys, 'pycache_prefix'):
+        pyrun_log_warning('A bytecode cache dir needs Python 3.8+; '
+                          'ignoring PYRUN_PYCACHE')
+        pyrun_pycache = ''
+        return
+    pyrun_pycache = pyrun_normpath(pyrun_pycache)
+    if pyrun_debug > 1:
+        pyrun_log('Using bytecode cache dir %r' % pyrun_pycache)
+    sys.pycache_prefix = pyrun_pycache
 
 def pyrun_setup_sys_path(pyrun_script=None):
 
@@ -551,6 +1200,11 @@ def pyrun_setup_sys_path(pyrun_script=None):
         for path in sys.path:
             pyrun_log('    %s' % path)
 
+    # Set up the bytecode cache dir before the first imports from
+    # sys.path
+    if pyrun_pycache:
+        pyrun_setup_pycache_prefix()
+
     # Determine various default locations
     if pyrun_script is not None:
         # Use the script dir as first sys.path dir
@@ -615,6 +1269,442 @@ def pyrun_setup_sys_path(pyrun_script=None):
         pyrun_log('  sys.path final version:')
         for path in sys.path:
             pyrun_log('    %s' % path)
+    pyrun_record_phase('sys_path')
+
+def pyrun_setup_site(pyrun_script=None):
+
+    """ Setup the sys.path for running pyrun_script and import the site
+        module (unless disabled).
+
+        multiprocessing child processes started by pyrun use the
+        sys.path handed over by the parent process instead (see
+        pyrun_export_site_settings()), skipping the .pth file
+        processing and site.main().
+
+    """
+    if pyrun_multiprocessing_path is not None:
+        if pyrun_pycache:
+            pyrun_setup_pycache_prefix()
+        sys.path = pyrun_multiprocessing_path
+        if pyrun_debug > 1:
+            pyrun_log('Using the sys.path of the parent process:')
+            for path in sys.path:
+                pyrun_log('    %s' % path)
+        pyrun_record_phase('sys_path')
+        return
+
+    # Setup sys.path
+    pyrun_setup_sys_path(pyrun_script)
+
+    # Import site module and run site.main() (which is not run by
+    # pyrun per default like in standard Python; see makepyrun.py)
+    if not pyrun_skip_site_main:
+        pyrun_run_site_main()
+
+    # Pass on the final sys.path to multiprocessing child processes
+    if pyrun_fastspawn:
+        pyrun_export_site_settings()
+
+def pyrun_freeze_gc():
+
+    """ Move all objects currently tracked by the garbage collector
+        into its permanent generation using gc.freeze().
+
+        Collections in forked child processes will then no longer
+        touch the reference count fields of these objects and so keep
+        their memory pages shared with the parent process.
+
+        pyrun_main() calls this at the end of the bootstrap, if
+        pyrun_gc_freeze is enabled. Apps using prefork servers or
+        multiprocessing should call this again after preloading their
+        code, right before forking the workers.
+
+        Returns the number of objects in the permanent generation or
+        None, in case gc.freeze() is not available (Python 3.7+ only).
+
+    """
+    import gc
+    if not hasattr(gc, 'freeze'):
+        return None
+    gc.freeze()
+    count = gc.get_freeze_count()
+    if pyrun_debug > 1:
+        pyrun_log('Froze %i objects in the gc permanent generation' % count)
+    if not pyrun_script_started:
+        # Only record the startup call as phase
+        pyrun_record_phase('gc_freeze')
+    return count
+
+def pyrun_install_import_tracer():
+
+    """ Install an import tracer, which records the self and
+        cumulative time of all imports and writes them on exit in the
+        format used by CPython's -X importtime option, so that the
+        usual tools for analyzing this output can be used.
+
+        The output is written to stderr, if pyrun_importtime is set to
+        '1', or to the file named by pyrun_importtime otherwise.
+
+        The tracer wraps the importlib function called by the import
+        statement for modules not yet in sys.modules, so it sees
+        frozen, builtin, shared and ZIP imported modules alike.
+
+        Only available in Python 3.
+
+    """
+    try:
+        import _frozen_importlib
+    except ImportError:
+        # Python 2
+        return
+    from time import perf_counter
+
+    find_and_load = _frozen_importlib._find_and_load
+    lines = []
+    # Accumulated time of the imports done at each nesting level
+    children_times = [0.0]
+
+    def pyrun_traced_find_and_load(name, *args, **kws):
+        depth = len(children_times) - 1
+        children_times.append(0.0)
+        start = perf_counter()
+        try:
+            return find_and_load(name, *args, **kws)
+        finally:
+            cumulative = perf_counter() - start
+            children = children_times.pop()
+            children_times[-1] += cumulative
+            lines.append('import time: %9d | %10d | %s%s' % (
+                (cumulative - children) * 1e6,
+                cumulative * 1e6,
+                '  ' * depth,
+                name))
+
+    def pyrun_write_import_times():
+        # Stop tracing
+        _frozen_importlib._find_and_load = find_and_load
+        output = ['import time: self [us] | cumulative | imported package']
+        output.extend(lines)
+        output.append('')
+        if pyrun_importtime == '1':
+            sys.stderr.write('\n'.join(output))
+        else:
+            with open(pyrun_importtime, 'w') as file:
+                file.write('\n'.join(output))
+
+    _frozen_importlib._find_and_load = pyrun_traced_find_and_load
+    pyrun_register_exit_hook(pyrun_write_import_times)
+
+def pyrun_enable_perf_trampoline():
+
+    """ Enable the perf trampoline, which makes Python functions
+        visible to the Linux perf profiler via /tmp/perf-<pid>.map.
+
+        Frozen modules use file names starting with '<pyrun>/' (see
+        the -r options passed to freeze.py), which are mapped back to
+        the stdlib source dir when exiting. The dir can be set using
+        PYRUN_PERF_SRCDIR and defaults to the stdlib path of the
+        Python build.
+
+        Forked child processes write their own map files. These are
+        only rewritten, if the child exits normally, not for children
+        ending with os._exit() (e.g. multiprocessing workers started
+        with the fork method), which keep the '<pyrun>/' paths.
+
+        Only available in Python 3.12+ on Linux.
+
+    """
+    if not hasattr(sys, 'activate_stack_trampoline'):
+        pyrun_log_warning('The perf trampoline is only available in '
+                          'Python 3.12+ on Linux; ignoring PYRUN_PERF')
+        return
+    srcdir = os.environ.get('PYRUN_PERF_SRCDIR', None)
+    if not srcdir:
+        import sysconfig
+        srcdir = sysconfig.get_path('stdlib')
+    srcdir = srcdir.rstrip(os.sep) + os.sep
+
+    def pyrun_write_perf_map():
+        sys.deactivate_stack_trampoline()
+        # Forked child processes use their own map files
+        perf_map = '/tmp/perf-%i.map' % os.getpid()
+        try:
+            with open(perf_map, 'r') as file:
+                entries = file.read()
+        except (IOError, OSError):
+            return
+        entries = entries.replace(':<pyrun>/', ':' + srcdir)
+        with open(perf_map + '.tmp', 'w') as file:
+            file.write(entries)
+        os.rename(perf_map + '.tmp', perf_map)
+
+    if pyrun_debug > 1:
+        pyrun_log('Enabling perf trampoline; mapping <pyrun>/ to %r' %
+                  srcdir)
+    sys.activate_stack_trampoline('perf')
+    pyrun_register_exit_hook(pyrun_write_perf_map)
+
+def pyrun_start_profiler():
+
+    """ Start profiling and write the results to the file named by
+        pyrun_profile on exit.
+
+        The output format depends on the file extension:
+
+        '.txt'                     - pstats text output, sorted by
+                                     cumulative time
+        '.collapsed' or '.folded'  - collapsed stacks as used by flame
+                                     graph tools
+        others                     - pstats binary format (for use
+                                     with pstats, snakeviz, etc.)
+
+        Collapsed stacks are created by sampling the stack of the main
+        thread every pyrun_profile_interval seconds of CPU time using
+        SIGPROF, since cProfile does not record complete stacks.
+
+    """
+    filename = pyrun_profile
+    if pyrun_debug > 1:
+        pyrun_log('Profiling script; writing results to %r' % filename)
+
+    if filename.endswith(('.collapsed', '.folded')):
+
+        ### Sampling profiler
+
+        import signal
+        samples = {}
+
+        def pyrun_sample_stack(signum, frame):
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%i)' % (code.co_name,
+                                             code.co_filename,
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            key = ';'.join(stack)
+            samples[key] = samples.get(key, 0) + 1
+
+        def pyrun_write_profile():
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            with open(filename, 'w') as file:
+                for stack, count in sorted(samples.items()):
+                    file.write('%s %i\n' % (stack, count))
+
+        signal.signal(signal.SIGPROF, pyrun_sample_stack)
+        pyrun_register_exit_hook(pyrun_write_profile)
+        signal.setitimer(signal.ITIMER_PROF,
+                         pyrun_profile_interval,
+                         pyrun_profile_interval)
+
+    else:
+
+        ### cProfile
+
+        import cProfile
+        profiler = cProfile.Profile()
+
+        def pyrun_write_profile():
+            profiler.disable()
+            if filename.endswith('.txt'):
+                import pstats
+                with open(filename, 'w') as file:
+                    stats = pstats.Stats(profiler, stream=file)
+                    stats.sort_stats('cumulative').print_stats()
+            else:
+                profiler.dump_stats(filename)
+
+        pyrun_register_exit_hook(pyrun_write_profile)
+        profiler.enable()
+
+def pyrun_start_tracemalloc(limit=50):
+
+    """ Start tracing memory allocations and write the top limit
+        allocations by file and line to the file named by
+        pyrun_tracemalloc on exit.
+
+        If the file name ends with '.snapshot', a tracemalloc snapshot
+        is written instead, which can be loaded using
+        tracemalloc.Snapshot.load().
+
+        Only available in Python 3.4+.
+
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        pyrun_log_warning('tracemalloc is not available; '
+                          'ignoring PYRUN_TRACEMALLOC')
+        return
+    filename = pyrun_tracemalloc
+    if pyrun_debug > 1:
+        pyrun_log('Tracing memory allocations; writing results to %r' %
+                  filename)
+
+    def pyrun_write_tracemalloc():
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        if filename.endswith('.snapshot'):
+            snapshot.dump(filename)
+            return
+        stats = snapshot.statistics('lineno')
+        with open(filename, 'w') as file:
+            file.write('Top %i allocations by file and line '
+                       '(total: %i blocks, %i bytes):\n\n' % (
+                           limit,
+                           sum(stat.count for stat in stats),
+                           sum(stat.size for stat in stats)))
+            for stat in stats[:limit]:
+                file.write('%s\n' % stat)
+
+    pyrun_register_exit_hook(pyrun_write_tracemalloc)
+    tracemalloc.start()
+
+def pyrun_find_app_module(pyrun_script, app_name):
+
+    """ Find the entry point module for app_name in the ZIP package
+        appended to pyrun_script.
+
+        This is used to support multi-app binaries (much like
+        busybox): a single binary can hold several apps in its
+        appended ZIP package and is then symlinked to the names of
+        the apps. The app to run is selected by the name used to
+        invoke the binary.
+
+        The entry points have to be placed into the pyrun_apps
+        package of the ZIP package, either as module
+        pyrun_apps/<app_name>.py or as package pyrun_apps/<app_name>/
+        with a __main__.py module. Dashes and dots in app_name are
+        mapped to underscores.
+
+        Returns the module name to run or None, in case no entry point
+        can be found for app_name. The top-level __main__ module of
+        the ZIP package is then used as usual.
+
+    """
+    import zipimport
+    module_name = app_name.replace('-', '_').replace('.', '_')
+    try:
+        # Note: zipimport caches the ZIP directory, so this does not
+        # cause extra overhead for the imports following this lookup
+        importer = zipimport.zipimporter(
+            os.path.join(pyrun_script, pyrun_apps_package))
+    except zipimport.ZipImportError:
+        # No ZIP package appended
+        return None
+    if hasattr(importer, 'find_spec'):
+        # Python 3.10+
+        found = importer.find_spec(module_name) is not None
+    else:
+        found = importer.find_module(module_name) is not None
+    if not found:
+        return None
+    if pyrun_debug > 1:
+        pyrun_log('Found entry point module %s.%s for app %r' % (
+            pyrun_apps_package, module_name, app_name))
+    return '%s.%s' % (pyrun_apps_package, module_name)
+
+def pyrun_pyc_header_size(data, filename):
+
+    """ Check the .pyc header at the start of data and return its size.
+
+        The header format depends on the Python version (which also
+        determines the magic):
+
+        - Python 3.7+ (PEP 552): magic, flags and either timestamp and
+          source size (flags 0) or source hash (flags bit 0 set);
+          16 bytes
+        - Python 3.3 - 3.6: magic, timestamp and source size; 12 bytes
+        - Python 2: magic and timestamp; 8 bytes
+
+        Since there's no source file to check against, timestamps,
+        source sizes and hashes are not validated. filename is only
+        used for error messages.
+
+    """
+    import struct
+    if PY3:
+        import importlib.util
+        magic = importlib.util.MAGIC_NUMBER
+    else:
+        import imp
+        magic = imp.get_magic()
+    if sys.version_info >= (3, 7):
+        header_size = 16
+    elif sys.version_info >= (3, 3):
+        header_size = 12
+    else:
+        header_size = 8
+    if len(data) < header_size or bytes(data[:4]) != magic:
+        pyrun_log_error('Incompatible bytecode file %r' % filename)
+        sys.exit(1)
+    if header_size == 16:
+        flags, = struct.unpack('<I', bytes(data[4:8]))
+        if flags & ~0b11:
+            pyrun_log_error('Invalid flags %r in bytecode file %r' %
+                            (flags, filename))
+            sys.exit(1)
+    return header_size
+
+def pyrun_load_pyc_data(data, filename='<stdin>'):
+
+    """ Return the code object stored in the .pyc format data.
+
+        data may be a bytes object or (in Python 3) any other object
+        supporting the buffer protocol. filename is only used for
+        error messages.
+
+    """
+    import marshal
+    header_size = pyrun_pyc_header_size(data, filename)
+    if PY2:
+        return marshal.loads(data[header_size:])
+    with memoryview(data) as view:
+        return marshal.loads(view[header_size:])
+
+def pyrun_load_pyc_file(filename):
+
+    """ Return the code object stored in the .pyc file filename.
+
+        The file is mapped into memory, so that the code can be
+        unmarshalled without copying the file data first.
+
+    """
+    with open(filename, 'rb') as file:
+        if PY2:
+            return pyrun_load_pyc_data(file.read(), filename)
+        import mmap
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty file or not mappable: read it instead
+            return pyrun_load_pyc_data(file.read(), filename)
+        try:
+            return pyrun_load_pyc_data(data, filename)
+        finally:
+            data.close()
+
+def pyrun_start_script():
+
+    """ Mark the end of the startup and start profiling and tracing,
+        if enabled.
+
+        Called once, before running the (first) script.
+
+    """
+    global pyrun_script_started, pyrun_script_rss
+
+    pyrun_script_started = True
+    pyrun_record_phase('script')
+    if pyrun_report:
+        pyrun_script_rss = pyrun_rss()
+
+    # Start profiling and tracing, if enabled
+    if pyrun_profile:
+        pyrun_start_profiler()
+    if pyrun_tracemalloc:
+        pyrun_start_tracemalloc()
 
 def pyrun_execute_script(pyrun_script, mode='file'):
 
@@ -633,6 +1723,8 @@ def pyrun_execute_script(pyrun_script, mode='file'):
                        with .pyc or .pyo)
         'string'     - run as Python source string
         'codestring' - run as Python byte code string (in .pyc format)
+        'lines'      - run as Python source string for each input
+                       line (-n/-p)
 
     """
     # Run the pyrun_script
@@ -643,6 +1735,10 @@ def pyrun_execute_script(pyrun_script, mode='file'):
         pyrun_log('  sys.path=%r' % sys.path)
         pyrun_log('  globals()=%r' % globals())
 
+    # End of startup
+    if not pyrun_script_started:
+        pyrun_start_script()
+
     # Adjust defaults
     if (mode == 'file' and
         (pyrun_script.endswith('.pyc') or
@@ -719,16 +1815,6 @@ def pyrun_execute_script(pyrun_script, mode='file'):
 
         ### Run pyrun_script as bytecode file or string
 
-        import marshal
-        if PY3:
-            # Python 3
-            import importlib.util
-            MAGIC = importlib.util.MAGIC_NUMBER
-        else:
-            # Python 2
-            import imp
-            MAGIC = imp.get_magic()
-
         if mode == 'codefile':
             if pyrun_verbose:
                 pyrun_log('Running %r as bytecode file' % pyrun_script)
@@ -738,34 +1824,21 @@ def pyrun_execute_script(pyrun_script, mode='file'):
                 sys.exit(1)
             # sys.argv[0]: should be the same as pyrun_script
             assert sys.argv[0] == pyrun_script
-            module_file = open(pyrun_script, 'rb')
+            module_code = pyrun_load_pyc_file(pyrun_script)
+            script_path = pyrun_script
 
         elif mode == 'codestring':
             if pyrun_verbose:
                 pyrun_log('Running pyrun_script as bytecode string')
             # sys.argv[0]: We mimic Python when using the -c option
             sys.argv[0] = '-c'
-            import cStringIO
-            module_file = cStringIO.StringIO(pyrun_script)
-
-        # Check magic
-        if module_file.read(4) != MAGIC:
-            pyrun_log_error('Incompatible bytecode file %r' % pyrun_script)
-            sys.exit(1)
-
-        # Skip timestamp (32 bits)
-        module_file.read(4)
-
-        # Load code object
-        module_code = marshal.load(module_file)
-
-        # Close file
-        module_file.close()
+            script_path = '<stdin>'
+            module_code = pyrun_load_pyc_data(pyrun_script, script_path)
 
         # Exec code in globals
         runtime_globals = globals()
         runtime_globals.update(__name__='__main__',
-                               __file__=pyrun_script)
+                               __file__=script_path)
         pyrun_exec_code(module_code, runtime_globals)
 
     elif mode == 'file':
@@ -812,21 +1885,312 @@ def pyrun_execute_script(pyrun_script, mode='file'):
                                __file__=script_path)
         pyrun_exec_code(code, runtime_globals)
 
+    elif mode == 'lines':
+
+        ### Run pyrun_script as source string for each input line
+
+        if pyrun_verbose:
+            pyrun_log('Running pyrun_script for each input line')
+
+        # Compile the loop function into code object
+        script_path = '<stdin>'
+        code = pyrun_line_loop_code(pyrun_script, script_path)
+
+        # sys.argv[0]: We mimic Python when using the -c option; the
+        # remaining arguments are the input files
+        sys.argv[0] = '-c'
+        filenames = sys.argv[1:] or ['-']
+
+        # Exec code in globals to define pyrun_line_loop()
+        runtime_globals = globals()
+        runtime_globals.update(__name__='__main__',
+                               __file__=script_path)
+        pyrun_exec_code(code, runtime_globals)
+
+        # Run the loop
+        import codecs
+        encoding = sys.stdin.encoding or 'utf-8'
+        errors = sys.stdin.errors or 'strict'
+        def decoder():
+            return codecs.getincrementaldecoder(encoding)(errors).decode
+        def files():
+            for filename in filenames:
+                if filename == '-':
+                    yield sys.stdin.buffer
+                    continue
+                with open(filename, 'rb') as file:
+                    yield file
+        if not pyrun_unbuffered:
+            pyrun_enable_block_buffered_stdout()
+        runtime_globals['pyrun_line_loop'](files(),
+                                           decoder,
+                                           sys.stdout.write)
+
     else:
         raise TypeError('unknown execution mode %r' % mode)
 
+### Batch mode
+
+def pyrun_read_batch_jobs(filename):
+
+    """ Read the batch jobs from filename (- for stdin).
+
+        The file has to contain one JSON object per line with these
+        entries:
+
+        'argv'  - list with the script and its parameters, like on
+                  the pyrun command line; "-c <code>" and "-m <module>"
+                  are supported as well (required)
+        'cwd'   - directory to run the job in (optional)
+        'env'   - dict with environment variables to set for the
+                  job; None values remove the variable (optional)
+        'stdin' - string to provide as sys.stdin (optional; default:
+                  empty)
+
+        Empty lines and lines starting with # are ignored.
+
+    """
+    import json
+    if filename == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(filename) as file:
+            lines = file.read().splitlines()
+    jobs = []
+    for lineno, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as reason:
+            pyrun_log_error('Could not parse batch job in line %i: %s' %
+                            (lineno + 1, reason))
+            sys.exit(1)
+        argv = job.get('argv') if isinstance(job, dict) else None
+        if (not isinstance(argv, list) or
+            not argv or
+            (argv[0] in ('-c', '-m') and len(argv) < 2)):
+            pyrun_log_error('Missing or invalid argv in batch job in '
+                            'line %i' % (lineno + 1))
+            sys.exit(1)
+        jobs.append(job)
+    return jobs
+
+def pyrun_exit_code(code):
+
+    """ Return the process exit code for the SystemExit code code.
+
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('%s\n' % code)
+    return 1
+
+def pyrun_run_batch_job(job):
+
+    """ Run the batch job job (see pyrun_read_batch_jobs()) and return
+        its exit code.
+
+    """
+    argv = list(job['argv'])
+    cwd = job.get('cwd')
+    if cwd:
+        os.chdir(cwd)
+
+    # Setup script to run, mode and sys.argv (see pyrun_main())
+    if argv[0] == '-m':
+        script_mode = 'module'
+        pyrun_script = argv[1]
+        script_dir = os.getcwd()
+        sys.argv = argv[1:]
+    elif argv[0] == '-c':
+        script_mode = 'string'
+        pyrun_script = argv[1]
+        script_dir = os.getcwd()
+        sys.argv = argv[1:]
+    else:
+        pyrun_script = argv[0]
+        if pyrun_script.endswith(('.py', '.pyw')):
+            script_mode = 'file'
+        else:
+            script_mode = 'path'
+        script_dir = os.path.split(pyrun_normpath(pyrun_script))[0]
+        sys.argv = argv
+    if not pyrun_safe_path:
+        sys.path[0] = pyrun_normpath(script_dir)
+
+    # Run the script
+    try:
+        pyrun_execute_script(pyrun_script, script_mode)
+    except SystemExit as exit:
+        return pyrun_exit_code(exit.code)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+def pyrun_run_batch(filename):
+
+    """ Run the jobs listed in the batch file filename (- for stdin)
+        one after another in the current process and write the
+        results to stdout.
+
+        This avoids the startup costs for each job. All jobs are run
+        in a fresh copy of the pyrun globals (which form the __main__
+        namespace) with their own sys.argv, sys.path, working
+        directory and environment. Modules imported by a job are
+        removed from sys.modules again after the job, except for
+        builtin and frozen modules. Other global state (e.g. atexit
+        hooks, warning filters or threads) is not reset.
+
+        The results are written as one JSON object per job and line:
+
+        'job'         - index of the job in the batch file
+        'argv'        - argv of the job
+        'exit_code'   - exit code of the job
+        'interrupted' - True, if the job was interrupted by a
+                        KeyboardInterrupt
+        'time_ms'     - run time of the job in ms
+        'stdout'      - captured sys.stdout output
+        'stderr'      - captured sys.stderr output
+
+        Output written directly to the file descriptors (e.g. by
+        subprocesses) is not captured. Output written as bytes to
+        sys.stdout.buffer and sys.stderr.buffer is decoded as UTF-8.
+
+        A KeyboardInterrupt stops the batch after writing the result
+        of the interrupted job.
+
+        Returns 0, if all jobs succeeded, 130 if the batch was
+        interrupted, 1 otherwise.
+
+    """
+    import io, json, importlib
+
+    jobs = pyrun_read_batch_jobs(filename)
+    pyrun_start_script()
+
+    # Save the state to restore after each job
+    namespace = globals()
+    saved_namespace = dict(namespace)
+    saved_modules = set(sys.modules)
+    saved_path = list(sys.path)
+    saved_cwd = os.getcwd()
+    saved_environ = dict(os.environ)
+    stdin, stdout, stderr = sys.stdin, sys.stdout, sys.stderr
+
+    rc = 0
+    for index, job in enumerate(jobs):
+        if pyrun_verbose:
+            pyrun_log('Running batch job %i: %r' % (index, job['argv']))
+        for name, value in (job.get('env') or {}).items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        # Use binary buffers, so that jobs can write bytes via
+        # sys.stdout.buffer just like outside of batch mode
+        sys.stdin = io.TextIOWrapper(
+            io.BytesIO(job.get('stdin', '').encode('utf-8')),
+            encoding='utf-8')
+        sys.stdout = job_stdout = io.TextIOWrapper(
+            io.BytesIO(), encoding='utf-8', newline='\n')
+        sys.stderr = job_stderr = io.TextIOWrapper(
+            io.BytesIO(), encoding='utf-8', errors='backslashreplace',
+            newline='\n', line_buffering=True)
+        output = {}
+        interrupted = False
+        start = pyrun_clock()
+        try:
+            try:
+                exit_code = pyrun_run_batch_job(job)
+            except KeyboardInterrupt:
+                import traceback
+                traceback.print_exc()
+                exit_code = 130
+                interrupted = True
+            for name, stream in (('stdout', job_stdout),
+                                 ('stderr', job_stderr)):
+                if stream.closed:
+                    # Closed by the job: the output is lost
+                    output[name] = ''
+                    continue
+                stream.flush()
+                output[name] = stream.buffer.getvalue().decode(
+                    'utf-8', 'replace')
+        finally:
+            elapsed = pyrun_clock() - start
+            sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+
+            # Restore the state
+            namespace.clear()
+            namespace.update(saved_namespace)
+            for name, module in list(sys.modules.items()):
+                if (name not in saved_modules and
+                    pyrun_module_source(name, module) not in ('builtin',
+                                                               'frozen')):
+                    del sys.modules[name]
+            sys.path[:] = saved_path
+            os.chdir(saved_cwd)
+            if os.environ != saved_environ:
+                os.environ.clear()
+                os.environ.update(saved_environ)
+            importlib.invalidate_caches()
+
+        if exit_code:
+            rc = 1
+        stdout.write(json.dumps({
+            'job': index,
+            'argv': job['argv'],
+            'exit_code': exit_code,
+            'interrupted': interrupted,
+            'time_ms': elapsed * 1000.0,
+            'stdout': output['stdout'],
+            'stderr': output['stderr'],
+            }, sort_keys=True) + '\n')
+        stdout.flush()
+        if interrupted:
+            if pyrun_verbose:
+                pyrun_log('Batch interrupted in job %i' % index)
+            return 130
+    return rc
+
 ### Main entry point
 
 def pyrun_main():
 
-    global pyrun_mode, pyrun_app, pyrun_as_string, \
-           pyrun_as_module, pyrun_script
+    global pyrun_mode, pyrun_app, pyrun_app_module, pyrun_as_string, \
+           pyrun_as_module, pyrun_script, pyrun_multiprocessing_path
+
+    pyrun_record_phase('main')
+
+    # Write the runtime report on exit, if requested
+    if pyrun_report:
+        pyrun_register_exit_hook(pyrun_write_report)
+
+    # Install the import tracer as early as possible
+    if pyrun_importtime:
+        pyrun_install_import_tracer()
+
+    # Enable perf support as early as possible as well
+    if pyrun_perf:
+        pyrun_enable_perf_trampoline()
 
     # Determine run mode
     pyrun_mode = 'script'
     pyrun_app = os.path.split(sys.executable)[1]
-    if not pyrun_app.startswith(('pyrun', 'python')):
-        # Renaming the pyrun executable triggers app mode
+    multiprocessing_child = (pyrun_fastspawn and
+                             pyrun_is_multiprocessing_child())
+    if (not multiprocessing_child and
+        not pyrun_app.startswith(('pyrun', 'python'))):
+        # Renaming the pyrun executable triggers app mode;
+        # multiprocessing child processes always run in script mode
+        # (even for apps), since they only run the multiprocessing
+        # bootstrap code
         pyrun_mode = 'app'
 
     # Parse the command line and get the script name (if not in app
@@ -834,9 +2198,16 @@ def pyrun_main():
     if pyrun_mode != 'app':
         pyrun_parse_cmdline()
 
+        if multiprocessing_child:
+            # Use the sys.path handed over by the parent process, if
+            # available (see pyrun_setup_site())
+            path = os.environ.get(pyrun_multiprocessing_path_env)
+            if path is not None:
+                pyrun_multiprocessing_path = path.split(os.pathsep)
+
         # Check for interactive mode, now that we have the command
         # line parsed
-        if not sys.argv and sys.stdin.isatty():
+        if not sys.argv and sys.stdin.isatty() and pyrun_batch is None:
             pyrun_mode = 'interactive'
 
     # Enable unbuffered mode
@@ -852,7 +2223,16 @@ def pyrun_main():
 
     # Start the runtime in various modes
 
-    if pyrun_mode == 'script':
+    if pyrun_mode == 'script' and pyrun_batch is not None:
+
+        ### Run the jobs from the batch file
+
+        pyrun_setup_site()
+        if pyrun_gc_freeze:
+            pyrun_freeze_gc()
+        sys.exit(pyrun_run_batch(pyrun_batch))
+
+    elif pyrun_mode == 'script':
 
         ### Run a script
 
@@ -869,6 +2249,13 @@ def pyrun_main():
             pyrun_script = sys.stdin.read()
             sys.argv = ['']
 
+        elif sys.argv[0] == '-' and pyrun_bytecode:
+            # Read the script bytecode from stdin
+            if PY3:
+                pyrun_script = sys.stdin.buffer.read()
+            else:
+                pyrun_script = sys.stdin.read()
+
         elif sys.argv[0] == '-' and not (pyrun_as_string or pyrun_as_module):
             # Read the script from stdin
             pyrun_as_string = True
@@ -885,8 +2272,17 @@ def pyrun_main():
             script_mode = 'module'
             script_path = None
         elif pyrun_as_string:
-            script_mode = 'string'
+            if pyrun_line_mode:
+                script_mode = 'lines'
+            else:
+                script_mode = 'string'
             script_path = None
+        elif pyrun_bytecode:
+            if sys.argv[0] == '-':
+                script_mode = 'codestring'
+                script_path = None
+            else:
+                script_mode = 'codefile'
         else:
             if pyrun_version < '2.7.0':
                 script_mode = 'file'
@@ -899,13 +2295,12 @@ def pyrun_main():
                 # provides support for directories, ZIP files, etc.
                 script_mode = 'path'
 
-        # Setup sys.path
-        pyrun_setup_sys_path(script_path)
+        # Setup sys.path and import the site module
+        pyrun_setup_site(script_path)
 
-        # Import site module and run site.main() (which is not run by
-        # pyrun per default like in standard Python; see makepyrun.py)
-        if not pyrun_skip_site_main:
-            pyrun_run_site_main()
+        # Keep the startup objects out of future gc collections
+        if pyrun_gc_freeze:
+            pyrun_freeze_gc()
 
         # Run the script
         try:
@@ -933,17 +2328,25 @@ def pyrun_main():
         # __main__ module from the appended ZIP file and runs it)
         pyrun_script = sys.executable
 
-        # Setup sys.path
-        pyrun_setup_sys_path(pyrun_script)
+        # Setup sys.path and import the site module
+        pyrun_setup_site(pyrun_script)
 
-        # Import site module and run site.main() (which is not run by
-        # pyrun per default like in standard Python; see makepyrun.py)
-        if not pyrun_skip_site_main:
-            pyrun_run_site_main()
+        # Keep the startup objects out of future gc collections
+        if pyrun_gc_freeze:
+            pyrun_freeze_gc()
+
+        # Check for multi-app binaries, which select the app to run
+        # by the name used for invoking the binary
+        pyrun_app_module = pyrun_find_app_module(pyrun_script, pyrun_app)
 
         # Run the script
         try:
-            pyrun_execute_script(pyrun_script, 'path')
+            if pyrun_app_module is not None:
+                # Run the app's entry point module from the ZIP package
+                sys.path.insert(0, pyrun_script)
+                pyrun_execute_script(pyrun_app_module, 'module')
+            else:
+                pyrun_execute_script(pyrun_script, 'path')
         except Exception as reason:
             if pyrun_inspect:
                 import traceback
@@ -963,13 +2366,8 @@ def pyrun_main():
 
         ### Enter interactive mode
 
-        # Setup sys.path
-        pyrun_setup_sys_path()
-
-        # Import site module and run site.main() (which is not run by
-        # pyrun per default like in standard Python; see makepyrun.py)
-        if not pyrun_skip_site_main:
-            pyrun_run_site_main()
+        # Setup sys.path and import the site module
+        pyrun_setup_site()
 
         # Setup sys.argv for interactive mode
         if not sys.argv:
@@ -0,0 +1,272 @@
+#===========================================================================
+#
+# PyRun subinterpreter pool
+#
+#---------------------------------------------------------------------------
+#
+# This module provides a pool of isolated subinterpreters, each with its
+# own GIL (PEP 684), which can be used to run CPU bound code in
+# parallel on multiple cores inside a single pyrun process.
+#
+# Usage:
+#
+#     from pyrun_pool import InterpreterPool
+#
+#     with InterpreterPool(4) as pool:
+#         results = list(pool.map(math.factorial, range(1000, 1100)))
+#
+# The pool implements the concurrent.futures.Executor interface. Work
+# items are pickled and handed to the subinterpreters; results are
+# returned via channels. This means that:
+#
+# * callables must be importable by name in the subinterpreters,
+#   i.e. be defined in a module on sys.path (not in the __main__
+#   script) or in the frozen stdlib,
+#
+# * arguments, results and exceptions must be picklable,
+#
+# * C extensions used by the callables must support per-interpreter
+#   GILs (most of the stdlib modules included in pyrun do).
+#
+# The subinterpreters are started with the sys.path of the main
+# interpreter. Since pyrun has the stdlib frozen into the executable,
+# starting them is cheap.
+#
+# Requires Python 3.12+. Python 3.13 renamed the private
+# subinterpreter modules and changed some of their APIs; the pool
+# supports both versions.
+#
+
+### Imports
+
+import sys
+import os
+import pickle
+import threading
+import queue
+import weakref
+from concurrent import futures
+
+try:
+    # Python 3.13+
+    import _interpreters
+    import _interpchannels as _channels
+except ImportError:
+    try:
+        # Python 3.12
+        import _xxsubinterpreters as _interpreters
+        import _xxinterpchannels as _channels
+    except ImportError:
+        _interpreters = None
+        _channels = None
+
+# Use the Python 3.13+ APIs ?
+_NEW_API = getattr(_interpreters, '__name__', None) == '_interpreters'
+
+### Globals
+
+# Code run in the subinterpreters when starting them; gets the
+# main interpreter's sys.path passed in as "path"
+_INIT_CODE = """\
+import sys
+sys.path[:] = path.split('\\0')
+del path
+"""
+
+# Python 3.13 channels: send() blocks until the item is received by
+# default and create() needs the operation to apply to unreceived items
+# when the sending interpreter is destroyed (1 = remove them)
+if _NEW_API:
+    _SEND_OPTIONS = ', blocking=False'
+    _CREATE_ARGS = (1,)
+else:
+    _SEND_OPTIONS = ''
+    _CREATE_ARGS = ()
+
+# Code run in the subinterpreters for each work item; gets the pickled
+# work item passed in as "task" and the result channel as "channel"
+_TASK_CODE = """\
+import pickle as _pickle
+import %s as _channels
+try:
+    _func, _args, _kwargs = _pickle.loads(task)
+    _result = (True, _func(*_args, **_kwargs))
+except BaseException as _exc:
+    _result = (False, _exc)
+try:
+    _data = _pickle.dumps(_result)
+except BaseException as _exc:
+    _data = _pickle.dumps(
+        (False, RuntimeError('Could not pickle task result: %%s' %% _exc)))
+_channels.send(channel, _data%s)
+del task, channel, _func, _args, _kwargs, _result, _data
+""" % (getattr(_channels, '__name__', None), _SEND_OPTIONS)
+
+# Pools which have not been shut down yet; the main interpreter cannot
+# be finalized while their subinterpreters are still alive, so these
+# are shut down at exit
+_pools = weakref.WeakSet()
+_exiting = False
+
+### Errors
+
+class PoolError(RuntimeError):
+
+    """ Error raised by the InterpreterPool.
+
+    """
+    pass
+
+### Helpers
+
+def _create_interpreter():
+
+    if _NEW_API:
+        return _interpreters.create('isolated')
+    return _interpreters.create(isolated=True)
+
+def _run_string(interp, code, shared):
+
+    # Python 3.13+ return an exception snapshot instead of raising an
+    # exception
+    excinfo = _interpreters.run_string(interp, code, shared)
+    if excinfo is not None:
+        raise PoolError('Subinterpreter failed: %s' % excinfo.formatted)
+
+def _recv(channel):
+
+    data = _channels.recv(channel)
+    if _NEW_API:
+        # Python 3.13+ return (data, unboundop)
+        data = data[0]
+    return data
+
+def _python_exit():
+
+    # Shut down all pools before the threading module joins the
+    # (non-daemon) worker threads at exit, like ThreadPoolExecutor does
+    global _exiting
+    _exiting = True
+    for pool in list(_pools):
+        pool.shutdown()
+
+if _interpreters is not None:
+    threading._register_atexit(_python_exit)
+
+### Pool
+
+class InterpreterPool(futures.Executor):
+
+    """ Pool of isolated subinterpreters, each with its own GIL.
+
+        max_workers defines the number of subinterpreters to start. It
+        defaults to the number of CPUs.
+
+        Each subinterpreter is driven by a worker thread of the main
+        interpreter, which hands it the work items one at a time.
+
+        Pools which are not shut down explicitly are shut down when the
+        main interpreter exits (pending work items are still run).
+
+    """
+    def __init__(self, max_workers=None):
+
+        if _interpreters is None:
+            raise PoolError(
+                'Subinterpreters with their own GIL are only '
+                'supported in Python 3.12+')
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers <= 0:
+            raise ValueError('max_workers must be greater than 0')
+        self.max_workers = max_workers
+        self._queue = queue.SimpleQueue()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._threads = []
+        if _exiting:
+            raise RuntimeError('cannot create a pool after interpreter '
+                               'shutdown')
+        path = '\0'.join(sys.path)
+        for i in range(max_workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(path,),
+                name='InterpreterPool-%i' % i)
+            thread.start()
+            self._threads.append(thread)
+        _pools.add(self)
+
+    def _worker(self, path):
+
+        """ Worker thread: create a subinterpreter and run the work
+            items from the queue in it, until a None item is found.
+
+        """
+        interp = _create_interpreter()
+        channel = _channels.create(*_CREATE_ARGS)
+        try:
+            _run_string(interp, _INIT_CODE, {'path': path})
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                future, task = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    _run_string(
+                        interp, _TASK_CODE,
+                        {'task': task, 'channel': channel})
+                    ok, result = pickle.loads(_recv(channel))
+                except BaseException as exc:
+                    future.set_exception(exc)
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        finally:
+            _channels.destroy(channel)
+            _interpreters.destroy(interp)
+
+    def submit(self, fn, /, *args, **kwargs):
+
+        """ Schedule fn(*args, **kwargs) to run in one of the
+            subinterpreters and return a Future for the result.
+
+        """
+        # Pickle in the calling thread, to report problems right away
+        task = pickle.dumps((fn, args, kwargs))
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            future = futures.Future()
+            self._queue.put((future, task))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+
+        """ Shut down the pool and its subinterpreters.
+
+            Pending work items are run before shutting down, unless
+            cancel_futures is true.
+
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            for thread in self._threads:
+                self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
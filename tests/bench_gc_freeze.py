@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# Benchmark the effect of gc.freeze() on the memory shared between
+# multiprocessing workers forked from a common parent process.
+#
+# Runs the same multiprocessing workload (based on
+# test_multiprocessing.py) with PYRUN_GCFREEZE=0 and PYRUN_GCFREEZE=1
+# and reports the PSS (proportional set size) and private dirty memory
+# per worker, taken from /proc/<pid>/smaps_rollup.
+#
+# Usage: bench_gc_freeze.py [runtime] [workers]
+#
+# Note: This benchmark only works on Linux.
+#
+
+import os, sys, subprocess
+
+WORKERS = 8
+
+# Number of objects to create during the simulated app preload
+PRELOAD_OBJECTS = 200000
+
+def memory_usage(pid='self'):
+
+    """ Return (pss, private_dirty) in kB for process pid.
+
+    """
+    pss = private_dirty = 0
+    path = '/proc/%s/smaps_rollup' % pid
+    if not os.path.exists(path):
+        # Linux < 4.14
+        path = '/proc/%s/smaps' % pid
+    with open(path) as smaps:
+        for line in smaps:
+            if line.startswith('Pss:'):
+                pss += int(line.split()[1])
+            elif line.startswith('Private_Dirty:'):
+                private_dirty += int(line.split()[1])
+    return pss, private_dirty
+
+def freeze_gc():
+
+    """ Call the pyrun gc freeze hook, or gc.freeze() when not running
+        under pyrun.
+
+    """
+    try:
+        import pyrun_main
+    except ImportError:
+        import gc
+        gc.freeze()
+    else:
+        pyrun_main.pyrun_freeze_gc()
+
+def worker(barrier, results):
+
+    """ Worker function: run a full collection, as would eventually
+        happen in a long running worker, and measure the memory usage
+        while all workers are alive.
+
+    """
+    import gc
+    gc.collect()
+    barrier.wait()
+    results.put(memory_usage())
+    barrier.wait()
+
+def run_workers(workers):
+
+    """ Preload some app data, fork the workers and print the average
+        memory usage per worker.
+
+    """
+    import multiprocessing
+    # Simulate an app preload, which creates lots of gc tracked objects
+    import json, decimal, email.parser, http.client, xml.dom.minidom
+    preload = [{'id': i, 'data': [i, str(i)]} for i in range(PRELOAD_OBJECTS)]
+    if os.environ.get('PYRUN_GCFREEZE') == '1':
+        # The bootstrap already froze the startup objects (under pyrun);
+        # freeze again to also include the preloaded objects
+        freeze_gc()
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    jobs = []
+    for i in range(workers):
+        p = context.Process(target=worker, args=(barrier, results))
+        jobs.append(p)
+        p.start()
+    usage = [results.get() for i in range(workers)]
+    while jobs:
+        p = jobs.pop()
+        p.join()
+    pss = sum(u[0] for u in usage) / float(workers)
+    private_dirty = sum(u[1] for u in usage) / float(workers)
+    print('%.0f %.0f' % (pss, private_dirty))
+
+def benchmark(runtime, workers=WORKERS):
+
+    print('Running %i workers using %s' % (workers, runtime))
+    print('')
+    print('PYRUN_GCFREEZE  PSS/worker [kB]  Private_Dirty/worker [kB]')
+    for gc_freeze in ('0', '1'):
+        env = dict(os.environ, PYRUN_GCFREEZE=gc_freeze)
+        output = subprocess.check_output(
+            [runtime, os.path.abspath(__file__), '--run-workers', str(workers)],
+            env=env)
+        pss, private_dirty = output.decode('ascii').split()
+        print('%14s  %15s  %25s' % (gc_freeze, pss, private_dirty))
+
+###
+
+if __name__ == '__main__':
+    if not sys.platform.startswith('linux'):
+        print('Benchmark only works on Linux. Skipping.')
+        sys.exit(0)
+    if sys.version_info < (3, 7):
+        print('gc.freeze() needs Python 3.7+. Skipping.')
+        sys.exit(0)
+    if sys.argv[1:2] == ['--run-workers']:
+        run_workers(int(sys.argv[2]))
+        sys.exit(0)
+    try:
+        runtime = sys.argv[1]
+    except IndexError:
+        runtime = sys.executable
+    try:
+        workers = int(sys.argv[2])
+    except IndexError:
+        workers = WORKERS
+    benchmark(runtime, workers)
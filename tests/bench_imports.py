@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# Per-module import benchmark: frozen pyrun vs. stock CPython.
+#
+# Imports each module listed in the generated pyrun.py (the import
+# lines written by makepyrun.find_imports() into the freeze.py hooks
+# section) in a fresh process and records the import time and RSS
+# increase, under pyrun and under a reference interpreter (normally the
+# CPython installation pyrun was built from).
+#
+# Prints a ranked table of the slowest imports under pyrun and one of
+# the modules which import slower under pyrun than under the reference
+# interpreter.
+#
+# Usage: bench_imports.py [options] pyrun.py runtime reference
+#
+# Note: The RSS increase is only available on Linux.
+#
+
+import os, sys, re, subprocess, json, argparse, statistics
+
+# Modules with import time side effects, which are not benchmarked:
+# packages listed here are excluded together with their submodules and
+# so are all __main__ modules (these run the package's main program)
+EXCLUDED_MODULES = (
+    'antigravity',      # opens a web browser
+    'this',             # prints the Zen of Python
+    '__hello__',        # prints a greeting in older Python versions
+    '__phello__',
+    'idlelib',          # IDLE GUI
+    'turtledemo',       # turtle GUI demos
+)
+
+# Code run in the fresh processes; gets the module name passed in as
+# sys.argv[1] and writes the import time in us and the RSS increase in
+# kB to stdout
+PROBE_CODE = '''\
+import sys, time
+def rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return 0
+name = sys.argv[1]
+rss_before = rss()
+start = time.perf_counter()
+__import__(name)
+elapsed = time.perf_counter() - start
+sys.stdout.write('%f %i' % (elapsed * 1e6, rss() - rss_before))
+'''
+
+def excluded(name):
+
+    """ Return True, if module name should not be benchmarked.
+
+    """
+    if name == '__main__' or name.endswith('.__main__'):
+        return True
+    for excluded_name in EXCLUDED_MODULES:
+        if name == excluded_name or name.startswith(excluded_name + '.'):
+            return True
+    return False
+
+def read_imports(pyrun_py):
+
+    """ Return the list of module names imported in the freeze.py hooks
+        section of the generated pyrun.py.
+
+        Modules with import time side effects (see EXCLUDED_MODULES)
+        are not included.
+
+    """
+    with open(pyrun_py) as f:
+        source = f.read()
+    hooks = source.find('### freeze.py Hooks')
+    if hooks < 0:
+        raise ValueError('%s has no freeze.py hooks section' % pyrun_py)
+    modules = re.findall(r'^import ([\w.]+)\s*$', source[hooks:], re.M)
+    # Remove duplicates, but keep the order
+    seen = set()
+    return [name
+            for name in modules
+            if not (excluded(name) or name in seen or seen.add(name))]
+
+def measure(runtime, name, runs=3):
+
+    """ Return (import time in us, RSS increase in kB) for importing
+        module name with runtime or None, if the import fails.
+
+        Uses the minimum time and the median RSS increase of runs
+        runs.
+
+    """
+    times = []
+    rss = []
+    for i in range(runs):
+        process = subprocess.Popen(
+            [runtime, '-c', PROBE_CODE, name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stdout_data, stderr_data = process.communicate()
+        if process.returncode:
+            return None
+        elapsed, rss_delta = stdout_data.split()
+        times.append(float(elapsed))
+        rss.append(int(rss_delta))
+    return min(times), statistics.median(rss)
+
+def print_table(title, rows):
+
+    print(title)
+    print('')
+    print('%-40s %12s %12s %7s %10s %10s' % (
+        'Module', 'pyrun[us]', 'ref[us]', 'ratio', 'pyrun[kB]', 'ref[kB]'))
+    for name, result in rows:
+        print('%-40s %12.0f %12s %7s %10i %10s' % (
+            name[:40],
+            result['time_us'],
+            '%.0f' % result['ref_time_us']
+            if result['ref_time_us'] is not None else '-',
+            '%.2f' % result['ratio'] if result['ratio'] is not None else '-',
+            result['rss_kb'],
+            '%i' % result['ref_rss_kb']
+            if result['ref_rss_kb'] is not None else '-'))
+    print('')
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the import of each module included '
+        'in pyrun under pyrun and a reference interpreter.')
+    parser.add_argument('pyrun_py',
+                        help='generated pyrun.py with the import list')
+    parser.add_argument('runtime',
+                        help='pyrun runtime to benchmark')
+    parser.add_argument('reference',
+                        help='reference interpreter to compare against')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='number of runs per module (default: 3)')
+    parser.add_argument('--top', type=int, default=30,
+                        help='number of modules to show per table '
+                        '(default: 30)')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this JSON file')
+    options = parser.parse_args()
+
+    modules = read_imports(options.pyrun_py)
+    print('Benchmarking %i module imports...' % len(modules))
+    results = {}
+    failed = []
+    for name in modules:
+        result = measure(options.runtime, name, options.runs)
+        if result is None:
+            failed.append(name)
+            continue
+        ref_result = measure(options.reference, name, options.runs)
+        if ref_result is None:
+            ref_result = (None, None)
+        ratio = None
+        if ref_result[0]:
+            ratio = result[0] / ref_result[0]
+        results[name] = {
+            'time_us': result[0],
+            'rss_kb': result[1],
+            'ref_time_us': ref_result[0],
+            'ref_rss_kb': ref_result[1],
+            'ratio': ratio,
+        }
+    print('')
+
+    slowest = sorted(results.items(),
+                     key=lambda item: -item[1]['time_us'])
+    print_table('Slowest imports under %s:' % options.runtime,
+                slowest[:options.top])
+    slower = sorted([item
+                     for item in results.items()
+                     if item[1]['ratio'] is not None and
+                     item[1]['ratio'] > 1.0],
+                    key=lambda item: -item[1]['ratio'])
+    print_table('Imports slower under %s than under %s:' % (
+                    options.runtime, options.reference),
+                slower[:options.top])
+    if failed:
+        print('Imports failing under %s: %s' % (
+            options.runtime, ', '.join(failed)))
+        print('')
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({
+                'runtime': options.runtime,
+                'reference': options.reference,
+                'results': results,
+                'failed': failed,
+                }, f, indent=2, sort_keys=True)
+
+###
+
+if __name__ == '__main__':
+    main()
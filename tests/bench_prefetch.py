@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Benchmark the prefetching of the frozen code region (PYRUN_PREFETCH).
+#
+# Runs "runtime -c pass" cold (after evicting the runtime from the page
+# cache) and warm without prefetching (PYRUN_PREFETCH=0), with
+# madvise(MADV_WILLNEED) (PYRUN_PREFETCH=1) and with additional
+# transparent huge pages (PYRUN_PREFETCH=2), and reports the median
+# wall time and page faults of each setting. If the perf tool is
+# available, the iTLB misses are reported as well.
+#
+# Usage: bench_prefetch.py [options] runtime
+#
+# Note: This benchmark only works on Linux. Cold runs need
+# os.posix_fadvise() and only evict pages which are not mapped by other
+# processes.
+#
+
+import os, sys, subprocess, json, shutil, argparse, statistics
+
+from bench_startup import run, evict
+
+SETTINGS = ('0', '1', '2')
+
+# perf events to count (perf event name, result name)
+PERF_EVENTS = (
+    ('iTLB-load-misses', 'itlb_misses'),
+    ('page-faults', 'page_faults'),
+    ('major-faults', 'major_faults'),
+)
+
+def perf_stat(args, env):
+
+    """ Return a dict with the perf event counts for running args or
+        None, if perf is not available.
+
+    """
+    if shutil.which('perf') is None:
+        return None
+    command = ['perf', 'stat', '-x', ',',
+               '-e', ','.join(event for event, name in PERF_EVENTS),
+               '--'] + args
+    process = subprocess.Popen(command,
+                               env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    stdout_data, stderr_data = process.communicate()
+    if process.returncode:
+        return None
+    names = dict(PERF_EVENTS)
+    counts = {}
+    for line in stderr_data.decode('utf-8', 'replace').splitlines():
+        fields = line.split(',')
+        if len(fields) < 3:
+            continue
+        for field in fields[2:]:
+            name = names.get(field.split(':')[0])
+            if name is not None:
+                try:
+                    counts[name] = int(fields[0])
+                except ValueError:
+                    # <not supported> or <not counted>
+                    counts[name] = None
+                break
+    return counts
+
+def benchmark(runtime, setting, runs=20, cold_runs=5):
+
+    """ Benchmark runtime with PYRUN_PREFETCH=setting and return a dict
+        with the results.
+
+    """
+    env = dict(os.environ, PYRUN_PREFETCH=setting)
+    args = [runtime, '-c', 'pass']
+    results = {}
+    for kind, count in (('cold', cold_runs), ('warm', runs)):
+        walls = []
+        minflt = []
+        majflt = []
+        for i in range(count):
+            if kind == 'cold':
+                evict([runtime])
+            wall_ms, rusage, output = run(args, env=env)
+            walls.append(wall_ms)
+            minflt.append(rusage.ru_minflt)
+            majflt.append(rusage.ru_majflt)
+        if not walls:
+            continue
+        results[kind] = {
+            'wall_ms': statistics.median(walls),
+            'minflt': statistics.median(minflt),
+            'majflt': statistics.median(majflt),
+        }
+    counts = perf_stat(args, env)
+    if counts:
+        results['perf'] = counts
+    return results
+
+def format_value(value, format='%.1f'):
+
+    if value is None:
+        return '-'
+    return format % value
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the PYRUN_PREFETCH settings of a pyrun '
+        'runtime.')
+    parser.add_argument('runtime',
+                        help='pyrun runtime to benchmark')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='number of warm runs per setting (default: 20)')
+    parser.add_argument('--cold-runs', type=int, default=5,
+                        help='number of cold runs per setting (default: 5)')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this JSON file')
+    options = parser.parse_args()
+
+    if not sys.platform.startswith('linux'):
+        print('PYRUN_PREFETCH is only supported on Linux. Skipping.')
+        return
+    if not hasattr(os, 'posix_fadvise'):
+        options.cold_runs = 0
+
+    results = {}
+    for setting in SETTINGS:
+        results[setting] = benchmark(options.runtime, setting,
+                                     options.runs, options.cold_runs)
+
+    print('PYRUN_PREFETCH benchmark for %s' % options.runtime)
+    print('')
+    print('%-8s %10s %8s %8s %10s %8s %8s %12s' % (
+        'setting', 'cold[ms]', 'minflt', 'majflt',
+        'warm[ms]', 'minflt', 'majflt', 'iTLB misses'))
+    for setting in SETTINGS:
+        result = results[setting]
+        cold = result.get('cold', {})
+        warm = result['warm']
+        perf = result.get('perf', {})
+        print('%-8s %10s %8s %8s %10s %8s %8s %12s' % (
+            setting,
+            format_value(cold.get('wall_ms')),
+            format_value(cold.get('minflt'), '%i'),
+            format_value(cold.get('majflt'), '%i'),
+            format_value(warm['wall_ms']),
+            format_value(warm['minflt'], '%i'),
+            format_value(warm['majflt'], '%i'),
+            format_value(perf.get('itlb_misses'), '%i')))
+    print('')
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({
+                'runtime': options.runtime,
+                'results': results,
+                }, f, indent=2, sort_keys=True)
+
+###
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Benchmark the latency of starting multiprocessing child processes
+# using the spawn and forkserver start methods.
+#
+# Runs the same workload (based on test_multiprocessing.py) with
+# PYRUN_FASTSPAWN=0 and PYRUN_FASTSPAWN=1 and reports the average time
+# needed to start and join a worker process, together with the gain of
+# the fast bootstrap.
+#
+# Usage: bench_spawn.py [runtime] [workers]
+#
+
+import os, sys, subprocess
+
+WORKERS = 20
+
+def worker():
+
+    """ Worker function: do nothing, we're only interested in the
+        startup time.
+
+    """
+    pass
+
+def run_workers(start_method, workers):
+
+    """ Start and join workers one after the other and print the
+        average time per worker in ms.
+
+    """
+    import multiprocessing, time
+    context = multiprocessing.get_context(start_method)
+    # Start the first worker outside the timing loop, to have the
+    # forkserver and resource tracker processes running
+    p = context.Process(target=worker)
+    p.start()
+    p.join()
+    start = time.time()
+    for i in range(workers):
+        p = context.Process(target=worker)
+        p.start()
+        p.join()
+    print('%.2f' % ((time.time() - start) * 1000.0 / workers))
+
+def measure(runtime, start_method, fastspawn, workers):
+
+    """ Return the average time per worker in ms for runtime using
+        start_method and PYRUN_FASTSPAWN=fastspawn.
+
+    """
+    env = dict(os.environ, PYRUN_FASTSPAWN=fastspawn)
+    output = subprocess.check_output(
+        [runtime, os.path.abspath(__file__),
+         '--run-workers', start_method, str(workers)],
+        env=env)
+    return float(output.decode('ascii').strip())
+
+def benchmark(runtime, workers=WORKERS):
+
+    import multiprocessing
+    print('Running %i workers using %s' % (workers, runtime))
+    print('')
+    print('Time/worker [ms]  PYRUN_FASTSPAWN=0  PYRUN_FASTSPAWN=1    Gain')
+    for start_method in ('spawn', 'forkserver'):
+        if start_method not in multiprocessing.get_all_start_methods():
+            continue
+        slow = measure(runtime, start_method, '0', workers)
+        fast = measure(runtime, start_method, '1', workers)
+        print('%16s  %17.2f  %17.2f  %5.1f%%' % (
+            start_method, slow, fast, (slow - fast) * 100.0 / slow))
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 4):
+        print('multiprocessing start methods need Python 3.4+. Skipping.')
+        sys.exit(0)
+    if sys.argv[1:2] == ['--run-workers']:
+        run_workers(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    try:
+        runtime = sys.argv[1]
+    except IndexError:
+        runtime = sys.executable
+    try:
+        workers = int(sys.argv[2])
+    except IndexError:
+        workers = WORKERS
+    benchmark(runtime, workers)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+#
+# Startup benchmark suite for pyrun.
+#
+# Measures the startup of the given runtimes in all pyrun entry modes
+# and compares them against a reference interpreter (normally the stock
+# CPython pyrun was built from):
+#
+# c-pass    - runtime -c pass
+# script    - runtime script.py
+# module    - runtime -m module
+# stdin     - runtime - < script
+# app       - app mode: runtime copied to a new name with an appended
+#             ZIP file (the reference runs the ZIP file instead)
+# no-site   - runtime -S -c pass
+# isolated  - runtime -I -c pass
+#
+# For each runtime and mode, the benchmark records the warm wall time
+# (median of several runs after a warm-up run), the cold wall time
+# (median of runs after evicting the runtime and its module files from
+# the page cache), the minor/major page faults, and the peak RSS and
+# number of modules loaded at startup (measured by a separate probe run).
+#
+# Budgets can be given as [mode.]metric=value and are checked against
+# the first runtime given on the command line; the other runtimes are
+# only measured for comparison. Metrics are wall_ms, cold_ms,
+# maxrss_kb, minflt, majflt and modules, or any of these with a
+# "_ratio" suffix, which checks the value relative to the reference
+# interpreter. The script exits with code 1, if a budget is exceeded.
+#
+# Usage: bench_startup.py [options] runtime [runtime ...]
+#
+# Note: This benchmark only works on Unix platforms. Cold runs need
+# os.posix_fadvise() and only evict pages which are not mapped by other
+# processes.
+#
+
+import os, sys, subprocess, time, json, shutil, tempfile, zipfile
+import argparse, statistics
+
+MODES = (
+    'c-pass',
+    'script',
+    'module',
+    'stdin',
+    'app',
+    'no-site',
+    'isolated',
+)
+
+METRICS = (
+    'wall_ms',
+    'cold_ms',
+    'maxrss_kb',
+    'minflt',
+    'majflt',
+    'modules',
+)
+
+# Code used for the timing runs
+TIMING_CODE = 'pass\n'
+
+# Code used for determining the number of loaded modules and the peak
+# RSS; note: ru_maxrss as returned by os.wait4() cannot be used for the
+# latter, since it includes the RSS of the forked benchmark process
+# before running exec()
+PROBE_CODE = '''\
+import sys
+modules = len(sys.modules)
+try:
+    with open('/proc/self/status') as f:
+        maxrss = [int(line.split()[1])
+                  for line in f
+                  if line.startswith('VmHWM:')][0]
+except (IOError, OSError):
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+sys.stdout.write('%i %i' % (modules, maxrss))
+'''
+
+# Code used for finding the files to evict for cold runs
+FILES_CODE = ('import sys; print("\\n".join([sys.executable] + ['
+              'getattr(m, "__file__", None) or "" '
+              'for m in list(sys.modules.values())]))')
+
+class Workload:
+
+    """ Files needed for running the benchmark modes with a given
+        runtime and code.
+
+    """
+    def __init__(self, workdir, runtime, code, reference=False):
+
+        self.workdir = workdir
+        self.runtime = runtime
+        self.code = code
+        self.reference = reference
+        os.makedirs(workdir)
+        self.script = os.path.join(workdir, 'bench_script.py')
+        with open(self.script, 'w') as f:
+            f.write(code)
+        with open(os.path.join(workdir, 'bench_module.py'), 'w') as f:
+            f.write(code)
+        self.zip_file = os.path.join(workdir, 'bench_app.zip')
+        with zipfile.ZipFile(self.zip_file, 'w') as zip_file:
+            zip_file.writestr('__main__.py', code)
+        if reference:
+            self.app = None
+        else:
+            # Renaming the runtime triggers app mode
+            self.app = os.path.join(workdir, 'benchapp')
+            shutil.copyfile(runtime, self.app)
+            shutil.copymode(runtime, self.app)
+            with open(self.app, 'ab') as app, open(self.zip_file, 'rb') as f:
+                app.write(f.read())
+
+    def command(self, mode):
+
+        """ Return (args, stdin data) for running mode.
+
+        """
+        runtime = self.runtime
+        if mode == 'c-pass':
+            return [runtime, '-c', self.code], None
+        elif mode == 'script':
+            return [runtime, self.script], None
+        elif mode == 'module':
+            return [runtime, '-m', 'bench_module'], None
+        elif mode == 'stdin':
+            return [runtime, '-'], self.code.encode('utf-8')
+        elif mode == 'app':
+            if self.app is None:
+                return [runtime, self.zip_file], None
+            return [self.app], None
+        elif mode == 'no-site':
+            return [runtime, '-S', '-c', self.code], None
+        elif mode == 'isolated':
+            return [runtime, '-I', '-c', self.code], None
+        raise ValueError('unknown mode %r' % mode)
+
+def run(args, stdin_data=None, cwd=None, env=None):
+
+    """ Run args and return (wall time in ms, rusage, stdout data).
+
+    """
+    # Use files for the I/O, since we have to reap the process
+    # ourselves to get its resource usage
+    with tempfile.TemporaryFile() as stdin_file, \
+         tempfile.TemporaryFile() as stdout_file, \
+         tempfile.TemporaryFile() as stderr_file:
+        if stdin_data:
+            stdin_file.write(stdin_data)
+            stdin_file.seek(0)
+        start = time.perf_counter()
+        process = subprocess.Popen(args,
+                                   cwd=cwd,
+                                   env=env,
+                                   stdin=stdin_file,
+                                   stdout=stdout_file,
+                                   stderr=stderr_file)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        wall_ms = (time.perf_counter() - start) * 1000.0
+        if os.WIFEXITED(status):
+            process.returncode = os.WEXITSTATUS(status)
+        else:
+            process.returncode = -os.WTERMSIG(status)
+        stdout_file.seek(0)
+        stdout_data = stdout_file.read()
+        if process.returncode:
+            stderr_file.seek(0)
+            raise RuntimeError('%s failed with exit code %i: %s' % (
+                ' '.join(args), process.returncode,
+                stderr_file.read().decode('utf-8', 'replace')))
+    return wall_ms, rusage, stdout_data
+
+def evict(files):
+
+    """ Evict the given files from the page cache.
+
+    """
+    for path in files:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+def startup_files(runtime, workload):
+
+    """ Return the files read by runtime when starting up.
+
+    """
+    wall_ms, rusage, output = run([runtime, '-c', FILES_CODE])
+    files = set(line.strip() for line in output.decode('utf-8').splitlines())
+    files.update([workload.script, workload.zip_file])
+    if workload.app is not None:
+        files.add(workload.app)
+    return sorted(path for path in files if path and os.path.isfile(path))
+
+def benchmark(runtime, workdir, runs=20, cold_runs=3, reference=False):
+
+    """ Benchmark runtime in all modes and return a dict mapping
+        modes to dicts of metrics.
+
+    """
+    timing = Workload(os.path.join(workdir, 'timing'), runtime,
+                      TIMING_CODE, reference)
+    probe = Workload(os.path.join(workdir, 'probe'), runtime,
+                     PROBE_CODE, reference)
+    can_evict = hasattr(os, 'posix_fadvise')
+    if cold_runs and can_evict:
+        files = startup_files(runtime, timing)
+    results = {}
+    for mode in MODES:
+        args, stdin_data = timing.command(mode)
+        cwd = timing.workdir
+        # Warm runs
+        run(args, stdin_data, cwd)
+        walls = []
+        minflt = []
+        majflt = []
+        for i in range(runs):
+            wall_ms, rusage, output = run(args, stdin_data, cwd)
+            walls.append(wall_ms)
+            minflt.append(rusage.ru_minflt)
+            majflt.append(rusage.ru_majflt)
+        # Cold runs
+        colds = []
+        if cold_runs and can_evict:
+            for i in range(cold_runs):
+                evict(files)
+                wall_ms, rusage, output = run(args, stdin_data, cwd)
+                colds.append(wall_ms)
+        # Module count and peak RSS
+        args, stdin_data = probe.command(mode)
+        wall_ms, rusage, output = run(args, stdin_data, probe.workdir)
+        try:
+            modules, maxrss = [int(value) for value in output.split()]
+        except ValueError:
+            # The runtime does not support this mode (e.g. app mode
+            # for runtimes other than pyrun)
+            modules = maxrss = None
+        results[mode] = {
+            'wall_ms': statistics.median(walls),
+            'wall_ms_min': min(walls),
+            'cold_ms': statistics.median(colds) if colds else None,
+            'maxrss_kb': maxrss,
+            'minflt': statistics.median(minflt),
+            'majflt': statistics.median(majflt),
+            'modules': modules,
+        }
+    return results
+
+def parse_budget(spec):
+
+    """ Parse a budget spec [mode.]metric=value into (mode, metric,
+        value). mode is None, if the budget applies to all modes.
+
+    """
+    try:
+        name, value = spec.split('=', 1)
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid budget %r' % spec)
+    mode = None
+    if '.' in name:
+        mode, name = name.split('.', 1)
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError('unknown mode in budget %r' %
+                                             spec)
+    metric = name
+    if metric.endswith('_ratio'):
+        metric = metric[:-len('_ratio')]
+    if metric not in METRICS:
+        raise argparse.ArgumentTypeError('unknown metric in budget %r' %
+                                         spec)
+    return mode, name, value
+
+def check_budgets(budgets, results, reference_results=None):
+
+    """ Check results against budgets and return a list of violation
+        messages.
+
+    """
+    violations = []
+    for budget_mode, name, limit in budgets:
+        for mode in MODES:
+            if budget_mode is not None and mode != budget_mode:
+                continue
+            if name.endswith('_ratio'):
+                metric = name[:-len('_ratio')]
+                if reference_results is None:
+                    continue
+                value = results[mode][metric]
+                reference_value = reference_results[mode][metric]
+                if value is None or not reference_value:
+                    continue
+                value = value / reference_value
+            else:
+                value = results[mode][name]
+                if value is None:
+                    continue
+            if value > limit:
+                violations.append('%s.%s = %.2f exceeds budget %.2f' % (
+                    mode, name, value, limit))
+    return violations
+
+def format_value(value, format='%.1f'):
+
+    if value is None:
+        return '-'
+    return format % value
+
+def print_results(all_results, reference=None):
+
+    reference_results = all_results.get(reference)
+    print('%-20s %-9s %9s %9s %7s %10s %8s %7s %8s' % (
+        'Runtime', 'Mode', 'Warm[ms]', 'Cold[ms]', 'vs.ref',
+        'RSS[kB]', 'MinFlt', 'MajFlt', 'Modules'))
+    for runtime, results in all_results.items():
+        name = os.path.basename(runtime)
+        for mode in MODES:
+            r = results[mode]
+            ratio = None
+            if reference_results is not None and runtime != reference:
+                ratio = r['wall_ms'] / reference_results[mode]['wall_ms']
+            print('%-20s %-9s %9s %9s %7s %10s %8s %7s %8s' % (
+                name[:20], mode,
+                format_value(r['wall_ms']),
+                format_value(r['cold_ms']),
+                format_value(ratio, '%.2f'),
+                format_value(r['maxrss_kb'], '%i'),
+                format_value(r['minflt'], '%i'),
+                format_value(r['majflt'], '%i'),
+                format_value(r['modules'], '%i')))
+        print('')
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup of pyrun runtimes.')
+    parser.add_argument('runtimes', nargs='+',
+                        help='runtimes to benchmark; budgets are checked '
+                        'for the first one, missing runtimes are skipped')
+    parser.add_argument('--reference', default=None,
+                        help='reference interpreter to compare against')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='number of warm runs per mode (default: 20)')
+    parser.add_argument('--cold-runs', type=int, default=3,
+                        help='number of cold runs per mode (default: 3)')
+    parser.add_argument('--budget', type=parse_budget, action='append',
+                        default=[],
+                        help='budget [mode.]metric=value to check')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this JSON file')
+    options = parser.parse_args()
+
+    runtimes = []
+    for runtime in options.runtimes:
+        if not os.path.exists(runtime):
+            print('Runtime %s not found. Skipping.' % runtime)
+            continue
+        runtimes.append(os.path.abspath(runtime))
+    if not runtimes:
+        print('No runtimes found.')
+        return 1
+    reference = options.reference
+    if reference is not None:
+        reference = shutil.which(reference) or reference
+
+    all_results = {}
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        if reference is not None:
+            runtimes.append(reference)
+        for i, runtime in enumerate(runtimes):
+            print('Benchmarking %s...' % runtime)
+            all_results[runtime] = benchmark(
+                runtime,
+                os.path.join(workdir, str(i)),
+                runs=options.runs,
+                cold_runs=options.cold_runs,
+                reference=(runtime == reference))
+    finally:
+        shutil.rmtree(workdir)
+    print('')
+    print_results(all_results, reference)
+
+    violations = check_budgets(options.budget,
+                               all_results[runtimes[0]],
+                               all_results.get(reference))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'reference': reference,
+                'results': all_results,
+                'budgets': [
+                    {'mode': mode, 'metric': name, 'limit': limit}
+                    for mode, name, limit in options.budget],
+                'violations': violations,
+                }, f, indent=2, sort_keys=True)
+    if violations:
+        print('Budget violations for %s:' % runtimes[0])
+        for violation in violations:
+            print('  %s' % violation)
+        return 1
+    return 0
+
+###
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli delta create/apply".
+#
+# Creates app binaries from the running interpreter binary (e.g. pyrun)
+# with an appended ZIP file, changes one module and checks that the
+# delta is small, that applying it results in the new binary and that
+# hash mismatches are detected.
+#
+# Usage: test_cli_delta.py [path to the cli/ dir]
+#
+
+import os, sys, json, random, shutil, zipfile, tempfile, subprocess
+
+from test_cli_install import CLI_DIR
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+# Maximum delta size for changing one module
+MAX_DELTA_SIZE = 16384
+
+def run_delta(*args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'delta'] + list(args) +
+        ['-q', '--json'],
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def make_app(path, modules):
+
+    with open(sys.executable, 'rb') as f:
+        runtime = f.read()
+    with open(path, 'wb') as f:
+        f.write(runtime)
+        with zipfile.ZipFile(f, 'a', zipfile.ZIP_DEFLATED) as app:
+            for name in sorted(modules):
+                app.writestr(name, modules[name])
+    os.chmod(path, 0o755)
+
+def read_file(path):
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 6):
+        print('pyrun_cli needs Python 3.6+. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        random.seed(42)
+        words = ['import', 'def', 'return', 'value', 'self', 'data', '=',
+                 'if', 'else', '(', ')', ':', '\n    ']
+        modules = {}
+        for i in range(100):
+            modules['app/module%i.py' % i] = ' '.join(
+                random.choice(words) for j in range(2000))
+        modules['__main__.py'] = 'import app\n'
+        old = os.path.join(tempdir, 'app-1')
+        make_app(old, modules)
+        modules['app/module42.py'] += '\nprint("changed")\n'
+        new = os.path.join(tempdir, 'app-2')
+        make_app(new, modules)
+
+        delta = os.path.join(tempdir, 'app.delta')
+        result = run_delta('create', old, new, delta)
+        assert result['size'] == os.path.getsize(delta)
+        assert result['size'] < MAX_DELTA_SIZE, result
+        assert 'zip:app/module42.py' in result['changed_segments'], result
+
+        # Apply the delta
+        output = os.path.join(tempdir, 'app-2.out')
+        result = run_delta('apply', old, delta, output,
+                           '--sha256', result['new_sha256'])
+        assert read_file(output) == read_file(new)
+        assert os.access(output, os.X_OK)
+
+        # Hash mismatches of the old file and the result are detected
+        os.remove(output)
+        for args in ((new, delta, output),
+                     (old, delta, output, '--sha256', '0' * 64)):
+            try:
+                run_delta('apply', *args)
+            except subprocess.CalledProcessError:
+                pass
+            else:
+                raise AssertionError('applying %r did not fail' % (args,))
+            assert not os.path.exists(output)
+
+        # Update in place
+        shutil.copy(old, output)
+        run_delta('apply', output, delta)
+        assert read_file(output) == read_file(new)
+    finally:
+        shutil.rmtree(tempdir)
+    print('Works.')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli env create/clone" using a local index directory
+# (offline).
+#
+# Creates two environments from the same files (the second one from
+# the stored template), clones one of them and checks that files are
+# shared via hard links and that scripts are relocated.
+#
+# Usage: test_cli_env.py [path to the cli/ dir]
+#
+
+import os, sys, json, shutil, tempfile, subprocess
+
+from test_cli_install import CLI_DIR, DISTRIBUTION, WHEEL, \
+     make_distribution, make_wheel
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+def run_env(*args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'env'] + list(args) +
+        ['-q', '--json'],
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def check_environment(target, reference):
+
+    executable = os.path.join(target, 'bin', 'pyrun')
+    for script in ('demo', 'demo-tool'):
+        with open(os.path.join(target, 'bin', script)) as f:
+            assert f.readline() == '#!%s\n' % executable
+    # Files are shared with the reference environment
+    for relpath in ('bin/pyrun3.12',
+                    'lib/python3.12/site-packages/demo_pkg/__init__.py'):
+        assert os.path.samefile(os.path.join(target, relpath),
+                                os.path.join(reference, relpath)), relpath
+    assert os.readlink(os.path.join(target, 'bin', 'pyrun')) == 'pyrun3.12'
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 6):
+        print('pyrun_cli needs Python 3.6+. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        index_dir = os.path.join(tempdir, 'index')
+        os.mkdir(index_dir)
+        make_distribution(os.path.join(index_dir, DISTRIBUTION))
+        make_wheel(os.path.join(index_dir, WHEEL))
+        options = ['--store', os.path.join(tempdir, 'store'),
+                   '--link', 'hardlink']
+        install_options = ['--cache', os.path.join(tempdir, 'cache'),
+                           '--index-dir', index_dir,
+                           '--offline',
+                           '--platform', 'linux-x86_64',
+                           '-m']
+        requirements = os.path.join(tempdir, 'requirements.txt')
+        with open(requirements, 'w') as f:
+            f.write('demo-pkg==1.0\n')
+        install_options += ['-r', requirements]
+
+        # Create two environments; the second one from the template
+        first = os.path.join(tempdir, 'first')
+        result = run_env('create', first, *(options + install_options))
+        assert result['methods']['relocated'] == 2, result
+        second = os.path.join(tempdir, 'second')
+        second_result = run_env('create', second,
+                                *(options + install_options))
+        assert second_result['template'] == result['template'], second_result
+        check_environment(second, first)
+
+        # Clone the second environment
+        third = os.path.join(tempdir, 'third')
+        result = run_env('clone', second, third, *options)
+        check_environment(third, first)
+
+        # Cloning into an existing environment fails
+        try:
+            run_env('clone', second, third, *options)
+        except subprocess.CalledProcessError:
+            pass
+        else:
+            raise AssertionError('clone into existing dir did not fail')
+    finally:
+        shutil.rmtree(tempdir)
+    print('Works.')
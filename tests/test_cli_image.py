@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli image".
+#
+# Builds an OCI image for the running interpreter binary (e.g. pyrun)
+# with an app script, checks the layout, config and layer contents and
+# that builds are reproducible.
+#
+# Usage: test_cli_image.py [path to the cli/ dir]
+#
+
+import os, sys, json, shutil, tarfile, tempfile, hashlib, subprocess
+
+from test_cli_install import CLI_DIR
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+def build_image(output, *args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'image', '-q', '--json',
+         output] + list(args),
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def file_hash(path):
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def read_blob(archive, digest):
+
+    return archive.extractfile(
+        'blobs/sha256/' + digest.split(':', 1)[1]).read()
+
+def read_config(path):
+
+    with tarfile.open(path) as archive:
+        index = json.loads(archive.extractfile('index.json').read())
+        manifest = json.loads(read_blob(archive,
+                                        index['manifests'][0]['digest']))
+        return json.loads(read_blob(archive, manifest['config']['digest']))
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 6):
+        print('pyrun_cli needs Python 3.6+. Skipping.')
+        sys.exit(0)
+    if not sys.platform.startswith('linux'):
+        print('pyrun_cli image only supports Linux. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        app = os.path.join(tempdir, 'app.py')
+        with open(app, 'w') as f:
+            f.write('print("Hello")\n')
+        options = ['--pyrun-binary', sys.executable,
+                   '--app', app,
+                   '--tag', 'test-app:1',
+                   '-e', 'APP_MODE=test',
+                   '--timestamp', '1700000000']
+        first = os.path.join(tempdir, 'first.tar')
+        result = build_image(first, *options)
+        assert [layer['name'] for layer in result['layers']] == [
+            'base', 'runtime', 'app'], result
+
+        # Builds are reproducible
+        second = os.path.join(tempdir, 'second.tar')
+        build_image(second, *options)
+        assert file_hash(first) == file_hash(second)
+
+        with tarfile.open(first) as archive:
+            names = archive.getnames()
+            for name in ('oci-layout', 'index.json', 'manifest.json'):
+                assert name in names, names
+            index = json.loads(archive.extractfile('index.json').read())
+            manifest_digest = index['manifests'][0]['digest']
+            assert manifest_digest == result['digest'], index
+            manifest = json.loads(read_blob(archive, manifest_digest))
+            config = json.loads(read_blob(archive,
+                                          manifest['config']['digest']))
+            assert config['config']['Entrypoint'] == [
+                '/opt/pyrun/bin/pyrun', '/app/app.py'], config
+            assert 'APP_MODE=test' in config['config']['Env'], config
+            assert config['created'] == '2023-11-14T22:13:20Z', config
+            assert len(config['rootfs']['diff_ids']) == 3, config
+
+            # Check the layer contents
+            layer_files = []
+            for layer in manifest['layers']:
+                blob = os.path.join(tempdir, 'layer.tar.gz')
+                with open(blob, 'wb') as f:
+                    f.write(read_blob(archive, layer['digest']))
+                with tarfile.open(blob) as layer_archive:
+                    members = layer_archive.getmembers()
+                    assert all(member.mtime == 1700000000 and
+                               member.uid == 0
+                               for member in members)
+                    layer_files.append([member.name for member in members])
+        base, runtime, app_layer = layer_files
+        assert 'etc/passwd' in base, base
+        assert 'app/app.py' in app_layer, app_layer
+        assert 'opt/pyrun/bin/pyrun' in runtime or \
+               'opt/pyrun/bin/%s' % os.path.basename(sys.executable) in \
+               runtime, runtime
+        with open(sys.executable, 'rb') as f:
+            interpreter_needed = b'ld-linux' in f.read()
+        if interpreter_needed:
+            assert [name for name in base if 'ld-linux' in name], base
+
+        # App directories are run via their __main__.py
+        app_dir = os.path.join(tempdir, 'appdir')
+        os.mkdir(app_dir)
+        with open(os.path.join(app_dir, 'helper.py'), 'w') as f:
+            f.write('print("Hello")\n')
+        options = ['--pyrun-binary', sys.executable,
+                   '--app', app_dir,
+                   '--timestamp', '1700000000']
+        image = os.path.join(tempdir, 'appdir.tar')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = CLI_DIR
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'pyrun_cli', 'image', '-q', image] +
+            options,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stdout_data, stderr_data = process.communicate()
+        assert process.returncode != 0
+        assert b'__main__.py' in stderr_data, stderr_data
+        with open(os.path.join(app_dir, '__main__.py'), 'w') as f:
+            f.write('import helper\n')
+        build_image(image, *options)
+        config = read_config(image)
+        assert config['config']['Entrypoint'] == [
+            '/opt/pyrun/bin/pyrun', '/app/appdir'], config
+    finally:
+        shutil.rmtree(tempdir)
+    print('Works.')
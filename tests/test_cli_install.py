@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli install" using a local index directory (offline).
+#
+# Creates a fake PyRun distribution and a wheel with a console script
+# and a .data/scripts/ entry, installs them twice (the second time only
+# from the cache) and checks the installation.
+#
+# Usage: test_cli_install.py [path to the cli/ dir]
+#
+
+import os, sys, json, io, shutil, tarfile, tempfile, zipfile, subprocess
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+CLI_DIR = os.path.abspath(
+    sys.argv[1] if len(sys.argv) > 1 else
+    os.path.join(os.path.dirname(__file__), '..', 'cli'))
+
+DISTRIBUTION = 'egenix-pyrun-2.6.0-py3.12_ucs4-linux-x86_64.tgz'
+WHEEL = 'demo_pkg-1.0-py3-none-any.whl'
+
+def make_distribution(path):
+
+    with tarfile.open(path, 'w:gz') as archive:
+        for name in ('bin', 'lib', 'lib/python3.12',
+                     'lib/python3.12/site-packages'):
+            info = tarfile.TarInfo('./' + name)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            archive.addfile(info)
+        data = b'#!/bin/sh\necho pyrun\n'
+        info = tarfile.TarInfo('./bin/pyrun3.12')
+        info.size = len(data)
+        info.mode = 0o755
+        archive.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('./bin/pyrun')
+        info.type = tarfile.SYMTYPE
+        info.linkname = 'pyrun3.12'
+        archive.addfile(info)
+
+def make_wheel(path):
+
+    with zipfile.ZipFile(path, 'w') as wheel:
+        wheel.writestr('demo_pkg/__init__.py', 'def main():\n    return 0\n')
+        wheel.writestr('demo_pkg-1.0.data/scripts/demo-tool',
+                       '#!python\nprint("demo")\n')
+        wheel.writestr('demo_pkg-1.0.dist-info/METADATA',
+                       'Metadata-Version: 2.1\nName: demo-pkg\n'
+                       'Version: 1.0\n')
+        wheel.writestr('demo_pkg-1.0.dist-info/WHEEL',
+                       'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n'
+                       'Tag: py3-none-any\n')
+        wheel.writestr('demo_pkg-1.0.dist-info/entry_points.txt',
+                       '[console_scripts]\ndemo = demo_pkg:main\n')
+        wheel.writestr('demo_pkg-1.0.dist-info/RECORD', '')
+
+def run_install(target, *args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'install', '-q', '--json',
+         '--offline', '--platform', 'linux-x86_64', '-m'] +
+        list(args) + [target],
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def check_installation(target):
+
+    site_packages = os.path.join(target, 'lib', 'python3.12',
+                                 'site-packages')
+    assert os.path.exists(os.path.join(site_packages, 'demo_pkg',
+                                       '__init__.py'))
+    dist_info = os.path.join(site_packages, 'demo_pkg-1.0.dist-info')
+    with open(os.path.join(dist_info, 'INSTALLER')) as f:
+        assert f.read().strip() == 'pyrun_cli'
+    with open(os.path.join(dist_info, 'RECORD')) as f:
+        record = f.read()
+    assert 'demo_pkg/__init__.py,sha256=' in record, record
+    executable = os.path.join(target, 'bin', 'pyrun')
+    for script in ('demo', 'demo-tool'):
+        path = os.path.join(target, 'bin', script)
+        assert os.access(path, os.X_OK), path
+        with open(path) as f:
+            assert f.readline() == '#!%s\n' % executable
+        assert '../../../bin/%s,sha256=' % script in record, record
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 6):
+        print('pyrun_cli needs Python 3.6+. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        index_dir = os.path.join(tempdir, 'index')
+        cache_dir = os.path.join(tempdir, 'cache')
+        os.mkdir(index_dir)
+        make_distribution(os.path.join(index_dir, DISTRIBUTION))
+        make_wheel(os.path.join(index_dir, WHEEL))
+        requirements = os.path.join(tempdir, 'requirements.txt')
+        with open(requirements, 'w') as f:
+            f.write('# pinned\ndemo-pkg==1.0\n')
+
+        # Install from the index directory
+        target = os.path.join(tempdir, 'first')
+        result = run_install(target,
+                             '--cache', cache_dir,
+                             '--index-dir', index_dir,
+                             '-r', requirements)
+        assert result['pyrun']['filename'] == DISTRIBUTION, result
+        assert [p['filename'] for p in result['packages']] == [WHEEL], result
+        check_installation(target)
+
+        # Install again, from the cache only
+        shutil.rmtree(index_dir)
+        target = os.path.join(tempdir, 'second')
+        result = run_install(target,
+                             '--cache', cache_dir,
+                             '-r', requirements)
+        assert result['packages'][0]['version'] == '1.0', result
+        check_installation(target)
+    finally:
+        shutil.rmtree(tempdir)
+    print('Works.')
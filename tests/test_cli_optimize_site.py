@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli optimize-site".
+#
+# Compiles the modules of a site-packages dir using the running
+# interpreter (e.g. pyrun) and checks that unchecked hash based .pyc
+# files are written for all optimization levels and used for imports,
+# also after stripping the sources.
+#
+# Usage: test_cli_optimize_site.py [path to the cli/ dir]
+#
+
+import os, sys, json, shutil, tempfile, subprocess
+
+from test_cli_install import CLI_DIR
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+def optimize_site(*args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'optimize-site'] + list(args) +
+        ['-q', '--json'],
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def import_value(site_packages, module, *options):
+
+    output = subprocess.check_output(
+        [sys.executable] + list(options) +
+        ['-c',
+         'import sys; sys.path.insert(0, %r); import %s; print(%s.VALUE)' %
+         (site_packages, module, module)])
+    return output.decode('ascii').strip()
+
+def write_file(path, text):
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 7):
+        print('Hash based .pyc files need Python 3.7+. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        libversion = '%i.%i' % sys.version_info[:2]
+        site_packages = os.path.join(tempdir, 'lib', 'python' + libversion,
+                                     'site-packages')
+        os.makedirs(os.path.join(tempdir, 'bin'))
+        os.symlink(sys.executable, os.path.join(tempdir, 'bin', 'pyrun'))
+        write_file(os.path.join(site_packages, 'top.py'), 'VALUE = 1\n')
+        write_file(os.path.join(site_packages, 'demo', '__init__.py'),
+                   'VALUE = "debug" if __debug__ else "optimized"\n')
+        write_file(os.path.join(site_packages, 'demo', 'data', 'config.py'),
+                   'VALUE = 2\n')
+
+        result = optimize_site(tempdir)
+        assert result['modules'] == 3, result
+        assert result['pyc_files'] == 9, result
+        cache_tag = sys.implementation.cache_tag
+        for suffix in ('', '.opt-1', '.opt-2'):
+            pyc = os.path.join(site_packages, '__pycache__',
+                               'top.%s%s.pyc' % (cache_tag, suffix))
+            with open(pyc, 'rb') as f:
+                # Flags: hash based, don't check the source
+                assert f.read(8)[4:] == b'\x01\x00\x00\x00', pyc
+
+        # The .pyc files are used without checking the sources
+        write_file(os.path.join(site_packages, 'top.py'), 'VALUE = 3\n')
+        assert import_value(site_packages, 'top') == '1'
+        assert import_value(site_packages, 'demo', '-O') == 'optimized'
+
+        # Strip the sources
+        result = optimize_site(site_packages, '--strip-sources',
+                               '--keep-source', 'demo/data/*')
+        assert result['stripped'] == 2, result
+        assert not os.path.exists(os.path.join(site_packages, 'top.py'))
+        assert os.path.exists(os.path.join(site_packages, 'top.pyc'))
+        assert not os.path.exists(os.path.join(site_packages, '__pycache__'))
+        assert os.path.exists(os.path.join(site_packages, 'demo', 'data',
+                                           'config.py'))
+        assert import_value(site_packages, 'top') == '3'
+        assert import_value(site_packages, 'demo.data.config') == '2'
+    finally:
+        shutil.rmtree(tempdir)
+    print('Works.')
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Test "pyrun_cli pycache".
+#
+# Fills a bytecode cache dir for an app using the running interpreter
+# (e.g. pyrun) and checks the cache layout, path mapping and that the
+# cached .pyc files are used when running the app with a read-only
+# cache (via PYRUN_PYCACHE for pyrun).
+#
+# Usage: test_cli_pycache.py [path to the cli/ dir]
+#
+
+import os, sys, json, shutil, tempfile, subprocess
+
+from test_cli_install import CLI_DIR
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+def fill_pycache(*args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = CLI_DIR
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'pyrun_cli', 'pycache'] + list(args) +
+        ['--python', sys.executable, '-q', '--json'],
+        env=env)
+    return json.loads(output.decode('utf-8'))
+
+def cache_files(directory):
+
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(dirpath, filename),
+                                         directory))
+    return sorted(files)
+
+def write_file(path, text):
+
+    with open(path, 'w') as f:
+        f.write(text)
+
+###
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 8):
+        print('Bytecode cache dirs need Python 3.8+. Skipping.')
+        sys.exit(0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        app = os.path.join(tempdir, 'app')
+        os.mkdir(app)
+        write_file(os.path.join(app, 'main.py'),
+                   'import helper\nprint(helper.VALUE)\n')
+        write_file(os.path.join(app, 'helper.py'), 'VALUE = "helper"\n')
+        cache_tag = sys.implementation.cache_tag
+
+        # Fill the cache for the paths used in an image
+        mapped = os.path.join(tempdir, 'mapped')
+        result = fill_pycache(mapped, '--app', app, '--map', app + '=/app',
+                              '-O', '0')
+        assert result['modules'] == 2, result
+        assert cache_files(mapped) == [
+            'app/helper.%s.pyc' % cache_tag,
+            'app/main.%s.pyc' % cache_tag], cache_files(mapped)
+        with open(os.path.join(mapped, 'app',
+                               'helper.%s.pyc' % cache_tag), 'rb') as f:
+            # Flags: hash based, check the source
+            assert f.read(8)[4:] == b'\x03\x00\x00\x00'
+
+        # Fill the cache for the local paths and run the app
+        cache = os.path.join(tempdir, 'cache')
+        result = fill_pycache(cache, '--app', app)
+        assert result['pyc_files'] == 6, result
+        files = cache_files(cache)
+        for dirpath, dirnames, filenames in os.walk(cache):
+            os.chmod(dirpath, 0o555)
+        env = dict(os.environ)
+        if hasattr(sys, 'pyrun'):
+            env['PYRUN_PYCACHE'] = cache
+        else:
+            env['PYTHONPYCACHEPREFIX'] = cache
+        output = subprocess.check_output(
+            [sys.executable, '-v', os.path.join(app, 'main.py')],
+            env=env, stderr=subprocess.STDOUT).decode('utf-8')
+        assert 'helper\n' in output, output
+        helper_pyc = os.path.join(cache, app.lstrip(os.sep),
+                                  'helper.%s.pyc' % cache_tag)
+        assert ('code object from %r' % helper_pyc) in output, output
+        if hasattr(sys, 'pyrun'):
+            # pyrun also uses the cache for the main script
+            main_pyc = os.path.join(cache, app.lstrip(os.sep),
+                                    'main.%s.pyc' % cache_tag)
+            assert ('code object from %r' % main_pyc) in output, output
+        assert cache_files(cache) == files
+        assert not os.path.exists(os.path.join(app, '__pycache__'))
+    finally:
+        for dirpath, dirnames, filenames in os.walk(tempdir):
+            os.chmod(dirpath, 0o755)
+        shutil.rmtree(tempdir)
+    print('Works.')
@@ -332,6 +332,44 @@ def test_c_flag(runtime=PYRUN):
     assert '-c' in result
     assert '-n' in result
 
+def test_b_flag(runtime=PYRUN):
+
+    os.chdir(TESTDIR)
+
+    import tempfile
+    tempdir = tempfile.mkdtemp()
+    try:
+        pyc_file = os.path.join(tempdir, 'showargv.pyc')
+        hash_pyc_file = os.path.join(tempdir, 'showargv_hash.pyc')
+        run('%s -c "import py_compile; '
+            'py_compile.compile(\'showargv.py\', cfile=\'%s\')"' %
+            (runtime, pyc_file))
+        assert os.path.exists(pyc_file)
+
+        result = run('%s -b %s x' % (runtime, pyc_file))
+        assert "sys.argv: ['%s', 'x']" % pyc_file in result, result
+
+        # Bytecode from stdin
+        result = run('%s -b - x < %s' % (runtime, pyc_file))
+        assert "sys.argv: ['-c', 'x']" in result, result
+
+        # Hash based .pyc files (PEP 552)
+        version = tuple(int(x) for x in python_version(runtime).split('.')[:2])
+        if version >= (3, 7):
+            run('%s -c "import py_compile; '
+                'py_compile.compile(\'showargv.py\', cfile=\'%s\', '
+                'invalidation_mode=py_compile.PycInvalidationMode.'
+                'CHECKED_HASH)"' %
+                (runtime, hash_pyc_file))
+            result = run('%s -b %s y' % (runtime, hash_pyc_file))
+            assert "sys.argv: ['%s', 'y']" % hash_pyc_file in result, result
+
+        # Invalid bytecode
+        result = run('%s -b showargv.py' % runtime)
+        assert 'Incompatible bytecode file' in result, result
+    finally:
+        shutil.rmtree(tempdir)
+
 def test_s_flag(runtime=PYRUN):
 
     os.chdir(TESTDIR)
@@ -377,6 +415,176 @@ def test_P_flag(runtime=PYRUN):
         runtime).strip()
     assert result != cwd, (result, cwd)
 
+def test_n_p_flags(runtime=PYRUN):
+
+    if python_version(runtime) < '3':
+        # Line processing mode is not supported in Python 2
+        return
+    os.chdir(TESTDIR)
+
+    result = run(
+        'printf "a 1\\nb 2\\nc 3" | '
+        '%s -n -c "print(NR, line.upper())"' %
+        runtime)
+    assert result == '1 A 1\n2 B 2\n3 C 3\n', repr(result)
+
+    result = run(
+        'printf "a 1\\nb 2\\n" | '
+        '%s -p -c "line = line[::-1]"' %
+        runtime)
+    assert result == '1 a\n2 b\n', repr(result)
+
+    result = run(
+        'printf "a:1\\nb:2\\nc:3\\n" | '
+        '%s -n -F : --begin "total = 0" --end "print(total)" '
+        '"total += int(F[1])"' %
+        runtime)
+    assert result == '6\n', repr(result)
+
+    # Input files given as parameters
+    result = run(
+        '%s -n -F " " -c "print(len(F))" showargv.py showargv.py' %
+        runtime)
+    lines = result.splitlines()
+    assert len(lines) > 2 and lines[:len(lines) // 2] == lines[len(lines) // 2:]
+
+    # The code is used as is: multi-line strings are not reindented
+    result = run(
+        'printf "a\\nb\\n" | '
+        '%s -n -c \'if NR == 1:\n'
+        '    s = """x\n'
+        'y"""\n'
+        '    print(repr(s))\n'
+        'else:\n'
+        '    continue\n'
+        'print(line)\'' %
+        runtime)
+    assert result == "'x\\ny'\na\n", repr(result)
+
+def test_batch(runtime=PYRUN):
+
+    if python_version(runtime) < '3':
+        # Batch mode is not supported in Python 2
+        return
+    os.chdir(TESTDIR)
+
+    import json
+    jobs = [
+        {'argv': ['showargv.py', 'a', 'b']},
+        {'argv': ['-c', 'import os, sys; x = 1; '
+                        'print(os.environ["BATCHVAR"], sys.stdin.read())'],
+         'env': {'BATCHVAR': 'value'},
+         'stdin': 'input'},
+        # Fresh namespace and environment for each job
+        {'argv': ['-c', 'import os; print("x" in globals(), '
+                        'os.environ.get("BATCHVAR"))']},
+        {'argv': ['-c', 'import sys; sys.stderr.write("error"); '
+                        'sys.exit(3)']},
+        {'argv': ['-m', 'showargv', 'c'], 'cwd': TESTDIR},
+        # Binary output
+        {'argv': ['-c', 'import sys; sys.stdout.write("text "); '
+                        'sys.stdout.flush(); '
+                        'sys.stdout.buffer.write(b"bytes\\n")']},
+        # Interrupts stop the batch after writing the job result
+        {'argv': ['-c', 'print("before"); raise KeyboardInterrupt']},
+        {'argv': ['-c', 'print("not run")']},
+        ]
+    pipe = subprocess.Popen([runtime, '--batch', '-'],
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+    stdout_data, stderr_data = pipe.communicate(
+        '\n'.join(json.dumps(job) for job in jobs).encode('utf-8'))
+    assert pipe.returncode == 130
+    results = [json.loads(line) for line in stdout_data.splitlines()]
+    assert len(results) == len(jobs) - 1
+    assert [result['exit_code'] for result in results] == [
+        0, 0, 0, 3, 0, 0, 130]
+    assert [result['interrupted'] for result in results] == [
+        False] * 6 + [True]
+    assert "'a', 'b'" in results[0]['stdout']
+    assert results[1]['stdout'] == 'value input\n'
+    assert results[2]['stdout'] == 'False None\n'
+    assert results[3]['stderr'] == 'error'
+    assert "'c'" in results[4]['stdout']
+    assert results[5]['stdout'] == 'text bytes\n'
+    assert results[6]['stdout'] == 'before\n'
+    assert 'KeyboardInterrupt' in results[6]['stderr']
+
+def is_pyrun(runtime):
+
+    return run('%s -c "import sys; print(hasattr(sys, \'pyrun\'))"' %
+               runtime).strip() == 'True'
+
+def test_multi_app(runtime=PYRUN):
+
+    os.chdir(TESTDIR)
+
+    if not is_pyrun(runtime):
+        # App mode is only available for pyrun
+        return
+
+    import tempfile, zipfile
+    tempdir = tempfile.mkdtemp()
+    try:
+        # Create a multi-app binary
+        app = os.path.join(tempdir, 'toolbox')
+        shutil.copy(runtime, app)
+        with zipfile.ZipFile(app, 'a') as zip_file:
+            zip_file.writestr('__main__.py',
+                              'print("toolbox main")\n')
+            zip_file.writestr('pyrun_apps/__init__.py', '')
+            zip_file.writestr('pyrun_apps/hello_tool.py',
+                              'print("hello tool")\n')
+            zip_file.writestr('pyrun_apps/other/__init__.py', '')
+            zip_file.writestr('pyrun_apps/other/__main__.py',
+                              'import sys; print("other %s" % sys.argv[1:])\n')
+        for name in ('hello-tool', 'other', 'unknown'):
+            os.symlink('toolbox', os.path.join(tempdir, name))
+
+        result = run(app)
+        assert match_result(result, 'toolbox main\n')
+        result = run(os.path.join(tempdir, 'hello-tool'))
+        assert match_result(result, 'hello tool\n')
+        result = run('%s -x' % os.path.join(tempdir, 'other'))
+        assert match_result(result, r"other \['-x'\]\n")
+        result = run(os.path.join(tempdir, 'unknown'))
+        assert match_result(result, 'toolbox main\n')
+    finally:
+        shutil.rmtree(tempdir)
+
+def test_pycache_env(runtime=PYRUN):
+
+    if not is_pyrun(runtime):
+        # PYRUN_PYCACHE is only available for pyrun
+        return
+    version = tuple(int(x) for x in python_version(runtime).split('.')[:2])
+    if version < (3, 8):
+        # sys.pycache_prefix is only available in Python 3.8+
+        return
+
+    import tempfile
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = os.path.join(tempdir, 'cache')
+        script = os.path.join(tempdir, 'script.py')
+        with open(os.path.join(tempdir, 'cachedmod.py'), 'w') as f:
+            f.write('VALUE = "cached"\n')
+        with open(script, 'w') as f:
+            f.write('import sys, cachedmod\n'
+                    'print(cachedmod.VALUE, sys.pycache_prefix)\n')
+        result = run('PYRUN_PYCACHE=%s %s %s' % (cache, runtime, script))
+        assert match_result(result, 'cached %s\n' % re.escape(cache))
+
+        # The .pyc files of the module and the script are written to
+        # the cache dir
+        cached = []
+        for dirpath, dirnames, filenames in os.walk(cache):
+            cached.extend(filename.split('.')[0] for filename in filenames)
+        assert sorted(cached) == ['cachedmod', 'script'], cached
+        assert not os.path.exists(os.path.join(tempdir, '__pycache__'))
+    finally:
+        shutil.rmtree(tempdir)
+
 ###
 
 if __name__ == '__main__':
@@ -396,8 +604,13 @@ if __name__ == '__main__':
     test_W_flag(runtime)
     test_m_flag(runtime)
     test_c_flag(runtime)
+    test_b_flag(runtime)
     test_E_flag(runtime)
     test_I_flag(runtime)
     test_s_flag(runtime)
     test_P_flag(runtime)
+    test_n_p_flags(runtime)
+    test_batch(runtime)
+    test_multi_app(runtime)
+    test_pycache_env(runtime)
     print('%s passes all command line tests' % runtime)
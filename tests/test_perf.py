@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Test the Linux perf support of pyrun (PYRUN_PERF=1).
+#
+# Records perf samples of a pyrun process running stdlib code and checks
+# that Python functions of frozen modules are resolved to the stdlib
+# source paths.
+#
+# Note: This test only works on Linux with Python 3.12+ and needs the
+# perf tool. It is skipped otherwise.
+#
+
+import os, sys, subprocess, shutil, tempfile
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+# Workload using frozen stdlib modules
+WORKLOAD = """\
+import json, os
+data = json.dumps([{'a': i, 'b': [str(i)] * 10} for i in range(2000)])
+for i in range(50):
+    json.loads(data)
+print(os.getpid())
+"""
+
+# Check for perf trampoline support (Python 3.12+ on Linux) of the
+# runtime under test
+PERF_SUPPORT_CODE = """\
+import sys
+print(hasattr(sys, 'activate_stack_trampoline'))
+"""
+
+def has_perf_support(runtime):
+
+    output = subprocess.check_output([runtime, '-c', PERF_SUPPORT_CODE])
+    return output.decode('ascii').strip() == 'True'
+
+def run_runtime(runtime, env, perf_data=None):
+
+    command = [runtime, '-c', WORKLOAD]
+    if perf_data is not None:
+        command = ['perf', 'record', '-F', '999', '-g', '-q',
+                   '-o', perf_data, '--'] + command
+    output = subprocess.check_output(command, env=env)
+    return int(output.decode('ascii').split()[-1])
+
+def test_perf_map(runtime):
+
+    env = dict(os.environ, PYRUN_PERF='1')
+    pid = run_runtime(runtime, env)
+    perf_map = '/tmp/perf-%i.map' % pid
+    try:
+        with open(perf_map) as f:
+            entries = f.read()
+    finally:
+        if os.path.exists(perf_map):
+            os.remove(perf_map)
+    assert 'py::' in entries
+    assert '<pyrun>/' not in entries
+    assert 'py::loads:' in entries and 'json' in entries
+
+def test_perf_record(runtime):
+
+    if shutil.which('perf') is None:
+        print('perf not found. Skipping perf record test.')
+        return
+    tempdir = tempfile.mkdtemp()
+    try:
+        perf_data = os.path.join(tempdir, 'perf.data')
+        env = dict(os.environ, PYRUN_PERF='1')
+        pid = run_runtime(runtime, env, perf_data)
+        output = subprocess.check_output(
+            ['perf', 'script', '-i', perf_data],
+            stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+        os.remove('/tmp/perf-%i.map' % pid)
+        assert 'py::' in output
+        assert '<pyrun>/' not in output
+    finally:
+        shutil.rmtree(tempdir)
+
+###
+
+if __name__ == '__main__':
+    try:
+        runtime = sys.argv[1]
+    except IndexError:
+        runtime = sys.executable
+    if not sys.platform.startswith('linux') or not has_perf_support(runtime):
+        print('perf support needs Python 3.12+ on Linux. Skipping.')
+        sys.exit(0)
+    print('Testing perf support of %s' % runtime)
+    test_perf_map(runtime)
+    test_perf_record(runtime)
+    print('Works.')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Test the pyrun subinterpreter pool (Python 3.12+ only).
+#
+
+import sys, os, time, subprocess
+
+# Double check that asserts work
+try:
+    assert False
+except AssertionError:
+    pass
+else:
+    raise RuntimeError('asserts are disabled - cannot run tests')
+
+if sys.version_info < (3, 12):
+    print('Subinterpreter pool needs Python 3.12+. Skipping.')
+    sys.exit(0)
+
+import math, operator
+from pyrun_pool import InterpreterPool
+
+def test_results():
+
+    with InterpreterPool(4) as pool:
+        future = pool.submit(operator.add, 1, 2)
+        assert future.result() == 3
+        results = list(pool.map(math.factorial, range(100)))
+        assert results == [math.factorial(i) for i in range(100)]
+
+def test_exceptions():
+
+    with InterpreterPool(2) as pool:
+        future = pool.submit(operator.truediv, 1, 0)
+        try:
+            future.result()
+        except ZeroDivisionError:
+            pass
+        else:
+            raise AssertionError('exception not passed on')
+        # The worker must still be usable afterwards
+        assert pool.submit(operator.mul, 6, 7).result() == 42
+
+def test_shutdown():
+
+    pool = InterpreterPool(2)
+    pool.shutdown()
+    try:
+        pool.submit(operator.add, 1, 2)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('submit() works after shutdown()')
+
+def test_exit_without_shutdown():
+
+    # The pool must be shut down at exit, since the interpreter cannot
+    # be finalized with running subinterpreters
+    code = (
+        'import sys, operator; sys.path[:0] = %r\n'
+        'from pyrun_pool import InterpreterPool\n'
+        'pool = InterpreterPool(2)\n'
+        'print(pool.submit(operator.add, 1, 2).result())\n'
+        'pool.submit(sum, range(100000))\n' % sys.path)
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output = result.stdout.decode('utf-8', 'replace')
+    assert result.returncode == 0, (result.returncode, output)
+    assert output == '3\n', output
+
+def test_parallel():
+
+    # CPU bound work should scale across cores
+    workers = min(4, os.cpu_count() or 1)
+    if workers < 2:
+        print('Only one CPU available. Skipping parallel test.')
+        return
+    n = 4000000
+    with InterpreterPool(workers) as pool:
+        # Warm up the subinterpreters
+        list(pool.map(abs, range(workers)))
+        # Use the best of a few rounds to reduce timing noise
+        single = parallel = None
+        for i in range(3):
+            start = time.perf_counter()
+            pool.submit(sum, range(n)).result()
+            elapsed = time.perf_counter() - start
+            if single is None or elapsed < single:
+                single = elapsed
+            start = time.perf_counter()
+            list(pool.map(sum, [range(n)] * workers))
+            elapsed = time.perf_counter() - start
+            if parallel is None or elapsed < parallel:
+                parallel = elapsed
+    print('1 task: %.3f sec, %i tasks in parallel: %.3f sec' % (
+        single, workers, parallel))
+    # Running the tasks one after the other would take
+    # single * workers; allow for some overhead
+    assert parallel < single * workers * 0.75, (single, workers, parallel)
+
+###
+
+if __name__ == '__main__':
+    print('Testing pyrun subinterpreter pool')
+    test_results()
+    test_exceptions()
+    test_shutdown()
+    test_exit_without_shutdown()
+    test_parallel()
+    print('Works.')